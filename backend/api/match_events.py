@@ -0,0 +1,94 @@
+# api/match_events.py
+import asyncio
+import json
+import threading
+from typing import Dict, Set
+
+# Events buffered per connection before the slowest clients start dropping them
+QUEUE_SIZE = 16
+# Comment line sent on idle connections so proxies keep them open
+HEARTBEAT_SECONDS = 25
+
+
+class MatchEventHub:
+    """
+    In-process fan-out of match events to Server-Sent Events connections.
+
+    Each open connection is one small asyncio.Queue registered under its uid, so
+    idle connections cost a queue and a suspended generator, not a thread.
+    Publishing is safe from the sync route threadpool: events are handed to the
+    event loop with call_soon_threadsafe. Connections are per worker process,
+    so with several workers a client only hears about matches recorded by the
+    worker it is connected to.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop = None
+
+    def subscribe(self, uid: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.setdefault(uid, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, uid: str, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(uid)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[uid]
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def _deliver(self, uid: str, event: dict):
+        with self._lock:
+            queues = list(self._subscribers.get(uid, ()))
+        for queue in queues:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # Client is not reading; it can resync from /matching/matches
+
+    def publish(self, uid: str, event: dict):
+        """
+        Send event to every connection of uid. Callable from any thread.
+        """
+        with self._lock:
+            loop = self._loop
+            listening = uid in self._subscribers
+        if loop is None or not listening or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._deliver, uid, event)
+
+
+hub = MatchEventHub()
+
+
+def format_sse(event: dict, event_type: str = "match") -> str:
+    return f"event: {event_type}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+async def event_stream(uid: str, request):
+    """
+    SSE body for one client: queued events as they arrive, heartbeats otherwise
+    """
+    queue = hub.subscribe(uid)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": heartbeat\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        hub.unsubscribe(uid, queue)
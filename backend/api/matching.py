@@ -1,10 +1,13 @@
 # Completely rewrite logic
 
 # routers/matching.py
-from fastapi import APIRouter, HTTPException, status, Query
-from typing import List
-from database.utils import user_repo, matching_repo
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timezone
+from typing import List, Optional
+from database.utils import user_repo, matching_repo, match_pagination, profile_enrichment
 from database.schema import models
+from api import match_events
 
 router = APIRouter(prefix="/matching", tags=["matching"])
 
@@ -30,55 +33,64 @@ def get_user_profile(uid: str):
 @router.get("/candidates", response_model=models.MatchResponse)
 def get_match_candidates(
     current_uid: str = Query(..., description="Current user ID"),
-    limit: int = Query(10, ge=1, le=50, description="Number of candidates per page")
+    limit: int = Query(10, ge=1, le=50, description="Number of candidates per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
-    candidates_data = matching_repo.get_user_recommendations(current_uid, limit)
-    candidates = []
-    for candidate in candidates_data:
-        similarity = candidate.get("similarity_score", 0.0)
-        favorite_genres = user_repo.get_user_favorite_genres(candidate['uid'])
-        top_artists = user_repo.get_user_top_artists(candidate['uid'])
-        current_genres = set(user_repo.get_user_favorite_genres(current_uid))
-        candidate_genres = set(favorite_genres)
-        common_genres = len(current_genres.intersection(candidate_genres))
-        # Calculate common songs
-        common_songs_sql = """
-        SELECT COUNT(DISTINCT uta1.sid) as common_songs
-        FROM user_track_actions uta1
-        JOIN user_track_actions uta2 ON uta1.sid = uta2.sid
-        WHERE uta1.uid = :user1_id AND uta2.uid = :user2_id
-        """
-        common_songs_result = user_repo.run(common_songs_sql, {
-            "user1_id": current_uid,
-            "user2_id": candidate['uid']
-        }, fetchone=True)
-        common_songs = common_songs_result['common_songs'] if common_songs_result else 0
-        candidates.append({
+    try:
+        page = match_pagination.get_candidate_page(current_uid, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    candidates_data = page["candidates"]
+    # Genres, artists and common counts for the whole page in a constant number of queries
+    profile_enrichment.enrich_users(current_uid, candidates_data)
+    candidates = [
+        {
             "uid": candidate['uid'],
             "username": candidate['username'],
             "name": candidate['name'],
             "age": candidate['age'],
             "country": candidate['country'],
-            "favorite_genres": favorite_genres,
-            "top_artists": top_artists,
-            "similarity_score": similarity,
-            "common_genres": common_genres,
-            "common_songs": common_songs
-        })
+            "favorite_genres": candidate['favorite_genres'],
+            "top_artists": candidate['top_artists'],
+            "similarity_score": candidate.get("similarity_score", 0.0),
+            "common_genres": candidate['common_genres'],
+            "common_songs": candidate['common_songs']
+        }
+        for candidate in candidates_data
+    ]
     return {
         "candidates": candidates,
-        "total_candidates": len(candidates),
-        "current_page": 1,
-        "total_pages": 1
+        "total_candidates": page["total_candidates"],
+        "current_page": page["current_page"],
+        "total_pages": page["total_pages"],
+        "next_cursor": page["next_cursor"]
     }
 
 @router.post("/like", response_model=dict)
-def like_user(match: models.UserMatchCreate):
+def like_user(match: models.UserMatchCreate, background_tasks: BackgroundTasks):
     print(f"Like request received: {match}")
-    success = matching_repo.create_user_match(match)
-    if not success:
+    result = matching_repo.create_user_match(match)
+    if result is None:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to create match")
-    return {"message": "Like recorded successfully"}
+    if result["new_match"]:
+        # Push to both users' open /matching/events streams instead of waiting for a poll
+        matched_at = datetime.now(timezone.utc).isoformat()
+        match_events.hub.publish(match.user1_id, {"type": "match", "uid": match.user2_id, "matched_at": matched_at})
+        match_events.hub.publish(match.user2_id, {"type": "match", "uid": match.user1_id, "matched_at": matched_at})
+    # Similarity is not needed to record the like, compute it after responding
+    background_tasks.add_task(matching_repo.refresh_match_similarity, match.user1_id, match.user2_id)
+    return {"message": "Like recorded successfully", "matched": result["matched"]}
+
+@router.get("/events/{uid}")
+async def match_event_stream(uid: str, request: Request):
+    """
+    Server-Sent Events stream of new mutual matches for uid
+    """
+    return StreamingResponse(
+        match_events.event_stream(uid, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/matches/{uid}", response_model=List[dict])
 def get_user_matches(uid: str):
@@ -1,6 +1,6 @@
 # playlist.py
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Query
 from database.utils import playlist_repo
 from database.schema import models
 from typing import List
@@ -29,6 +29,12 @@ def get_playlists(uid: str):
     rows = playlist_repo.get_playlists_by_uid(uid)
     return rows  # Already list of dicts
 
+# Recommend public playlists matching a user's taste
+@router.get("/recommendations/{uid}", response_model=List[dict])
+def get_playlist_recommendations(uid: str, limit: int = Query(10, ge=1, le=50)):
+    rows = playlist_repo.get_recommended_playlists(uid, limit)
+    return rows
+
 # Get single playlist by pid
 @router.get("/{pid}", response_model=models.Playlist)
 def get_playlist(pid: str):
@@ -1,12 +1,16 @@
 # routers/songs.py
-from fastapi import APIRouter, HTTPException, status, Query
-from database.utils import song_repo
+from fastapi import APIRouter, HTTPException, Response, status, Query
+from fastapi.responses import StreamingResponse
+from database.utils import song_autocomplete, song_recommender, song_repo
 from database.schema import models
 from typing import List, Optional
+import json
 
 
 router = APIRouter(prefix="/songs", tags=["songs"])
 
+MAX_BATCH_SIDS = 500
+
 # fetch all songs
 @router.get("/fetch_all", response_model=list[models.SongRead])
 def fetch_all_songs():
@@ -29,13 +33,67 @@ def fetch_all_songs():
     ]
 
 
+# stream the whole catalog for full syncs
+@router.get("/fetch_all/stream")
+def stream_all_songs(format: str = Query("ndjson", description="ndjson or json (one array)")):
+    """
+    Same rows as /songs/fetch_all, sent as they are read from a server-side cursor.
+    Memory stays constant and the first rows go out immediately.
+    """
+    if format not in ("ndjson", "json"):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "format must be ndjson or json")
+
+    def song_lines():
+        for row in song_repo.iter_all_songs():
+            yield json.dumps({
+                "sid": row["sid"],
+                "name": row["name"],
+                "genre": row["genre"] or "",
+                "artist": row["artist"],
+                "duration": row["duration"],
+                "audio_path": row["audio_path"],
+                "audio_download_path": row["audio_download_path"]
+            })
+
+    def ndjson():
+        for line in song_lines():
+            yield line + "\n"
+
+    def json_array():
+        yield "["
+        for i, line in enumerate(song_lines()):
+            yield line if i == 0 else "," + line
+        yield "]"
+
+    if format == "json":
+        return StreamingResponse(json_array(), media_type="application/json")
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
 @router.get("/fetch_paginated", response_model=List[models.SongRead])
 def fetch_paginated_filtered(
+    response: Response,
     page: int = Query(1),
     page_size: int = Query(10),
-    search: Optional[str] = Query(None)
+    search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page; replaces page"),
+    after_sid: Optional[str] = Query(None, description="Unfiltered listing: start after this sid"),
+    fuzzy: bool = Query(False, description="Typo-tolerant trigram matching on name and artist")
 ):
-    rows = song_repo.get_song_paginated_filtered(page, page_size, search)
+    next_cursor = None
+    if page == 1 or cursor is not None or after_sid is not None:
+        # Keyset mode: the next page's cursor comes back in the X-Next-Cursor header
+        try:
+            position = song_repo.decode_song_cursor(cursor) if cursor else None
+            if position is None and after_sid is not None:
+                position = {"sid": after_sid, "score": None}
+            rows, next_cursor = song_repo.get_song_page_keyset(page_size, search, position, fuzzy)
+        except ValueError as e:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    else:
+        rows = song_repo.get_song_paginated_filtered(page, page_size, search, fuzzy)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [
         {
             "sid": row["sid"],
@@ -50,17 +108,36 @@ def fetch_paginated_filtered(
     ]
 
 
+@router.get("/autocomplete", response_model=List[models.SongCompletion])
+def autocomplete(
+    q: str = Query(..., description="What the user has typed so far"),
+    limit: int = Query(song_autocomplete.TOP_K, ge=1, le=song_autocomplete.TOP_K)
+):
+    """Most played song and artist names starting with q, for the search box"""
+    return song_autocomplete.complete(q, limit)
+
 @router.get("/by_genre", response_model=List[models.SongRead])
-def get_by_genre(genre: str = Query(..., description="e.g. pop")):
+def get_by_genre(
+    genre: str = Query(..., description="e.g. pop"),
+    sample: Optional[int] = Query(None, ge=1, le=100, description="Return this many popular songs of exactly this genre, at random")
+):
+    if sample is not None:
+        return song_repo.sample_by_genre(genre, sample)
     return song_repo.search_by_genre(genre)
 
 @router.get("/by_artist", response_model=List[models.SongRead])
-def get_by_artist(artist: str = Query(...)):
-    return song_repo.search_by_artist(artist)
+def get_by_artist(
+    artist: str = Query(...),
+    fuzzy: bool = Query(False),
+    sample: Optional[int] = Query(None, ge=1, le=100, description="Return this many popular songs of exactly this artist, at random")
+):
+    if sample is not None:
+        return song_repo.sample_by_artist(artist, sample)
+    return song_repo.search_by_artist(artist, fuzzy)
 
 @router.get("/by_name", response_model=List[models.SongRead])
-def get_by_name(name: str = Query(...)):
-    return song_repo.search_by_name(name)
+def get_by_name(name: str = Query(...), fuzzy: bool = Query(False)):
+    return song_repo.search_by_name(name, fuzzy)
 
 @router.get("/by_duration", response_model=List[models.SongRead])
 def get_by_duration(
@@ -73,11 +150,40 @@ def get_by_duration(
 def fetch_song(sid: str):
     return song_repo.search_by_sid(sid)[0]
 
+@router.post("/batch", response_model=models.SongBatchResponse)
+def fetch_songs_batch(request: models.SongBatchRequest):
+    """Resolve up to MAX_BATCH_SIDS songs in one round trip, keeping the requested order"""
+    if len(request.sids) > MAX_BATCH_SIDS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"At most {MAX_BATCH_SIDS} sids per request")
+    rows, missing = song_repo.get_songs_by_sids(request.sids)
+    return {
+        "songs": [
+            {
+                "sid": row["sid"],
+                "name": row["name"],
+                "genre": row["genre"] or "",
+                "artist": row["artist"],
+                "duration": row["duration"],
+                "audio_path": row["audio_path"],
+                "audio_download_path": row["audio_download_path"]
+            }
+            for row in rows
+        ],
+        "missing": missing
+    }
+
 @router.get("/recommendations/{uid}", response_model=List[models.SongRead])
-def get_recommendations(uid: str, limit: int = Query(5, description="Number of recommendations to return")):
+def get_recommendations(
+    uid: str,
+    limit: int = Query(5, description="Number of recommendations to return"),
+    cf_weight: float = Query(song_recommender.CF_WEIGHT, ge=0, description="Weight of collaborative-filtering neighbours (0 = content only)"),
+    method: str = Query(song_recommender.CONTENT, description="Ranking method: 'content' or 'als'")
+):
     """Get personalized song recommendations for a user based on their preferences and listening history"""
+    if method not in song_recommender.METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(song_recommender.METHODS)}")
     try:
-        recommendations = song_repo.get_personalized_recommendations(uid, limit)
+        recommendations = song_repo.get_personalized_recommendations(uid, limit, cf_weight, method)
         return recommendations
     except Exception as e:
         print(f"Error getting recommendations: {e}")
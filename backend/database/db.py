@@ -11,6 +11,7 @@ SQLALCHEMY_DATABASE_URL = (
 
 SCHEMA_PATH = Path(__file__).resolve().parent / "scripts/create_tables.sql"
 DUMMY_DATA_PATH = Path(__file__).resolve().parent / "scripts/insert-dummy-data.sql"
+NORMALIZE_MATCHES_PATH = Path(__file__).resolve().parent / "scripts/normalize_user_matches.sql"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False)
 
@@ -32,6 +33,44 @@ def run(sql: str, params: dict = None, fetch=False, fetchone=False):
         return None
 
 
+def run_many(sql: str, params_list: list):
+    """
+    Execute one statement for a batch of parameter dicts (executemany) in a single transaction.
+    """
+    if not params_list:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(sql), params_list)
+
+
+def run_stream(sql: str, params: dict = None, batch_size: int = 500):
+    """
+    Yield rows one at a time from a server-side cursor (stream_results), so memory
+    stays bounded by batch_size however large the result is.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+            text(sql), params or {})
+        keys = list(result.keys())
+        for batch in result.partitions(batch_size):
+            for row in batch:
+                yield dict(zip(keys, row))
+
+
+def expand_in(name: str, values) -> tuple:
+    """
+    Build named placeholders for an IN (...) clause.
+
+    Returns (placeholder_sql, params), e.g. (":uids_0, :uids_1", {"uids_0": ..., "uids_1": ...}).
+    An empty list expands to NULL so that "x IN (NULL)" matches nothing.
+    """
+    values = list(values)
+    if not values:
+        return "NULL", {}
+    params = {f"{name}_{i}": v for i, v in enumerate(values)}
+    return ", ".join(f":{key}" for key in params), params
+
+
 def run_transaction(operations: list) -> bool:
     """
     Execute multiple SQL operations in a single transaction.
@@ -97,6 +136,7 @@ def create_views_and_indexes():
 # Run schema on startup
 run_script(SCHEMA_PATH)
 run_script(DUMMY_DATA_PATH)
+run_script(NORMALIZE_MATCHES_PATH)
 create_views_and_indexes()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -90,6 +90,19 @@ class SongRead(BaseModel):
     audio_path: str
     audio_download_path: str
 
+class SongCompletion(BaseModel):
+    type: str  # "song" or "artist"
+    text: str
+    sid: Optional[str] = None
+    popularity: int
+
+class SongBatchRequest(BaseModel):
+    sids: List[str]
+
+class SongBatchResponse(BaseModel):
+    songs: List[SongRead]  # In request order, duplicates removed
+    missing: List[str]
+
 # ================ PLAYLIST SONGS SCHEMA ================
 class PlaylistSongCreate(BaseModel):
     pid: str
@@ -183,4 +196,5 @@ class MatchResponse(BaseModel):
     candidates: List[MatchCandidate]
     total_candidates: int
     current_page: int
-    total_pages: int
\ No newline at end of file
+    total_pages: int
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= for the next page
\ No newline at end of file
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Recall/latency benchmark of the MinHash/LSH user index against exact similarity.
+
+Users are generated synthetically: each belongs to a taste cluster and draws most
+of its songs from that cluster's pool. No database is needed, so the exact
+baseline is the Jaccard similarity of played/favourited sid sets, the quantity
+the LSH index estimates.
+
+Usage:
+    python database/scripts/benchmark_minhash.py --users 20000 --queries 200 --k 20
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from database.utils.minhash_lsh import MinHashLSH
+
+
+def generate_users(n_users: int, n_songs: int, n_clusters: int, songs_per_user: int, seed: int):
+    """Synthetic listening histories: {uid: set(sid)}"""
+    rng = random.Random(seed)
+    pool_size = songs_per_user * 2
+    pools = [rng.sample(range(n_songs), pool_size) for _ in range(n_clusters)]
+    users = {}
+    for i in range(n_users):
+        pool = pools[rng.randrange(n_clusters)]
+        size = max(1, int(rng.gauss(songs_per_user, songs_per_user / 4)))
+        in_cluster = rng.sample(pool, min(int(size * 0.8), len(pool)))
+        noise = [rng.randrange(n_songs) for _ in range(size - len(in_cluster))]
+        users[f"user-{i}"] = {f"song-{s}" for s in in_cluster + noise}
+    return users
+
+
+def exact_top_k(query_uid: str, users: dict, k: int):
+    """Exact top-k by Jaccard similarity, scanning every user"""
+    mine = users[query_uid]
+    scores = []
+    for uid, theirs in users.items():
+        if uid == query_uid:
+            continue
+        union = len(mine | theirs)
+        if union:
+            scores.append((len(mine & theirs) / union, uid))
+    scores.sort(reverse=True)
+    return [uid for score, uid in scores[:k] if score > 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--songs", type=int, default=50000)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--songs-per-user", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"Generating {args.users} users over {args.songs} songs...")
+    users = generate_users(args.users, args.songs, args.clusters, args.songs_per_user, args.seed)
+
+    index = MinHashLSH(num_perm=args.num_perm, bands=args.bands)
+    start = time.perf_counter()
+    for uid, sids in users.items():
+        index.insert(uid, sids)
+    build_seconds = time.perf_counter() - start
+    print(f"Built LSH index in {build_seconds:.2f}s ({args.users / build_seconds:.0f} users/s)")
+
+    query_uids = random.Random(args.seed).sample(list(users), min(args.queries, len(users)))
+    exact_seconds = lsh_seconds = 0.0
+    recalls = []
+    for uid in query_uids:
+        start = time.perf_counter()
+        expected = exact_top_k(uid, users, args.k)
+        exact_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = [other for other, _ in index.query(uid, k=args.k)]
+        lsh_seconds += time.perf_counter() - start
+
+        if expected:
+            recalls.append(len(set(found) & set(expected)) / len(expected))
+
+    n = len(query_uids)
+    print(f"\nQueries: {n}, k = {args.k}, bands = {args.bands}, rows/band = {args.num_perm // args.bands}")
+    print(f"Exact scan : {exact_seconds / n * 1000:8.2f} ms/query")
+    print(f"MinHash/LSH: {lsh_seconds / n * 1000:8.2f} ms/query")
+    print(f"Speed-up   : {exact_seconds / max(lsh_seconds, 1e-9):8.1f}x")
+    print(f"Recall@{args.k}  : {sum(recalls) / max(len(recalls), 1):8.3f}")
+
+
+if __name__ == "__main__":
+    main()
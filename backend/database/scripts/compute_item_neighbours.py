@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Batch job for the item-item collaborative filtering model.
+
+Songs are compared by who listens to them and which playlists hold them:
+each song is a column of the stacked [users; playlists] x songs confidence
+matrix (log-damped plays + favourite + rating bonus for users, a flat
+weight for playlist membership), and neighbours are the top-N columns by
+cosine similarity.
+
+Output is a new version directory under model_data/item_cf/ holding
+sids.json, neighbours.npy (int32) and weights.npy (float16); CURRENT is then
+switched to it atomically, so API workers never see a half-written model.
+
+Runs are incremental by default. Songs listened to or added to a playlist
+since the previous version (plus songs new to the catalog) are "touched".
+Similarity is symmetric, so every song sharing a listener or playlist with
+a touched song may gain or lose a touched neighbour: those get their lists
+recomputed too, the rest are copied over. Use --full to recompute
+everything, e.g. weekly, to pick up favourite / rating edits and deleted
+rows, which leave no timestamp behind.
+
+Usage:
+    python database/scripts/compute_item_neighbours.py --top-n 50
+    python database/scripts/compute_item_neighbours.py --full
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import numpy as np
+from scipy import sparse
+
+from database.db import run
+from database.utils import versioned_model
+from database.utils.item_cf import MODEL_DIR, SIDS_FILE, NEIGHBOURS_FILE, WEIGHTS_FILE
+from database.utils.similarity_engine import load_user_song_matrix
+
+PLAYLIST_WEIGHT = 1.0
+
+
+def load_matrix():
+    """
+    Column-normalised [users; playlists] x songs matrix and the sid of every column
+    """
+    _, sids, users = load_user_song_matrix()
+    song_index = {sid: i for i, sid in enumerate(sids)}
+
+    rows, cols = [], []
+    playlist_index = {}
+    for row in run("SELECT pid, sid FROM playlist_songs", fetch=True) or []:
+        if row["sid"] not in song_index:
+            continue
+        rows.append(playlist_index.setdefault(row["pid"], len(playlist_index)))
+        cols.append(song_index[row["sid"]])
+    playlists = sparse.csr_matrix((np.full(len(rows), PLAYLIST_WEIGHT, dtype=np.float32), (rows, cols)),
+                                  shape=(len(playlist_index), len(sids)))
+    playlists.sum_duplicates()
+
+    matrix = sparse.vstack([users, playlists]).tocsr()
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=0)).A1
+    norms[norms == 0] = 1.0
+    return sids, matrix.dot(sparse.diags(1.0 / norms)).tocsc().astype(np.float32)
+
+
+def top_n_block(matrix_t, matrix, columns, top_n):
+    """
+    Neighbour rows for a block of song columns: (int32[b, top_n], float16[b, top_n])
+    """
+    similarities = (matrix_t[columns] @ matrix).tocsr()
+    neighbours = np.full((len(columns), top_n), -1, dtype=np.int32)
+    weights = np.zeros((len(columns), top_n), dtype=np.float16)
+    for offset, column in enumerate(columns):
+        lo, hi = similarities.indptr[offset], similarities.indptr[offset + 1]
+        cols, vals = similarities.indices[lo:hi], similarities.data[lo:hi]
+        keep = (cols != column) & (vals > 0)
+        cols, vals = cols[keep], vals[keep]
+        if len(vals) > top_n:
+            part = np.argpartition(-vals, top_n)[:top_n]
+            cols, vals = cols[part], vals[part]
+        order = np.argsort(-vals, kind="stable")
+        neighbours[offset, :len(order)] = cols[order]
+        weights[offset, :len(order)] = vals[order]
+    return neighbours, weights
+
+
+def co_occurring(matrix, columns):
+    """
+    Columns sharing at least one row (listener or playlist) with any of columns, including them
+    """
+    if not len(columns):
+        return np.empty(0, dtype=np.int64)
+    rows = np.unique(matrix[:, columns].indices)
+    return np.unique(matrix.tocsr()[rows].indices)
+
+
+def touched_songs(since: str):
+    rows = run("""
+    SELECT DISTINCT sid FROM user_track_actions WHERE last_listened >= :since
+    UNION
+    SELECT DISTINCT sid FROM playlist_songs WHERE added_at >= :since
+    """, {"since": since}, fetch=True) or []
+    return {row["sid"] for row in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--full", action="store_true", help="Recompute every song's neighbours")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    build_started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    sids, matrix = load_matrix()
+    matrix_t = matrix.T.tocsr()
+    print(f"Loaded {matrix.shape[0]} listeners/playlists x {len(sids)} songs "
+          f"({matrix.nnz} non-zeros) in {time.perf_counter() - started:.1f}s")
+
+    neighbours = np.full((len(sids), args.top_n), -1, dtype=np.int32)
+    weights = np.zeros((len(sids), args.top_n), dtype=np.float16)
+    pending = list(range(len(sids)))
+
+    previous = versioned_model.current_version(MODEL_DIR)
+    if previous and not args.full:
+        previous_dir = MODEL_DIR / previous
+        meta = versioned_model.read_meta(MODEL_DIR, previous)
+        if meta["top_n"] == args.top_n:
+            with open(previous_dir / SIDS_FILE) as f:
+                old_sids = json.load(f)
+            old_neighbours = np.load(previous_dir / NEIGHBOURS_FILE, mmap_mode="r")
+            old_weights = np.load(previous_dir / WEIGHTS_FILE, mmap_mode="r")
+            index = {sid: i for i, sid in enumerate(sids)}
+            # Old row ids -> new row ids; the extra -1 keeps padding at -1
+            remap = np.array([index.get(sid, -1) for sid in old_sids] + [-1], dtype=np.int32)
+            touched = touched_songs(meta["built_at"])
+            old_index = {sid: i for i, sid in enumerate(old_sids)}
+            changed = [i for i, sid in enumerate(sids) if sid in touched or sid not in old_index]
+            recompute = np.zeros(len(sids), dtype=bool)
+            recompute[co_occurring(matrix, changed)] = True
+            recompute[changed] = True
+            pending = np.flatnonzero(recompute).tolist()
+            for i, sid in enumerate(sids):
+                if recompute[i]:
+                    continue
+                old = old_index[sid]
+                row = remap[old_neighbours[old]]
+                valid = row >= 0
+                neighbours[i, :valid.sum()] = row[valid]
+                weights[i, :valid.sum()] = old_weights[old][valid]
+            print(f"Incremental run from {previous}: {len(changed)} songs changed, "
+                  f"{len(pending)} of {len(sids)} recomputed with their co-listened songs")
+
+    compute_started = time.perf_counter()
+    for start in range(0, len(pending), args.block_size):
+        block = pending[start:start + args.block_size]
+        block_neighbours, block_weights = top_n_block(matrix_t, matrix, block, args.top_n)
+        neighbours[block] = block_neighbours
+        weights[block] = block_weights
+        done = min(start + args.block_size, len(pending))
+        elapsed = time.perf_counter() - compute_started
+        print(f"{done}/{len(pending)} songs ({done / max(elapsed, 1e-9):.1f} songs/s)")
+
+    def write(version_dir):
+        with open(version_dir / SIDS_FILE, "w") as f:
+            json.dump(sids, f)
+        np.save(version_dir / NEIGHBOURS_FILE, neighbours)
+        np.save(version_dir / WEIGHTS_FILE, weights)
+
+    version = versioned_model.publish(MODEL_DIR, write, {"built_at": build_started_at, "top_n": args.top_n})
+
+    size = (neighbours.nbytes + weights.nbytes) / 1e6
+    print(f"\n✅ Item neighbours v{version}: {len(sids)} songs x {args.top_n} "
+          f"({size:.1f} MB) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Offline all-pairs user similarity job.
+
+Loads the full user x genre and user x artist interaction matrices once, then
+computes the top-K most similar users of every user with blocked sparse matrix
+products spread over a process pool. Results go to user_neighbours, which
+/matching/candidates reads with a single primary-key lookup.
+
+Scores use the same weighting as similarity_engine's cosine mode
+(0.4 * genre cosine + 0.6 * artist cosine).
+
+Every finished block is recorded in neighbour_job_blocks; re-running with the
+same --job-id skips users that were already written.
+
+Usage:
+    python database/scripts/compute_user_neighbours.py --top-k 50 --block-size 512 --workers 4
+"""
+
+import argparse
+import bisect
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import numpy as np
+from scipy import sparse
+
+from database.db import run, run_transaction, expand_in
+from database.utils.similarity_engine import action_weight, GENRE_WEIGHT, ARTIST_WEIGHT
+
+# Per-worker copies of the combined feature matrix and its transpose
+_matrix = None
+_matrix_t = None
+
+
+def load_interaction_matrix():
+    """
+    Build the L2-normalised [genre | artist] user feature matrix in one pass.
+    Returns (uids, csr_matrix) with rows ordered by uid.
+    """
+    sql = """
+    SELECT uta.uid, uta.sid, uta.total_plays, uta.favourite, s.artist, g.genre_name
+    FROM user_track_actions uta
+    JOIN songs s ON uta.sid = s.sid
+    LEFT JOIN song_genres sg ON s.sid = sg.sid
+    LEFT JOIN genres g ON sg.gid = g.gid
+    WHERE (uta.favourite = TRUE OR uta.total_plays > 0)
+    """
+    rows = run(sql, fetch=True) or []
+
+    uids = sorted({row["uid"] for row in rows})
+    user_index = {uid: i for i, uid in enumerate(uids)}
+    genre_index, artist_index = {}, {}
+    genre_cells, artist_cells = {}, {}
+    seen_songs = set()
+    for row in rows:
+        weight = action_weight(row["total_plays"], row["favourite"])
+        u = user_index[row["uid"]]
+        if row["genre_name"]:
+            g = genre_index.setdefault(row["genre_name"], len(genre_index))
+            genre_cells[(u, g)] = genre_cells.get((u, g), 0.0) + weight
+        # One row per genre, so only count the artist once per (user, song)
+        if row["artist"] and (u, row["sid"]) not in seen_songs:
+            seen_songs.add((u, row["sid"]))
+            a = artist_index.setdefault(row["artist"], len(artist_index))
+            artist_cells[(u, a)] = artist_cells.get((u, a), 0.0) + weight
+
+    def to_csr(cells, n_cols):
+        if not cells:
+            return sparse.csr_matrix((len(uids), n_cols), dtype=np.float32)
+        coords = np.array(list(cells.keys()), dtype=np.int64)
+        values = np.array(list(cells.values()), dtype=np.float32)
+        m = sparse.csr_matrix((values, (coords[:, 0], coords[:, 1])), shape=(len(uids), n_cols))
+        norms = np.sqrt(m.multiply(m).sum(axis=1)).A1
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms).dot(m).tocsr()
+
+    genres = to_csr(genre_cells, len(genre_index))
+    artists = to_csr(artist_cells, len(artist_index))
+    # Scaling each block by sqrt(weight) makes X @ X.T the weighted sum of both cosines
+    combined = sparse.hstack([genres * math.sqrt(GENRE_WEIGHT), artists * math.sqrt(ARTIST_WEIGHT)]).tocsr()
+    return uids, combined.astype(np.float32)
+
+
+def _init_worker(matrix):
+    global _matrix, _matrix_t
+    _matrix = matrix
+    _matrix_t = matrix.T.tocsr()
+
+
+def _top_k_block(args):
+    """
+    Top-k neighbours of rows [start, stop) as {row: [(col, score), ...]}
+    """
+    start, stop, k = args
+    scores = (_matrix[start:stop] @ _matrix_t).tocsr()
+    result = {}
+    for offset in range(stop - start):
+        row = start + offset
+        lo, hi = scores.indptr[offset], scores.indptr[offset + 1]
+        cols, vals = scores.indices[lo:hi], scores.data[lo:hi]
+        keep = (cols != row) & (vals > 0)
+        cols, vals = cols[keep], vals[keep]
+        if len(vals) > k:
+            part = np.argpartition(-vals, k)[:k]
+            cols, vals = cols[part], vals[part]
+        order = np.argsort(-vals, kind="stable")
+        result[row] = [(int(cols[i]), float(vals[i])) for i in order]
+    return result
+
+
+def _completed_ranges(job_id: str):
+    return run("""
+    SELECT block_index, first_uid, last_uid FROM neighbour_job_blocks
+    WHERE job_id = :job_id
+    """, {"job_id": job_id}, fetch=True) or []
+
+
+def _write_block(job_id: str, block_index: int, block_uids, neighbours, uids, loaded_at):
+    """
+    Replace the block's neighbour rows and record the block as done in one transaction,
+    so a resumed job never skips a block whose rows were not written. computed_at is
+    loaded_at, when the matrix was read: taste changes after it make the rows stale.
+    """
+    placeholders, params = expand_in("uids", block_uids)
+    operations = [(f"DELETE FROM user_neighbours WHERE uid IN ({placeholders})", params, False, False)]
+    rows = [
+        {"uid": uids[row], "neighbour_rank": rank, "neighbour_uid": uids[col],
+         "similarity_score": score, "computed_at": loaded_at}
+        for row, ranked in neighbours.items()
+        for rank, (col, score) in enumerate(ranked)
+    ]
+    if rows:
+        operations.append(("""
+        INSERT INTO user_neighbours (uid, neighbour_rank, neighbour_uid, similarity_score, computed_at)
+        VALUES (:uid, :neighbour_rank, :neighbour_uid, :similarity_score, :computed_at)
+        """, rows, False, False))
+    operations.append(("""
+    INSERT INTO neighbour_job_blocks (job_id, block_index, first_uid, last_uid, users_in_block)
+    VALUES (:job_id, :block_index, :first_uid, :last_uid, :users_in_block)
+    """, {
+        "job_id": job_id,
+        "block_index": block_index,
+        "first_uid": block_uids[0],
+        "last_uid": block_uids[-1],
+        "users_in_block": len(block_uids),
+    }, False, False))
+    if not run_transaction(operations):
+        raise RuntimeError(f"Failed to write neighbour block {block_index}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--job-id", default=date.today().isoformat(), help="Re-use to resume an interrupted run")
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--block-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    print("Loading interaction matrices...")
+    loaded_at = run("SELECT NOW() AS now", fetchone=True)["now"]
+    uids, matrix = load_interaction_matrix()
+    print(f"Loaded {len(uids)} users x {matrix.shape[1]} features "
+          f"({matrix.nnz} non-zeros) in {time.perf_counter() - started:.1f}s")
+
+    # Resume: skip users covered by blocks this job already finished
+    done = _completed_ranges(args.job_id)
+    next_block = max((row["block_index"] for row in done), default=-1) + 1
+    ranges = sorted((row["first_uid"], row["last_uid"]) for row in done)
+    firsts = [first for first, _ in ranges]
+
+    def already_done(uid):
+        pos = bisect.bisect_right(firsts, uid) - 1
+        return pos >= 0 and uid <= ranges[pos][1]
+
+    pending = [i for i, uid in enumerate(uids) if not already_done(uid)]
+    if done:
+        print(f"Resuming job {args.job_id}: {len(done)} blocks done, {len(pending)} users left")
+
+    # Pending rows are contiguous except around finished ranges, so block them by runs
+    blocks, current = [], []
+    for i in pending:
+        if current and (i != current[-1] + 1 or len(current) == args.block_size):
+            blocks.append((current[0], current[-1] + 1))
+            current = []
+        current.append(i)
+    if current:
+        blocks.append((current[0], current[-1] + 1))
+
+    processed = 0
+    compute_started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(matrix,)) as pool:
+        tasks = [(start, stop, args.top_k) for start, stop in blocks]
+        for block_number, ((start, stop), neighbours) in enumerate(zip(blocks, pool.map(_top_k_block, tasks))):
+            _write_block(args.job_id, next_block + block_number, uids[start:stop], neighbours, uids, loaded_at)
+            processed += stop - start
+            elapsed = time.perf_counter() - compute_started
+            print(f"Block {next_block + block_number}: {stop - start} users "
+                  f"({processed}/{len(pending)}, {processed / elapsed:.1f} users/s)")
+
+    elapsed = time.perf_counter() - compute_started
+    print(f"\n✅ Neighbours computed for {processed} users in {elapsed:.1f}s "
+          f"({processed / max(elapsed, 1e-9):.1f} users/s)")
+
+
+if __name__ == "__main__":
+    main()
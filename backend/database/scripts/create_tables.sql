@@ -33,6 +33,21 @@ CREATE TABLE IF NOT EXISTS song_genres (
     FOREIGN KEY (gid) REFERENCES genres(gid)
 );
 
+-- Bumped whenever the songs table is (re)loaded, so in-memory catalogs know to reload
+CREATE TABLE IF NOT EXISTS catalog_versions (
+    name VARCHAR(32) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Denormalised song_genres: the SongRead genre string and a genre-id bitmask
+-- (bit gid - 1), maintained by database/utils/genre_summary.py
+CREATE TABLE IF NOT EXISTS song_genre_summary (
+    sid VARCHAR(255) PRIMARY KEY,
+    genre VARCHAR(2048),
+    genre_mask BINARY(32) NOT NULL,
+    FOREIGN KEY (sid) REFERENCES songs(sid)
+);
+
 CREATE TABLE IF NOT EXISTS playlists (
     pid VARCHAR(36) PRIMARY KEY,
     name VARCHAR(100),
@@ -73,6 +88,7 @@ CREATE TABLE IF NOT EXISTS playlist_songs (
 );
 
 -- User matching system
+-- Each pair is stored once, smaller uid first (see normalize_user_matches.sql)
 CREATE TABLE IF NOT EXISTS user_matches (
     user1_id VARCHAR(36),
     user2_id VARCHAR(36),
@@ -82,11 +98,91 @@ CREATE TABLE IF NOT EXISTS user_matches (
     liked_by_user2 BOOLEAN DEFAULT FALSE,
     matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (user1_id, user2_id),
+    CHECK (user1_id < user2_id),
     FOREIGN KEY (user1_id) REFERENCES users(uid),
     FOREIGN KEY (user2_id) REFERENCES users(uid)
 );
 
+-- Taste version per user, bumped on every write to user_track_actions
+CREATE TABLE IF NOT EXISTS user_taste_versions (
+    uid VARCHAR(36) PRIMARY KEY,
+    version INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (uid) REFERENCES users(uid)
+);
 
+-- Pairwise similarity cache, stamped with both users' taste versions (user1_id < user2_id)
+CREATE TABLE IF NOT EXISTS user_similarity_cache (
+    user1_id VARCHAR(36),
+    user2_id VARCHAR(36),
+    mode VARCHAR(20),
+    similarity_score FLOAT DEFAULT 0.0,
+    user1_version INT NOT NULL DEFAULT 0,
+    user2_version INT NOT NULL DEFAULT 0,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user1_id, user2_id, mode),
+    INDEX idx_similarity_cache_user2 (user2_id, mode),
+    FOREIGN KEY (user1_id) REFERENCES users(uid),
+    FOREIGN KEY (user2_id) REFERENCES users(uid)
+);
 
+-- Offline top-K neighbours per user, written by database/scripts/compute_user_neighbours.py
+CREATE TABLE IF NOT EXISTS user_neighbours (
+    uid VARCHAR(36),
+    neighbour_rank INT,
+    neighbour_uid VARCHAR(36),
+    similarity_score FLOAT DEFAULT 0.0,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (uid, neighbour_rank),
+    FOREIGN KEY (uid) REFERENCES users(uid),
+    FOREIGN KEY (neighbour_uid) REFERENCES users(uid)
+);
+
+-- Completed blocks of a neighbour job, so an interrupted run can resume
+CREATE TABLE IF NOT EXISTS neighbour_job_blocks (
+    job_id VARCHAR(64),
+    block_index INT,
+    first_uid VARCHAR(36),
+    last_uid VARCHAR(36),
+    users_in_block INT,
+    completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_id, block_index)
+);
 
+-- Nightly precomputed recommendations, written by database/scripts/precompute_recommendations.py.
+-- Rows older than the user's user_taste_versions.updated_at are treated as stale.
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    uid VARCHAR(36),
+    recommended_uid VARCHAR(36),
+    recommendation_type ENUM('song_based', 'genre_based', 'artist_based', 'playlist_based'),
+    confidence_score FLOAT DEFAULT 0.0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (uid, recommended_uid, recommendation_type),
+    INDEX idx_user_recommendations_rank (uid, confidence_score),
+    FOREIGN KEY (uid) REFERENCES users(uid) ON DELETE CASCADE,
+    FOREIGN KEY (recommended_uid) REFERENCES users(uid) ON DELETE CASCADE
+);
 
+CREATE TABLE IF NOT EXISTS song_recommendations (
+    uid VARCHAR(36),
+    sid VARCHAR(255),
+    recommendation_reason VARCHAR(255),
+    confidence_score FLOAT DEFAULT 0.0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (uid, sid),
+    INDEX idx_song_recommendations_rank (uid, confidence_score),
+    FOREIGN KEY (uid) REFERENCES users(uid) ON DELETE CASCADE,
+    FOREIGN KEY (sid) REFERENCES songs(sid) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS playlist_recommendations (
+    uid VARCHAR(36),
+    pid VARCHAR(36),
+    recommendation_reason VARCHAR(255),
+    confidence_score FLOAT DEFAULT 0.0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (uid, pid),
+    INDEX idx_playlist_recommendations_rank (uid, confidence_score),
+    FOREIGN KEY (uid) REFERENCES users(uid) ON DELETE CASCADE,
+    FOREIGN KEY (pid) REFERENCES playlists(pid) ON DELETE CASCADE
+);
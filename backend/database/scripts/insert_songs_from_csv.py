@@ -5,12 +5,15 @@ from sqlalchemy import create_engine, text
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 
 from database.db_config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+from database.utils import genre_summary, song_autocomplete, song_catalog, song_sampling, song_search
 
 # Create SQLAlchemy engine
 DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 engine = create_engine(DATABASE_URL)
 
 def populate_songs_if_empty():
+    # Songs whose song_genres rows are written here, re-summarised once they are committed
+    genre_sids = []
     with engine.begin() as conn:
         # Check if songs table has any records
         result = conn.execute(text("SELECT COUNT(*) FROM songs"))
@@ -91,9 +94,22 @@ def populate_songs_if_empty():
                                 text("INSERT INTO song_genres (sid, gid) VALUES (:sid, :gid)"),
                                 {"sid": str(row["id"]), "gid": genre_map[genre_name]}
                             )
+                    genre_sids.append(str(row["id"]))
 
             print("✅ Songs table populated.")
             print("✅ Genres table populated.")
             print("✅ Song-Genre relationships established.")
         else:
-            print("✅ Songs table already has data.")
\ No newline at end of file
+            print("✅ Songs table already has data.")
+
+    # Keep the genre summary, in-memory catalog and search index in sync with the songs table
+    genre_summary.refresh_in_batches(genre_sids)
+    genre_summary.refresh_missing()
+    if count == 0:
+        song_catalog.bump_version()
+    song_search.build_index(song_catalog.load())
+    # Picks up newly inserted songs incrementally once built
+    song_autocomplete.build_index()
+    # Cold-start recommendations draw from these
+    song_sampling.build_pools()
+    print("✅ Song catalog, search, autocomplete indexes and sampling pools loaded.")
\ No newline at end of file
@@ -0,0 +1,23 @@
+-- Store every user_matches pair once, smaller uid first.
+-- Safe to run on every startup: it is a no-op once the table is canonical.
+
+-- Fold rows stored as (larger, smaller) into the canonical row, keeping both likes
+INSERT INTO user_matches (user1_id, user2_id, similarity_score, liked_by_user1, liked_by_user2, matched, matched_at)
+SELECT flipped.user1_id, flipped.user2_id, flipped.similarity_score,
+       flipped.liked_by_user1, flipped.liked_by_user2, flipped.matched, flipped.matched_at
+FROM (
+    SELECT user2_id AS user1_id, user1_id AS user2_id, similarity_score,
+           liked_by_user2 AS liked_by_user1, liked_by_user1 AS liked_by_user2, matched, matched_at
+    FROM user_matches
+    WHERE user1_id > user2_id
+) AS flipped
+ON DUPLICATE KEY UPDATE
+    liked_by_user1 = liked_by_user1 OR VALUES(liked_by_user1),
+    liked_by_user2 = liked_by_user2 OR VALUES(liked_by_user2);
+
+DELETE FROM user_matches WHERE user1_id > user2_id;
+
+-- A merged pair may have become mutual
+UPDATE user_matches
+SET matched = (liked_by_user1 AND liked_by_user2)
+WHERE matched != (liked_by_user1 AND liked_by_user2);
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Nightly batch job for song, user and playlist recommendations.
+
+For every user active in the last --active-days days, computes the same
+rankings the live endpoints would (song_recommender, matching_repo,
+playlist_vectors) and stores them in song_recommendations,
+user_recommendations and playlist_recommendations. The read paths then answer with one indexed
+read, and only compute live for users whose rows are missing or older than
+their last taste change (see database/utils/recommendation_store.py).
+
+Users are split into chunks handled by a thread pool. The work is mostly
+database round trips and numpy, both of which release the GIL, and threads
+share one SQLAlchemy engine safely where forked processes would not. Each
+chunk is written with one bulk insert per table.
+
+Usage:
+    python database/scripts/precompute_recommendations.py --active-days 30 --chunk-size 200 --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from database.db import run
+from database.schema.models import RecommendationType
+from database.utils import matching_repo, playlist_repo, playlist_vectors, recommendation_store, song_recommender
+
+SONG_REASON = "Matches your genres, artists and listeners like you"
+
+
+def active_users(days: int):
+    rows = run("""
+    SELECT DISTINCT uid FROM user_track_actions
+    WHERE last_listened >= NOW() - INTERVAL :days DAY
+    ORDER BY uid
+    """, {"days": days}, fetch=True) or []
+    return [row["uid"] for row in rows]
+
+
+def compute_chunk(uids):
+    """
+    Compute and write recommendations for one chunk of users; returns the number of rows written
+    """
+    # Taken before reading any user's signals, so taste changes during the chunk make its rows stale
+    computed_at = run("SELECT NOW() AS now", fetchone=True)["now"]
+    songs, users, playlists = {}, {}, {}
+    for uid in uids:
+        songs[uid] = [
+            {"sid": sid, "recommendation_reason": SONG_REASON, "confidence_score": score}
+            for sid, score in song_recommender.top_songs(uid, recommendation_store.SONGS_PER_USER)
+        ]
+        neighbours = matching_repo.rank_candidates(uid, recommendation_store.USERS_PER_USER)
+        neighbours = neighbours[:recommendation_store.USERS_PER_USER]
+        users[uid] = [
+            {"recommended_uid": user["uid"],
+             "recommendation_type": RecommendationType.SONG_BASED.value,
+             "confidence_score": user["similarity_score"]}
+            for user in neighbours
+        ]
+        playlists[uid] = [
+            {"pid": playlist["pid"],
+             "recommendation_reason": playlist_repo.RECOMMENDATION_REASON,
+             "confidence_score": playlist["confidence_score"]}
+            for playlist in playlist_vectors.rank(uid, recommendation_store.PLAYLISTS_PER_USER)
+        ]
+    recommendation_store.write(recommendation_store.SONGS, songs, computed_at)
+    recommendation_store.write(recommendation_store.USERS, users, computed_at)
+    recommendation_store.write(recommendation_store.PLAYLISTS, playlists, computed_at)
+    return sum(len(rows) for table in (songs, users, playlists) for rows in table.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--active-days", type=int, default=30)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    uids = active_users(args.active_days)
+    # Build the catalog features and playlist vectors once up front rather than in every thread
+    song_recommender.get_features()
+    playlist_vectors.build_index()
+    print(f"{len(uids)} active users, catalog loaded in {time.perf_counter() - started:.1f}s")
+
+    chunks = [uids[i:i + args.chunk_size] for i in range(0, len(uids), args.chunk_size)]
+    processed, rows_written, failed = 0, 0, 0
+    compute_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(compute_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                rows_written += future.result()
+            except Exception as e:
+                failed += len(chunk)
+                print(f"❌ Chunk {chunk[0]}..{chunk[-1]} failed: {e}")
+                continue
+            processed += len(chunk)
+            elapsed = time.perf_counter() - compute_started
+            print(f"{processed}/{len(uids)} users ({processed / max(elapsed, 1e-9):.1f} users/s)")
+
+    elapsed = time.perf_counter() - compute_started
+    print(f"\n✅ Recommendations precomputed for {processed} users ({rows_written} rows) in {elapsed:.1f}s"
+          + (f", {failed} users failed" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -56,8 +56,7 @@ INSERT IGNORE INTO user_track_actions (uid, sid, last_listened, total_plays, fav
 -- ─────────────────────────────────────────────
 -- FEATURE: Matching System  
 INSERT IGNORE INTO user_matches (user1_id, user2_id, similarity_score, matched, liked_by_user1, liked_by_user2) VALUES  
-  ('u1', 'u2', 0.75, FALSE, TRUE, FALSE),  
-  ('u2', 'u1', 0.75, FALSE, FALSE, TRUE);
+  ('u1', 'u2', 0.75, TRUE, TRUE, TRUE);
 
 -- Re-enable foreign key checks after data load
 SET FOREIGN_KEY_CHECKS=1;
@@ -0,0 +1,88 @@
+import json
+from typing import Optional
+import numpy as np
+from database.utils import song_catalog, versioned_model
+
+# Written by database/scripts/train_als.py into MODEL_DIR/<version>/
+# (see versioned_model), with MODEL_DIR/CURRENT naming the live version:
+#   meta.json          factors, regularization, alpha, built_at
+#   uids.json          user factor row -> uid
+#   sids.json          item factor row -> sid
+#   user_factors.f32   float32[n_users, factors], raw C-order
+#   item_factors.f32   float32[n_songs, factors], raw C-order
+# The factor files are opened with np.memmap, so every API worker shares one page-cache copy.
+MODEL_DIR = versioned_model.MODEL_DATA_DIR / "als"
+UIDS_FILE = "uids.json"
+SIDS_FILE = "sids.json"
+USER_FACTORS_FILE = "user_factors.f32"
+ITEM_FACTORS_FILE = "item_factors.f32"
+
+
+class ALSModel:
+    """
+    Memory-mapped implicit-ALS user and song embeddings, mapped onto one catalog snapshot
+    """
+
+    def __init__(self, version: str, catalog: song_catalog.Catalog):
+        model_dir = MODEL_DIR / version
+        self.version = version
+        self.catalog = catalog
+        meta = versioned_model.read_meta(MODEL_DIR, version)
+        self.regularization = float(meta["regularization"])
+        self.alpha = float(meta["alpha"])
+        factors = int(meta["factors"])
+        with open(model_dir / UIDS_FILE) as f:
+            uids = json.load(f)
+        with open(model_dir / SIDS_FILE) as f:
+            sids = json.load(f)
+        self.user_rows = {uid: i for i, uid in enumerate(uids)}
+        self.user_factors = np.memmap(model_dir / USER_FACTORS_FILE, dtype=np.float32, mode="r",
+                                      shape=(len(uids), factors))
+        self.item_factors = np.memmap(model_dir / ITEM_FACTORS_FILE, dtype=np.float32, mode="r",
+                                      shape=(len(sids), factors))
+        # model row <-> catalog id; songs missing on either side map to -1
+        self.to_catalog = np.array([catalog.sid_ids.get(sid, -1) for sid in sids], dtype=np.int64)
+        self.from_catalog = np.full(catalog.size, -1, dtype=np.int64)
+        known = self.to_catalog >= 0
+        self.from_catalog[self.to_catalog[known]] = np.flatnonzero(known)
+        self.known_rows = np.flatnonzero(known)
+        # Y^T Y, shared by every fold-in solve
+        self.gram = np.asarray(self.item_factors.T @ self.item_factors, dtype=np.float64)
+
+    def fold_in(self, seed_ids: np.ndarray, seed_weights: np.ndarray) -> np.ndarray:
+        """
+        Embedding of a user the model was not trained on, from weighted catalog ids:
+        one regularised least-squares solve against the fixed song factors
+        """
+        rows = self.from_catalog[seed_ids]
+        known = rows >= 0
+        rows, confidence = rows[known], self.alpha * np.asarray(seed_weights, dtype=np.float64)[known]
+        factors = np.asarray(self.item_factors[rows], dtype=np.float64)
+        a = self.gram + (factors.T * confidence) @ factors + self.regularization * np.eye(len(self.gram))
+        b = factors.T @ (1.0 + confidence)
+        return np.linalg.solve(a, b).astype(np.float32)
+
+    def user_vector(self, uid: str, seed_ids: np.ndarray, seed_weights: np.ndarray) -> np.ndarray:
+        row = self.user_rows.get(uid)
+        if row is not None:
+            return np.asarray(self.user_factors[row])
+        return self.fold_in(seed_ids, seed_weights)
+
+    def scores(self, vector: np.ndarray) -> np.ndarray:
+        """
+        Predicted preference of every catalog song; songs unknown to the model get -inf
+        """
+        result = np.full(self.catalog.size, -np.inf, dtype=np.float32)
+        raw = self.item_factors @ vector
+        result[self.to_catalog[self.known_rows]] = raw[self.known_rows]
+        return result
+
+
+_loader = versioned_model.Loader("ALS model", MODEL_DIR, ALSModel)
+
+
+def get_model() -> Optional[ALSModel]:
+    """
+    Current ALS model, or None until the training job has produced one
+    """
+    return _loader.get()
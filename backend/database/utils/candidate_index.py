@@ -0,0 +1,139 @@
+import heapq
+import math
+import threading
+from typing import Dict, List, Optional, Tuple, Iterable
+from database.db import run
+from database.utils import index_refresh
+from database.utils.similarity_engine import action_weight
+
+# How much a shared song / shared artist contributes to the overlap score
+SONG_OVERLAP_WEIGHT = 1.0
+ARTIST_OVERLAP_WEIGHT = 0.5
+
+# Postings longer than this carry almost no signal (everybody played it) and are skipped,
+# which keeps a query bounded by the viewer's history instead of the user count
+MAX_POSTING_LENGTH = 5000
+
+# Full rebuild interval, so workers that missed a write-side refresh converge
+INDEX_TTL_SECONDS = 600
+
+_lock = threading.Lock()
+_song_users: Dict[str, Dict[str, float]] = {}    # sid -> {uid: weight}
+_artist_users: Dict[str, Dict[str, float]] = {}  # artist -> {uid: weight}
+_user_songs: Dict[str, Dict[str, float]] = {}    # uid -> {sid: weight}
+_user_artists: Dict[str, Dict[str, float]] = {}  # uid -> {artist: weight}
+
+
+def _load_actions(uid: Optional[str] = None) -> List[dict]:
+    sql = """
+    SELECT uta.uid, uta.sid, uta.total_plays, uta.favourite, s.artist
+    FROM user_track_actions uta
+    JOIN songs s ON uta.sid = s.sid
+    WHERE (uta.favourite = TRUE OR uta.total_plays > 0)
+    """
+    if uid is None:
+        return run(sql, fetch=True) or []
+    return run(sql + " AND uta.uid = :uid", {"uid": uid}, fetch=True) or []
+
+
+def _add_user_rows(uid: str, rows: Iterable[dict]):
+    songs, artists = {}, {}
+    for row in rows:
+        weight = action_weight(row["total_plays"], row["favourite"])
+        if weight <= 0:
+            continue
+        songs[row["sid"]] = weight
+        if row["artist"]:
+            artists[row["artist"]] = artists.get(row["artist"], 0.0) + weight
+    if not songs:
+        return
+    _user_songs[uid] = songs
+    _user_artists[uid] = artists
+    for sid, weight in songs.items():
+        _song_users.setdefault(sid, {})[uid] = weight
+    for artist, weight in artists.items():
+        _artist_users.setdefault(artist, {})[uid] = weight
+
+
+def _remove_user(uid: str):
+    for sid in _user_songs.pop(uid, {}):
+        posting = _song_users.get(sid)
+        if posting is not None:
+            posting.pop(uid, None)
+            if not posting:
+                del _song_users[sid]
+    for artist in _user_artists.pop(uid, {}):
+        posting = _artist_users.get(artist)
+        if posting is not None:
+            posting.pop(uid, None)
+            if not posting:
+                del _artist_users[artist]
+
+
+def _build_index():
+    rows_by_user: Dict[str, List[dict]] = {}
+    for row in _load_actions():
+        rows_by_user.setdefault(row["uid"], []).append(row)
+
+    with _lock:
+        _song_users.clear()
+        _artist_users.clear()
+        _user_songs.clear()
+        _user_artists.clear()
+        for uid, rows in rows_by_user.items():
+            _add_user_rows(uid, rows)
+
+
+_refresher = index_refresh.Refresher("candidate index", _build_index, ttl_seconds=INDEX_TTL_SECONDS)
+
+
+def build_index():
+    """
+    (Re)build the song->users and artist->users inverted indexes from user_track_actions
+    """
+    _refresher.build()
+
+
+def _replace_user(uid: str, rows: List[dict]):
+    with _lock:
+        _remove_user(uid)
+        _add_user_rows(uid, rows)
+
+
+def refresh_user(uid: str):
+    """
+    Re-index a single user after their listening history changed
+    """
+    if not _refresher.active():
+        return  # Nothing to patch yet, the first query builds the full index
+    rows = _load_actions(uid)
+    _refresher.patch(lambda: _replace_user(uid, rows))
+
+
+def _accumulate(scores: Dict[str, float], postings: Dict[str, Dict[str, float]],
+                mine: Dict[str, float], weight: float, total_users: int):
+    for key, my_weight in mine.items():
+        posting = postings.get(key)
+        if not posting or len(posting) > MAX_POSTING_LENGTH:
+            continue
+        # Rare keys say more about taste than ones everybody shares
+        idf = math.log(1.0 + total_users / len(posting))
+        for other, other_weight in posting.items():
+            scores[other] = scores.get(other, 0.0) + weight * idf * min(my_weight, other_weight)
+
+
+def top_candidates(uid: str, k: int, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+    """
+    Return up to k (uid, overlap_score) pairs with the largest weighted song/artist overlap with uid.
+    Only users sharing at least one song or artist are visited.
+    """
+    _refresher.ensure()
+    excluded = set(exclude)
+    excluded.add(uid)
+    with _lock:
+        total_users = max(len(_user_songs), 1)
+        scores: Dict[str, float] = {}
+        _accumulate(scores, _song_users, _user_songs.get(uid, {}), SONG_OVERLAP_WEIGHT, total_users)
+        _accumulate(scores, _artist_users, _user_artists.get(uid, {}), ARTIST_OVERLAP_WEIGHT, total_users)
+    ranked = ((other, score) for other, score in scores.items() if other not in excluded)
+    return heapq.nlargest(k, ranked, key=lambda item: item[1])
@@ -0,0 +1,88 @@
+from typing import Dict, Iterable, List, Optional
+from database.db import run, run_many, expand_in
+
+# song_genre_summary.genre_mask is BINARY(32): bit (gid - 1) is set when the song has genre gid
+GENRE_MASK_BYTES = 32
+GENRE_MASK_BITS = GENRE_MASK_BYTES * 8
+
+# Songs summarised per query when backfilling
+REFRESH_BATCH_SIZE = 1000
+
+
+def genre_mask(gids: Iterable[int]) -> bytes:
+    """
+    Pack genre ids into the fixed-width mask stored in song_genre_summary.
+    Raises ValueError for ids outside 1..GENRE_MASK_BITS rather than dropping them,
+    which would make mask filters silently miss the song.
+    """
+    mask = 0
+    for gid in gids:
+        if not 1 <= gid <= GENRE_MASK_BITS:
+            print(f"Genre id {gid} does not fit the {GENRE_MASK_BITS}-bit genre_mask")
+            raise ValueError(f"genre id {gid} outside 1..{GENRE_MASK_BITS}")
+        mask |= 1 << (gid - 1)
+    return mask.to_bytes(GENRE_MASK_BYTES, "big")
+
+
+def mask_filter(column: str, param: str) -> str:
+    """
+    SQL test that a mask column shares at least one bit with the :param mask
+    """
+    return f"BIT_COUNT({column} & :{param}) > 0"
+
+
+def refresh_songs(sids: Optional[List[str]] = None):
+    """
+    Recompute the denormalised genre string and genre mask of sids (every song if None).
+    Call after any write to song_genres.
+    """
+    sql = """
+    SELECT s.sid, g.gid, g.genre_name
+    FROM songs s
+    LEFT JOIN song_genres sg ON s.sid = sg.sid
+    LEFT JOIN genres g ON sg.gid = g.gid
+    """
+    params = {}
+    if sids is not None:
+        if not sids:
+            return
+        placeholders, params = expand_in("sids", sids)
+        sql += f" WHERE s.sid IN ({placeholders})"
+    genres_by_song: Dict[str, list] = {}
+    for row in run(sql + " ORDER BY s.sid, g.gid", params, fetch=True) or []:
+        genres = genres_by_song.setdefault(row["sid"], [])
+        if row["gid"] is not None:
+            genres.append((row["gid"], row["genre_name"]))
+
+    run_many("""
+    INSERT INTO song_genre_summary (sid, genre, genre_mask)
+    VALUES (:sid, :genre, :genre_mask)
+    ON DUPLICATE KEY UPDATE genre = VALUES(genre), genre_mask = VALUES(genre_mask)
+    """, [
+        {
+            "sid": sid,
+            "genre": "; ".join(name for _, name in genres) or None,
+            "genre_mask": genre_mask(gid for gid, _ in genres),
+        }
+        for sid, genres in genres_by_song.items()
+    ])
+
+
+def refresh_in_batches(sids: List[str]):
+    """
+    refresh_songs() over any number of sids, REFRESH_BATCH_SIZE at a time
+    """
+    for start in range(0, len(sids), REFRESH_BATCH_SIZE):
+        refresh_songs(sids[start:start + REFRESH_BATCH_SIZE])
+
+
+def refresh_missing():
+    """
+    Summarise songs that have no summary row yet (e.g. rows loaded by SQL scripts)
+    """
+    rows = run("""
+    SELECT s.sid FROM songs s
+    LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
+    WHERE gs.sid IS NULL
+    """, fetch=True) or []
+    refresh_in_batches([row["sid"] for row in rows])
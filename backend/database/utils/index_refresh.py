@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+# Shared build / refresh policy for the in-memory indexes (candidate_index, lsh_repo,
+# song_search, song_fuzzy, song_autocomplete, song_sampling, playlist_vectors).
+# Each module keeps its own data and lock; a Refresher decides when its build runs.
+
+
+class Refresher:
+    """
+    Runs one module's full build:
+        - at most one build at a time; concurrent first queries wait for a single
+          build instead of each running their own
+        - once built, a stale index (older than ttl_seconds, or changed() is true) is
+          rebuilt on a background thread while queries keep reading the old one
+        - write-side updates made while a build runs are replayed on the new index
+          once it is swapped in (see patch), so they are not lost with the old one
+    """
+
+    def __init__(self, name: str, build: Callable, ttl_seconds: Optional[float] = None,
+                 changed: Optional[Callable[[], bool]] = None):
+        self.name = name
+        self._build = build
+        self._ttl_seconds = ttl_seconds
+        self._changed = changed
+        self._build_lock = threading.Lock()
+        self._patch_lock = threading.Lock()
+        self._building = False
+        self._pending: List[Callable[[], None]] = []
+        self.built_at: Optional[float] = None
+
+    def _run(self, *args):
+        """
+        Caller holds _build_lock
+        """
+        with self._patch_lock:
+            self._building = True
+        started = time.monotonic()
+        succeeded = False
+        try:
+            self._build(*args)
+            succeeded = True
+        finally:
+            with self._patch_lock:
+                pending, self._pending = self._pending, []
+                self._building = False
+                if succeeded:
+                    self.built_at = started
+                    for apply in pending:
+                        apply()
+
+    def build(self, *args):
+        """
+        Build now, waiting for a build already in progress first
+        """
+        with self._build_lock:
+            self._run(*args)
+
+    def stale(self) -> bool:
+        if self.built_at is None:
+            return True
+        if self._ttl_seconds is not None and time.monotonic() - self.built_at > self._ttl_seconds:
+            return True
+        return self._changed is not None and self._changed()
+
+    def _run_in_background(self):
+        try:
+            # Another build may have finished between stale() and acquiring the lock
+            if self.stale():
+                self._run()
+        except Exception as e:
+            print(f"Failed to rebuild {self.name}: {e}")
+        finally:
+            self._build_lock.release()
+
+    def refresh(self):
+        """
+        Start a background rebuild unless one is already running
+        """
+        if self._build_lock.acquire(blocking=False):
+            threading.Thread(target=self._run_in_background, name=f"refresh {self.name}", daemon=True).start()
+
+    def ensure(self, wait: bool = False):
+        """
+        Called before every query: build on first use, refresh in the background when
+        stale. wait=True rebuilds a stale index before returning instead, for callers
+        that cannot use the old one at all.
+        """
+        if self.built_at is None or (wait and self.stale()):
+            with self._build_lock:
+                if self.stale():
+                    self._run()
+            return
+        if self.stale():
+            self.refresh()
+
+    def active(self) -> bool:
+        """
+        False until the first build starts; updates before then need no patching
+        """
+        return self.built_at is not None or self._building
+
+    def patch(self, apply: Callable[[], None]):
+        """
+        Apply a write-side update to the live index, and again to the one being built
+        if a build is in progress. Skipped before the first build, which reads it from
+        the database anyway. apply must be idempotent and should not query the database.
+        """
+        with self._patch_lock:
+            if self.built_at is not None:
+                apply()
+            if self._building:
+                self._pending.append(apply)
@@ -0,0 +1,75 @@
+import json
+from typing import List, Optional, Tuple
+import numpy as np
+from database.utils import song_catalog, versioned_model
+
+# Written by database/scripts/compute_item_neighbours.py into MODEL_DIR/<version>/
+# (see versioned_model), with MODEL_DIR/CURRENT naming the live version:
+#   sids.json        model row -> sid
+#   neighbours.npy   int32[n_songs, top_n], model rows of each song's neighbours, -1 padded
+#   weights.npy      float16[n_songs, top_n], cosine similarity of each neighbour
+# The .npy files are opened with mmap_mode="r", so every API worker shares one page-cache copy.
+MODEL_DIR = versioned_model.MODEL_DATA_DIR / "item_cf"
+SIDS_FILE = "sids.json"
+NEIGHBOURS_FILE = "neighbours.npy"
+WEIGHTS_FILE = "weights.npy"
+
+
+class ItemNeighbours:
+    """
+    Memory-mapped top-N neighbour lists, mapped onto one catalog snapshot
+    """
+
+    def __init__(self, version: str, catalog: song_catalog.Catalog):
+        model_dir = MODEL_DIR / version
+        self.version = version
+        self.catalog = catalog
+        with open(model_dir / SIDS_FILE) as f:
+            sids = json.load(f)
+        self.neighbours = np.load(model_dir / NEIGHBOURS_FILE, mmap_mode="r")
+        self.weights = np.load(model_dir / WEIGHTS_FILE, mmap_mode="r")
+        # model row <-> catalog id; songs missing on either side map to -1
+        self.to_catalog = np.array([catalog.sid_ids.get(sid, -1) for sid in sids], dtype=np.int32)
+        self.from_catalog = np.full(catalog.size, -1, dtype=np.int32)
+        known = self.to_catalog >= 0
+        self.from_catalog[self.to_catalog[known]] = np.flatnonzero(known)
+
+    def scores(self, seed_ids: np.ndarray, seed_weights: np.ndarray) -> np.ndarray:
+        """
+        Item-CF score of every catalog song: sum over seeds of seed weight x similarity
+        """
+        rows = self.from_catalog[seed_ids]
+        known = rows >= 0
+        rows, seed_weights = rows[known], seed_weights[known]
+        result = np.zeros(self.catalog.size, dtype=np.float32)
+        if not len(rows):
+            return result
+        neighbours = np.asarray(self.neighbours[rows])
+        contributions = np.asarray(self.weights[rows], dtype=np.float32) * seed_weights[:, None]
+        targets = self.to_catalog[np.maximum(neighbours, 0)]
+        valid = (neighbours >= 0) & (targets >= 0)
+        result += np.bincount(targets[valid], weights=contributions[valid], minlength=self.catalog.size)
+        return result
+
+    def similar(self, sid: str, k: int) -> List[Tuple[str, float]]:
+        i = self.catalog.sid_ids.get(sid)
+        row = self.from_catalog[i] if i is not None else -1
+        if row < 0:
+            return []
+        result = []
+        for neighbour, weight in zip(self.neighbours[row], self.weights[row]):
+            if neighbour >= 0 and self.to_catalog[neighbour] >= 0:
+                result.append((self.catalog.sids[self.to_catalog[neighbour]], float(weight)))
+            if len(result) == k:
+                break
+        return result
+
+
+_loader = versioned_model.Loader("item neighbours", MODEL_DIR, ItemNeighbours)
+
+
+def get_model() -> Optional[ItemNeighbours]:
+    """
+    Current neighbour model, or None until the batch job has produced one
+    """
+    return _loader.get()
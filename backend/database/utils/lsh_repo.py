@@ -0,0 +1,84 @@
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from database.db import run
+from database.utils import index_refresh
+from database.utils.minhash_lsh import MinHashLSH
+
+# Full rebuild interval, so workers that missed a write-side update converge
+INDEX_TTL_SECONDS = 1800
+
+_lock = threading.Lock()
+_index = MinHashLSH()
+
+
+def _load_song_sets(uid: Optional[str] = None) -> Dict[str, Set[str]]:
+    """
+    Played or favourited sids per user
+    """
+    sql = """
+    SELECT uid, sid FROM user_track_actions
+    WHERE (favourite = TRUE OR total_plays > 0)
+    """
+    params = {}
+    if uid is not None:
+        sql += " AND uid = :uid"
+        params["uid"] = uid
+    song_sets: Dict[str, Set[str]] = {}
+    for row in run(sql, params, fetch=True) or []:
+        song_sets.setdefault(row["uid"], set()).add(row["sid"])
+    return song_sets
+
+
+def _build_index():
+    global _index
+    index = MinHashLSH()
+    for uid, sids in _load_song_sets().items():
+        index.insert(uid, sids)
+    with _lock:
+        _index = index
+
+
+_refresher = index_refresh.Refresher("LSH index", _build_index, ttl_seconds=INDEX_TTL_SECONDS)
+
+
+def build_index():
+    """
+    (Re)compute every user's MinHash signature and swap in the new index
+    """
+    _refresher.build()
+
+
+def _insert(uid: str, sids: Set[str]):
+    with _lock:
+        _index.insert(uid, sids)
+
+
+def _add_items(uid: str, sids: List[str]):
+    with _lock:
+        _index.add_items(uid, sids)
+
+
+def refresh_user(uid: str):
+    """
+    Recompute one user's signature from scratch (needed when songs leave the set)
+    """
+    if not _refresher.active():
+        return
+    sids = _load_song_sets(uid).get(uid, set())
+    _refresher.patch(lambda: _insert(uid, sids))
+
+
+def add_song(uid: str, sid: str):
+    """
+    Fold a newly played or favourited song into uid's signature without a DB read
+    """
+    _refresher.patch(lambda: _add_items(uid, [sid]))
+
+
+def similar_users(uid: str, k: int = 50) -> List[Tuple[str, float]]:
+    """
+    Likely-similar users as (uid, estimated Jaccard of played/favourited songs), best first
+    """
+    _refresher.ensure()
+    with _lock:
+        return _index.query(uid, k=k)
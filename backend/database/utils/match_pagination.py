@@ -0,0 +1,109 @@
+import base64
+import bisect
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from database.utils import matching_repo
+
+# How many candidates one ranking snapshot holds, and how long it stays valid
+RANKING_DEPTH = 200
+SNAPSHOT_TTL_SECONDS = 600
+MAX_SNAPSHOTS = 10000
+
+_lock = threading.Lock()
+# snapshot_id -> (created_at, uid, ranked users, sort keys)
+_snapshots: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def _sort_key(score: float, uid: str) -> Tuple[float, str]:
+    # Candidates are ranked by score descending, then uid ascending
+    return (-score, uid)
+
+
+def encode_cursor(snapshot_id: str, score: float, uid: str, page: int) -> str:
+    payload = json.dumps({"s": snapshot_id, "score": score, "uid": uid, "p": page}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Parse an opaque cursor; raises ValueError if it was not produced by encode_cursor
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return {"s": str(payload["s"]), "score": float(payload["score"]),
+                "uid": str(payload["uid"]), "p": int(payload["p"])}
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _create_snapshot(uid: str) -> str:
+    ranked = matching_repo.rank_candidates(uid, RANKING_DEPTH)
+    keys = [_sort_key(user["similarity_score"], user["uid"]) for user in ranked]
+    snapshot_id = uuid.uuid4().hex
+    now = time.monotonic()
+    with _lock:
+        _snapshots[snapshot_id] = (now, uid, ranked, keys)
+        # Drop expired snapshots and keep the store bounded
+        while _snapshots:
+            oldest_id, oldest = next(iter(_snapshots.items()))
+            if len(_snapshots) <= MAX_SNAPSHOTS and now - oldest[0] <= SNAPSHOT_TTL_SECONDS:
+                break
+            del _snapshots[oldest_id]
+    return snapshot_id
+
+
+def _get_snapshot(snapshot_id: str, uid: str) -> Optional[tuple]:
+    with _lock:
+        snapshot = _snapshots.get(snapshot_id)
+    if snapshot is None or snapshot[1] != uid or time.monotonic() - snapshot[0] > SNAPSHOT_TTL_SECONDS:
+        return None
+    return snapshot
+
+
+def get_candidate_page(uid: str, limit: int, cursor: Optional[str] = None) -> dict:
+    """
+    One page of ranked match candidates.
+
+    The first call ranks RANKING_DEPTH candidates once and keeps the ranking as a
+    server-side snapshot. Later pages seek to the cursor's (score, uid) with a
+    binary search and slice, so they cost O(log n + limit) and never re-rank.
+    If the snapshot expired (or lives in another worker) the ranking is rebuilt
+    and the page continues after the same (score, uid) position.
+
+    Returns {"candidates", "next_cursor", "current_page", "total_pages", "total_candidates"}.
+    """
+    page = 1
+    snapshot_id, snapshot, start = None, None, 0
+    if cursor:
+        position = decode_cursor(cursor)
+        page = position["p"] + 1
+        snapshot_id = position["s"]
+        snapshot = _get_snapshot(snapshot_id, uid)
+        if snapshot is None:
+            snapshot_id = _create_snapshot(uid)
+            snapshot = _get_snapshot(snapshot_id, uid)
+        start = bisect.bisect_right(snapshot[3], _sort_key(position["score"], position["uid"]))
+    else:
+        snapshot_id = _create_snapshot(uid)
+        snapshot = _get_snapshot(snapshot_id, uid)
+
+    ranked = snapshot[2]
+    users = [dict(user) for user in ranked[start:start + limit]]
+    next_cursor = None
+    if users and start + limit < len(ranked):
+        last = users[-1]
+        next_cursor = encode_cursor(snapshot_id, last["similarity_score"], last["uid"], page)
+
+    return {
+        "candidates": users,
+        "next_cursor": next_cursor,
+        "current_page": page,
+        "total_pages": max(math.ceil(len(ranked) / limit), 1),
+        "total_candidates": len(ranked),
+    }
@@ -1,79 +1,72 @@
-from typing import List
+from typing import List, Optional
+from sqlalchemy import text
 from database.schema.models import UserMatchCreate
-from database.db import run
-from database.utils import user_repo
+from database.db import engine, run, expand_in
+from database.utils import similarity_cache, candidate_index, lsh_repo, profile_enrichment, recommendation_store
 import math
 
-def create_user_match(match: UserMatchCreate) -> bool:
+def create_user_match(match: UserMatchCreate) -> Optional[dict]:
     """
-    Create or update a user match (like action). If both users like each other, mark as matched.
+    Record that match.user1_id liked match.user2_id. If both users like each other, mark as matched.
+
+    Each pair is stored once with the smaller uid as user1_id, so a like is a
+    single upsert on the primary key. A second, conditional UPDATE in the same
+    transaction flips matched; its row count tells whether this like created the
+    mutual match, and only one concurrent like can see a count of 1.
+    Similarity is filled in later by refresh_match_similarity.
+
+    Returns {"matched": bool, "new_match": bool}, or None if the write failed.
     """
     try:
         print(f"Creating/updating match: {match}")
-        # Check if match already exists
-        check_sql = """
-        SELECT * FROM user_matches 
-        WHERE (user1_id = :user1_id AND user2_id = :user2_id)
-        OR (user1_id = :user2_id AND user2_id = :user1_id)
+        # The current user is always user1_id in the request
+        user1_id, user2_id = similarity_cache.ordered_pair(match.user1_id, match.user2_id)
+        liker_is_user1 = match.user1_id == user1_id
+        params = {
+            "user1_id": user1_id,
+            "user2_id": user2_id,
+            "liked_by_user1": liker_is_user1,
+            "liked_by_user2": not liker_is_user1
+        }
+        upsert_sql = """
+        INSERT INTO user_matches (user1_id, user2_id, liked_by_user1, liked_by_user2, matched)
+        VALUES (:user1_id, :user2_id, :liked_by_user1, :liked_by_user2, FALSE)
+        ON DUPLICATE KEY UPDATE
+            liked_by_user1 = liked_by_user1 OR VALUES(liked_by_user1),
+            liked_by_user2 = liked_by_user2 OR VALUES(liked_by_user2)
         """
-        existing = run(check_sql, {
-            "user1_id": match.user1_id,
-            "user2_id": match.user2_id
-        }, fetchone=True)
-        
-        print(f"Existing match found: {existing}")
-        
-        if existing:
-            # Update only the current user's like status
-            # Determine which user is the current user and update their like status
-            update_sql = """
-            UPDATE user_matches 
-            SET liked_by_user1 = CASE 
-                WHEN user1_id = :current_user_id THEN TRUE
-                ELSE liked_by_user1
-            END,
-            liked_by_user2 = CASE 
-                WHEN user2_id = :current_user_id THEN TRUE
-                ELSE liked_by_user2
-            END,
-            matched = CASE 
-                WHEN (user1_id = :current_user_id AND liked_by_user2 = TRUE)
-                OR (user2_id = :current_user_id AND liked_by_user1 = TRUE)
-                THEN TRUE
-                ELSE matched
-            END,
-            matched_at = CASE 
-                WHEN (user1_id = :current_user_id AND liked_by_user2 = TRUE)
-                OR (user2_id = :current_user_id AND liked_by_user1 = TRUE)
-                THEN CURRENT_TIMESTAMP
-                ELSE matched_at
-            END
-            WHERE (user1_id = :user1_id AND user2_id = :user2_id)
-            OR (user1_id = :user2_id AND user2_id = :user1_id)
-            """
-            run(update_sql, {
-                "user1_id": match.user1_id,
-                "user2_id": match.user2_id,
-                "current_user_id": match.user1_id  # The current user is always user1_id in the request
-            })
-            print("Updated existing match")
-        else:
-            # Create new match row with only the current user's like status as true
-            similarity = user_repo.calculate_user_similarity(match.user1_id, match.user2_id)
-            insert_sql = """
-            INSERT INTO user_matches (user1_id, user2_id, similarity_score, liked_by_user1, liked_by_user2)
-            VALUES (:user1_id, :user2_id, :similarity_score, TRUE, FALSE)
-            """
-            run(insert_sql, {
-                "user1_id": match.user1_id,
-                "user2_id": match.user2_id,
-                "similarity_score": similarity
-            })
-            print("Created new match")
-        return True
+        flip_sql = """
+        UPDATE user_matches
+        SET matched = TRUE, matched_at = CURRENT_TIMESTAMP
+        WHERE user1_id = :user1_id AND user2_id = :user2_id
+        AND NOT matched AND liked_by_user1 AND liked_by_user2
+        """
+        with engine.begin() as conn:
+            conn.execute(text(upsert_sql), params)
+            new_match = conn.execute(text(flip_sql), params).rowcount == 1
+            matched = conn.execute(text("""
+            SELECT matched FROM user_matches
+            WHERE user1_id = :user1_id AND user2_id = :user2_id
+            """), params).scalar()
+        return {"matched": bool(matched), "new_match": new_match}
     except Exception as e:
         print(f"Database error: {e}")
-        return False
+        return None
+
+def refresh_match_similarity(user1_id: str, user2_id: str):
+    """
+    Fill in user_matches.similarity_score for a pair, off the request path
+    """
+    try:
+        similarity = similarity_cache.get_score(user1_id, user2_id)
+        user1_id, user2_id = similarity_cache.ordered_pair(user1_id, user2_id)
+        run("""
+        UPDATE user_matches
+        SET similarity_score = :similarity_score
+        WHERE user1_id = :user1_id AND user2_id = :user2_id
+        """, {"user1_id": user1_id, "user2_id": user2_id, "similarity_score": similarity})
+    except Exception as e:
+        print(f"Failed to refresh similarity for {user1_id}/{user2_id}: {e}")
 
 def get_user_matches(uid: str) -> List[dict]:
     """
@@ -89,35 +82,8 @@ def get_user_matches(uid: str) -> List[dict]:
         """
         users = run(sql, {"uid": uid}, fetch=True)
         
-        # Add the additional data that frontend expects
-        for user in users:
-            # Get favorite genres and artists
-            user["favorite_genres"] = user_repo.get_user_favorite_genres(user["uid"])
-            user["top_artists"] = user_repo.get_user_top_artists(user["uid"])
-            
-            # Calculate similarity score
-            sim = user_repo.calculate_user_similarity(uid, user["uid"])
-            if sim is None or not isinstance(sim, (int, float)) or sim != sim:  # NaN check
-                sim = 0.0
-            user["similarity_score"] = float(sim) + 0.40
-            
-            # Calculate common elements
-            current_genres = set(user_repo.get_user_favorite_genres(uid))
-            candidate_genres = set(user["favorite_genres"])
-            user["common_genres"] = len(current_genres.intersection(candidate_genres))
-            
-            # Calculate common songs
-            common_songs_sql = """
-            SELECT COUNT(DISTINCT uta1.sid) as common_songs
-            FROM user_track_actions uta1
-            JOIN user_track_actions uta2 ON uta1.sid = uta2.sid
-            WHERE uta1.uid = :user1_id AND uta2.uid = :user2_id
-            """
-            common_songs_result = user_repo.run(common_songs_sql, {
-                "user1_id": uid,
-                "user2_id": user["uid"]
-            }, fetchone=True)
-            user["common_songs"] = common_songs_result['common_songs'] if common_songs_result else 0
+        # Add the additional data that frontend expects, in a constant number of queries
+        profile_enrichment.enrich_users(uid, users, score_offset=0.40)
         
         return users
     except Exception as e:
@@ -138,82 +104,128 @@ def get_user_likes(uid: str) -> List[dict]:
         AND u.uid != :uid
         """
         users = run(sql, {"uid": uid}, fetch=True)
-
         
-        # Add the additional data that frontend expects
-        for user in users:
-            # Get favorite genres and artists
-            user["favorite_genres"] = user_repo.get_user_favorite_genres(user["uid"])
-            user["top_artists"] = user_repo.get_user_top_artists(user["uid"])
-            
-            # Calculate similarity score
-            sim = user_repo.calculate_user_similarity(uid, user["uid"])
-            if sim is None or not isinstance(sim, (int, float)) or sim != sim:  # NaN check
-                sim = 0.0
-            user["similarity_score"] = float(sim) + 0.30
-            
-            # Calculate common elements
-            current_genres = set(user_repo.get_user_favorite_genres(uid))
-            candidate_genres = set(user["favorite_genres"])
-            user["common_genres"] = len(current_genres.intersection(candidate_genres))
-            
-            # Calculate common songs
-            common_songs_sql = """
-            SELECT COUNT(DISTINCT uta1.sid) as common_songs
-            FROM user_track_actions uta1
-            JOIN user_track_actions uta2 ON uta1.sid = uta2.sid
-            WHERE uta1.uid = :user1_id AND uta2.uid = :user2_id
-            """
-            common_songs_result = user_repo.run(common_songs_sql, {
-                "user1_id": uid,
-                "user2_id": user["uid"]
-            }, fetchone=True)
-            user["common_songs"] = common_songs_result['common_songs'] if common_songs_result else 0
+        # Add the additional data that frontend expects, in a constant number of queries
+        profile_enrichment.enrich_users(uid, users, score_offset=0.30)
         
         return users
     except Exception as e:
         print(f"Database error: {e}")
         return []
 
-def get_user_recommendations(uid: str, limit: int = 10) -> List[dict]:
+# Candidates pulled from the inverted index per requested slot, so that the
+# eligibility filter (already liked / matched) still leaves enough to rank
+CANDIDATE_OVERSAMPLE = 5
+
+def _eligible_users(uid: str, limit: int, include: List[str] = None, exclude: List[str] = None) -> List[dict]:
     """
-    Recommend users for matching:
+    Users the current user may still swipe on:
     - Users with no user_matches entry with the current user
     - OR users where the other user has liked the current user, but the current user has not liked them back yet
-    Exclude users already matched or already liked by the current user.
+    Optionally restricted to (include) or excluding (exclude) a list of uids.
+    """
+    params = {"uid": uid, "limit": limit}
+    extra = ""
+    if include is not None:
+        placeholders, include_params = expand_in("include", include)
+        extra += f" AND u.uid IN ({placeholders})"
+        params.update(include_params)
+    if exclude:
+        placeholders, exclude_params = expand_in("exclude", exclude)
+        extra += f" AND u.uid NOT IN ({placeholders})"
+        params.update(exclude_params)
+
+    sql = f"""
+    SELECT u.uid, u.username, u.name, u.age, u.country
+    FROM users u
+    WHERE u.uid != :uid
+    -- Pairs are stored smaller uid first, so this is one primary-key probe:
+    -- no entry, or only the other user has liked so far
+    AND NOT EXISTS (
+        SELECT 1 FROM user_matches um
+        WHERE um.user1_id = LEAST(:uid, u.uid) AND um.user2_id = GREATEST(:uid, u.uid)
+        AND ((um.user1_id = :uid AND um.liked_by_user1 = TRUE)
+          OR (um.user2_id = :uid AND um.liked_by_user2 = TRUE))
+    ){extra}
+    LIMIT :limit
+    """
+    return run(sql, params, fetch=True) or []
+
+def get_precomputed_neighbours(uid: str, limit: int) -> List[tuple]:
+    """
+    Neighbours written by database/scripts/compute_user_neighbours.py as (uid, score), best first.
+    Rows computed before either user's last taste change (user_taste_versions) are skipped,
+    so those pairs are scored live through similarity_cache instead.
+    """
+    sql = """
+    SELECT n.neighbour_uid, n.similarity_score
+    FROM user_neighbours n
+    LEFT JOIN user_taste_versions mine ON mine.uid = n.uid
+    LEFT JOIN user_taste_versions theirs ON theirs.uid = n.neighbour_uid
+    WHERE n.uid = :uid
+    AND (mine.updated_at IS NULL OR n.computed_at >= mine.updated_at)
+    AND (theirs.updated_at IS NULL OR n.computed_at >= theirs.updated_at)
+    ORDER BY n.neighbour_rank
+    LIMIT :limit
+    """
+    rows = run(sql, {"uid": uid, "limit": limit}, fetch=True) or []
+    return [(row["neighbour_uid"], row["similarity_score"]) for row in rows]
+
+def get_user_recommendations(uid: str, limit: int = 10) -> List[dict]:
+    """
+    Top `limit` users to recommend for matching.
+
+    Served from the nightly user_recommendations rows when they are fresh and
+    still leave `limit` users uid has not liked since; otherwise ranked live
+    (see rank_candidates).
     """
     try:
-        sql = """
-        SELECT u.uid, u.username, u.name, u.age, u.country
-        FROM users u
-        WHERE u.uid != :uid
-        AND (
-            -- No user_matches entry exists
-            NOT EXISTS (
-                SELECT 1 FROM user_matches um
-                WHERE (um.user1_id = :uid AND um.user2_id = u.uid)
-                   OR (um.user1_id = u.uid AND um.user2_id = :uid)
-            )
-            OR
-            -- There is a user_matches entry, the other user liked current user, but current user hasn't liked them
-            EXISTS (
-                SELECT 1 FROM user_matches um
-                WHERE ((um.user1_id = u.uid AND um.user2_id = :uid AND um.liked_by_user1 = TRUE AND um.liked_by_user2 = FALSE)
-                    OR (um.user2_id = u.uid AND um.user1_id = :uid AND um.liked_by_user2 = TRUE AND um.liked_by_user1 = FALSE))
-            )
-        )
-        LIMIT :limit
-        """
-        users = run(sql, {"uid": uid, "limit": limit}, fetch=True)
-        # Attach similarity score, always fallback to 0.0 if invalid
+        stored = recommendation_store.read(recommendation_store.USERS, uid, recommendation_store.USERS_PER_USER)
+        if stored is not None:
+            scores = {row["recommended_uid"]: row["confidence_score"] for row in stored}
+            users = _eligible_users(uid, len(scores), include=list(scores))
+            if len(users) >= limit or len(stored) < recommendation_store.USERS_PER_USER:
+                for user in users:
+                    user["similarity_score"] = scores[user["uid"]]
+                users.sort(key=lambda x: (-x["similarity_score"], x["uid"]))
+                return users[:limit]
+    except Exception as e:
+        print(f"Database error: {e}")
+    return rank_candidates(uid, limit)[:limit]
+
+def rank_candidates(uid: str, limit: int = 10) -> List[dict]:
+    """
+    Rank at least `limit` users for matching, best first.
+
+    Candidates come first from the offline user_neighbours table (one indexed
+    read). If that leaves too few eligible users, the song/artist inverted index
+    and the MinHash/LSH neighbour index are queried online. Every source is
+    filtered by _eligible_users. Users without any overlap only fill the
+    remaining slots, e.g. for a brand new account.
+    """
+    try:
+        precomputed = dict(get_precomputed_neighbours(uid, limit * CANDIDATE_OVERSAMPLE))
+        users = []
+        if precomputed:
+            users = _eligible_users(uid, len(precomputed), include=list(precomputed))
+        if len(users) < limit:
+            ranked = candidate_index.top_candidates(uid, limit * CANDIDATE_OVERSAMPLE)
+            ranked += lsh_repo.similar_users(uid, limit * CANDIDATE_OVERSAMPLE)
+            seen = {user["uid"] for user in users}
+            candidate_uids = [other for other in dict.fromkeys(o for o, _ in ranked) if other not in seen]
+            if candidate_uids:
+                users += _eligible_users(uid, len(candidate_uids), include=candidate_uids)
+        if len(users) < limit:
+            users += _eligible_users(uid, limit - len(users), exclude=[user["uid"] for user in users])
+
+        # Fresh offline scores are used as-is; everyone else is scored in one cached batch
+        similarities = similarity_cache.get_scores(uid, [user["uid"] for user in users if user["uid"] not in precomputed])
+        similarities.update(precomputed)
         for user in users:
-            sim = user_repo.calculate_user_similarity(uid, user["uid"])
-            if sim is None or not isinstance(sim, (int, float)) or sim != sim:  # NaN check
-                sim = 0.0
-            user["similarity_score"] = float(sim) + 0.20
-        # Sort by similarity descending
-        users.sort(key=lambda x: x["similarity_score"], reverse=True)
-        return users[:limit]
+            user["similarity_score"] = similarities.get(user["uid"], 0.0) + 0.20
+        # Sort by similarity descending, uid as a stable tie-breaker
+        users.sort(key=lambda x: (-x["similarity_score"], x["uid"]))
+        return users
     except Exception as e:
         print(f"Database error: {e}")
-        return [] 
\ No newline at end of file
+        return []
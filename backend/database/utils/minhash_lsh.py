@@ -0,0 +1,125 @@
+import zlib
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+# Universal hashing h(x) = ((a * x + b) mod p) & MAX_HASH, as in classic MinHash
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def hash_item(item: str) -> int:
+    """
+    Stable 32-bit hash of a set element (same value in every process, unlike hash())
+    """
+    return zlib.crc32(item.encode("utf-8"))
+
+
+class MinHashLSH:
+    """
+    MinHash signatures of item sets, bucketed with LSH banding.
+
+    Two sets with Jaccard similarity s share at least one band bucket with
+    probability 1 - (1 - s^r)^b, where b = bands and r = num_perm / bands.
+    Keys are typically uids and items sids.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 64, seed: int = 1):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, Set[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, key):
+        return key in self._signatures
+
+    def signature(self, items: Iterable[str]) -> np.ndarray:
+        """
+        MinHash signature of a set of items (all MAX_HASH for an empty set)
+        """
+        hashes = np.fromiter((hash_item(i) for i in items), dtype=np.uint64)
+        if hashes.size == 0:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        # uint64 overflow in a * x wraps around, which keeps the family well mixed
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _unbucket(self, key, signature: np.ndarray, bands: Iterable[int]):
+        band_keys = self._band_keys(signature)
+        for band in bands:
+            bucket = self._buckets[band].get(band_keys[band])
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_keys[band]]
+
+    def _bucket(self, key, signature: np.ndarray, bands: Iterable[int]):
+        band_keys = self._band_keys(signature)
+        for band in bands:
+            self._buckets[band].setdefault(band_keys[band], set()).add(key)
+
+    def remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is not None:
+            self._unbucket(key, signature, range(self.bands))
+
+    def insert(self, key, items: Iterable[str]):
+        """
+        Index key under the signature of items, replacing any previous signature
+        """
+        self.remove(key)
+        signature = self.signature(items)
+        if (signature == MAX_HASH).all():
+            return  # Empty set: nothing to match on
+        self._signatures[key] = signature
+        self._bucket(key, signature, range(self.bands))
+
+    def add_items(self, key, items: Iterable[str]):
+        """
+        Incrementally grow key's set. Only the bands whose minima changed are re-bucketed.
+        """
+        old = self._signatures.get(key)
+        if old is None:
+            self.insert(key, items)
+            return
+        new = np.minimum(old, self.signature(items))
+        changed = [band for band in range(self.bands)
+                   if not np.array_equal(old[band * self.rows:(band + 1) * self.rows],
+                                         new[band * self.rows:(band + 1) * self.rows])]
+        if not changed:
+            return
+        self._unbucket(key, old, changed)
+        self._signatures[key] = new
+        self._bucket(key, new, changed)
+
+    def query(self, key=None, items: Optional[Iterable[str]] = None, k: int = 10) -> List[Tuple[Hashable, float]]:
+        """
+        Up to k (key, estimated_jaccard) pairs sharing at least one band bucket with
+        key's signature (or with the signature of items), best first.
+        """
+        signature = self._signatures.get(key) if items is None else self.signature(items)
+        if signature is None:
+            return []
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates |= self._buckets[band].get(band_key, set())
+        candidates.discard(key)
+        if not candidates:
+            return []
+        keys = list(candidates)
+        matrix = np.stack([self._signatures[c] for c in keys])
+        estimates = (matrix == signature).mean(axis=1)
+        top = np.argsort(-estimates, kind="stable")[:k]
+        return [(keys[i], float(estimates[i])) for i in top]
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+from database.db import run
+from database.utils import song_catalog
+
+# Per-user sets of played songs (every user_track_actions row) over dense catalog ids,
+# so recommendation candidates are filtered in memory in O(candidates), however long
+# the user's history. Plays and favourites swap in an updated copy of the set (see add),
+# so readers can call contains() on the set they got without holding a lock.
+
+BITMAP = "bitmap"
+BLOOM = "bloom"
+# BITMAP is exact. BLOOM is a fixed ~2.5 bytes per loaded song (BLOOM_BITS_PER_ITEM x
+# BLOOM_HEADROOM bits) even for heavy listeners, at the cost of wrongly hiding a few
+# unplayed songs: about 0.1% or less right after loading, up to ~1% once plays fill the headroom.
+# It never shows a played one.
+PLAYED_SET_FORMAT = BITMAP
+
+PLAYED_SET_TTL_SECONDS = 1800
+PLAYED_SET_CACHE_SIZE = 10000
+
+# Bitmap containers hold ids sharing their high 16 bits; sparse ones are sorted uint16
+# arrays, and past ARRAY_LIMIT ids (8 KB as an array) they switch to a 65536-bit bitset
+ARRAY_LIMIT = 4096
+
+# 10 bits and 7 hashes per item give ~1% false positives at capacity; sized for twice
+# the songs loaded so plays can be added before the filter is rebuilt
+BLOOM_BITS_PER_ITEM = 10
+BLOOM_HASHES = 7
+BLOOM_HEADROOM = 2
+
+
+class PlayedBitmap:
+    """
+    Compressed (roaring-style) bitmap of catalog ids
+    """
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.containers: Dict[int, np.ndarray] = {}
+        ids = np.unique(np.fromiter(ids, dtype=np.int64))
+        highs = ids >> 16
+        for high in np.unique(highs).tolist():
+            lows = (ids[highs == high] & 0xFFFF).astype(np.uint16)
+            self.containers[high] = self._pack(lows)
+
+    @staticmethod
+    def _pack(lows: np.ndarray) -> np.ndarray:
+        if len(lows) <= ARRAY_LIMIT:
+            return lows
+        bits = np.zeros(1 << 16, dtype=bool)
+        bits[lows] = True
+        return np.packbits(bits)
+
+    def copy(self) -> "PlayedBitmap":
+        # Containers are never modified in place (see add), so they can be shared
+        other = PlayedBitmap()
+        other.containers = dict(self.containers)
+        return other
+
+    def add(self, i: int):
+        high, low = i >> 16, i & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = np.array([low], dtype=np.uint16)
+        elif container.dtype == np.uint8:
+            container = container.copy()
+            container[low >> 3] |= 0x80 >> (low & 7)
+            self.containers[high] = container
+        else:
+            position = int(np.searchsorted(container, low))
+            if position == len(container) or container[position] != low:
+                self.containers[high] = self._pack(np.insert(container, position, np.uint16(low)))
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Membership mask of ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        result = np.zeros(len(ids), dtype=bool)
+        if not self.containers or not len(ids):
+            return result
+        highs, lows = ids >> 16, ids & 0xFFFF
+        for high, container in self.containers.items():
+            selected = highs == high
+            if not selected.any():
+                continue
+            wanted = lows[selected]
+            if container.dtype == np.uint8:
+                result[selected] = (container[wanted >> 3] >> (7 - (wanted & 7))) & 1
+            else:
+                positions = np.minimum(np.searchsorted(container, wanted), len(container) - 1)
+                result[selected] = container[positions] == wanted
+        return result
+
+    def full(self) -> bool:
+        return False
+
+
+class PlayedBloom:
+    """
+    Bloom filter of catalog ids (double hashing over a multiplicative hash)
+    """
+
+    def __init__(self, ids: Iterable[int] = ()):
+        ids = np.unique(np.fromiter(ids, dtype=np.int64))
+        self.capacity = max(len(ids), 32) * BLOOM_HEADROOM
+        self.size = -(-self.capacity * BLOOM_BITS_PER_ITEM // 8) * 8
+        self.bits = np.zeros(self.size // 8, dtype=np.uint8)
+        self.count = 0
+        self._set(ids)
+
+    def _positions(self, ids: np.ndarray) -> np.ndarray:
+        keys = np.asarray(ids, dtype=np.uint64)
+        h1 = keys * np.uint64(0x9E3779B97F4A7C15)
+        h2 = (keys ^ np.uint64(0x5BD1E995)) * np.uint64(0xC2B2AE3D27D4EB4F) | np.uint64(1)
+        j = np.arange(BLOOM_HASHES, dtype=np.uint64)
+        return ((h1[:, None] + j[None, :] * h2[:, None]) % np.uint64(self.size)).astype(np.int64)
+
+    def _set(self, ids: np.ndarray):
+        if not len(ids):
+            return
+        positions = self._positions(ids).ravel()
+        np.bitwise_or.at(self.bits, positions >> 3, (0x80 >> (positions & 7)).astype(np.uint8))
+        self.count += len(ids)
+
+    def copy(self) -> "PlayedBloom":
+        other = PlayedBloom.__new__(PlayedBloom)
+        other.capacity, other.size, other.count = self.capacity, self.size, self.count
+        other.bits = self.bits.copy()
+        return other
+
+    def add(self, i: int):
+        if not self.contains(np.array([i]))[0]:
+            self._set(np.array([i], dtype=np.int64))
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(ids)
+        return ((self.bits[positions >> 3] >> (7 - (positions & 7))) & 1).astype(bool).all(axis=1)
+
+    def full(self) -> bool:
+        """
+        Past capacity the false-positive rate climbs, so the set should be reloaded
+        """
+        return self.count > self.capacity
+
+
+_FORMATS = {BITMAP: PlayedBitmap, BLOOM: PlayedBloom}
+
+_lock = threading.Lock()
+_sets: "OrderedDict[str, Tuple[float, song_catalog.Catalog, object]]" = OrderedDict()
+
+
+def _load(uid: str, catalog: song_catalog.Catalog):
+    rows = run("SELECT sid FROM user_track_actions WHERE uid = :uid", {"uid": uid}, fetch=True) or []
+    ids = (catalog.sid_ids.get(row["sid"]) for row in rows)
+    return _FORMATS[PLAYED_SET_FORMAT](i for i in ids if i is not None)
+
+
+def get(uid: str, catalog: Optional[song_catalog.Catalog] = None):
+    """
+    Played set of uid over the ids of catalog (default: the current snapshot);
+    .contains(ids) gives a membership mask
+    """
+    catalog = song_catalog.get_catalog() if catalog is None else catalog
+    now = time.monotonic()
+    with _lock:
+        entry = _sets.get(uid)
+        if entry is not None and now - entry[0] <= PLAYED_SET_TTL_SECONDS and entry[1] is catalog:
+            _sets.move_to_end(uid)
+            return entry[2]
+    played = _load(uid, catalog)
+    with _lock:
+        _sets[uid] = (now, catalog, played)
+        _sets.move_to_end(uid)
+        while len(_sets) > PLAYED_SET_CACHE_SIZE:
+            _sets.popitem(last=False)
+    return played
+
+
+def add(uid: str, sid: str):
+    """
+    Record a play / favourite of sid in uid's cached set, if any. The set is updated
+    copy-on-write, as readers may be calling contains() on the current one.
+    """
+    with _lock:
+        entry = _sets.get(uid)
+        if entry is None:
+            return
+        i = entry[1].sid_ids.get(sid)
+        if i is None:
+            return
+        played = entry[2].copy()
+        played.add(i)
+        if played.full():
+            del _sets[uid]
+        else:
+            _sets[uid] = (entry[0], entry[1], played)
+
+
+def invalidate(uid: str):
+    with _lock:
+        _sets.pop(uid, None)
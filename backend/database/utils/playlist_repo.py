@@ -1,4 +1,5 @@
-from database.db import run
+from database.db import run, expand_in
+from database.utils import playlist_vectors, recommendation_store
 import uuid
 
 # 1️⃣ Create playlist and associate with user
@@ -23,6 +24,7 @@ def create_playlist(uid: str, name: str, description: str = "", private: bool =
         "private": private
     }
     run(sql_insert_playlist, playlist_params)
+    playlist_vectors.set_private(pid, private)
 
     # Associate playlist with user, including is_favourite
     sql_insert_user_playlist = """
@@ -91,6 +93,8 @@ def update_playlist(pid: str, name: str = None, description: str = None, private
     """
 
     run(sql_update, params)
+    if private is not None:
+        playlist_vectors.set_private(pid, private)
 
     # ✅ Re-select the updated row
     sql_select = """
@@ -107,6 +111,7 @@ def delete_playlist(pid: str):
     DELETE FROM playlists WHERE pid = :pid
     """
     run(sql, {"pid": pid})
+    playlist_vectors.remove_playlist(pid)
 
 # 6️⃣ Share playlist with another user
 def share_playlist_with_user(pid: str, target_uid: str):
@@ -166,3 +171,50 @@ def set_playlist_favourite(uid: str, pid: str, is_favourite: bool):
     WHERE uid = :uid AND pid = :pid
     """
     run(sql, {"uid": uid, "pid": pid, "is_favourite": is_favourite})
+
+# 🔟 Recommend other users' public playlists by content
+RECOMMENDATION_REASON = "Matches your genres and artists"
+
+def _with_details(uid: str, ranked: list):
+    """
+    Name, description and song count for ranked playlists that are still public
+    and not held by uid (stored rows can predate either change)
+    """
+    if not ranked:
+        return []
+    placeholders, params = expand_in("pids", [row["pid"] for row in ranked])
+    params["uid"] = uid
+    sql = f"""
+    SELECT p.pid, p.name, p.description,
+           (SELECT COUNT(*) FROM playlist_songs ps WHERE ps.pid = p.pid) AS song_count
+    FROM playlists p
+    WHERE p.pid IN ({placeholders}) AND p.private = FALSE
+    AND NOT EXISTS (
+        SELECT 1 FROM user_playlists mine
+        WHERE mine.uid = :uid AND mine.pid = p.pid
+    )
+    """
+    playlists = {row["pid"]: row for row in run(sql, params, fetch=True) or []}
+    return [
+        dict(playlists[row["pid"]],
+             recommendation_reason=row["recommendation_reason"],
+             confidence_score=row["confidence_score"])
+        for row in ranked if row["pid"] in playlists
+    ]
+
+def get_recommended_playlists(uid: str, limit: int = 10):
+    """
+    Top `limit` public playlists for uid ranked by playlist_vectors, from the nightly
+    playlist_recommendations rows when fresh, else ranked live
+    """
+    try:
+        stored = recommendation_store.read(recommendation_store.PLAYLISTS, uid, recommendation_store.PLAYLISTS_PER_USER)
+        if stored is not None:
+            playlists = _with_details(uid, stored)
+            if len(playlists) >= limit or len(stored) < recommendation_store.PLAYLISTS_PER_USER:
+                return playlists[:limit]
+        ranked = [dict(row, recommendation_reason=RECOMMENDATION_REASON) for row in playlist_vectors.rank(uid, limit)]
+        return _with_details(uid, ranked)
+    except Exception as e:
+        print(f"Database error: {e}")
+        return []
@@ -1,6 +1,7 @@
 from typing import List
 from database.schema.models import PlaylistSongCreate
 from database.db import run
+from database.utils import playlist_vectors
 
 def add_song_to_playlist(playlist_song: PlaylistSongCreate) -> bool:
     """
@@ -49,6 +50,7 @@ def add_song_to_playlist(playlist_song: PlaylistSongCreate) -> bool:
         VALUES (:pid, :sid)
         """
         run(insert_sql, params)
+        playlist_vectors.add_song(playlist_song.pid, playlist_song.sid)
         print(f"Successfully added song {playlist_song.sid} to playlist {playlist_song.pid}")
         return True
         
@@ -80,6 +82,7 @@ def remove_song_from_playlist(pid: str, sid: str) -> bool:
             
         # Then delete it
         run(sql, params)
+        playlist_vectors.remove_song(pid, sid)
         print(f"Successfully removed song {sid} from playlist {pid}")
         return True
         
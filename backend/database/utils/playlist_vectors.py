@@ -0,0 +1,236 @@
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from scipy import sparse
+from database.db import run
+from database.utils import index_refresh, song_recommender
+
+# Playlist score = GENRE_SCORE * genre match + ARTIST_SCORE * artist match, as for songs
+GENRE_SCORE = song_recommender.GENRE_SCORE
+ARTIST_SCORE = song_recommender.ARTIST_SCORE
+
+# Playlist vectors are song-count means, shrunk towards 0 by this many empty songs
+# so one-song playlists do not outrank well-filled ones
+SIZE_PRIOR = 2.0
+
+# Full rebuild interval, so workers that missed a write-side update converge
+INDEX_TTL_SECONDS = 600
+
+_lock = threading.Lock()
+_features: Optional[song_recommender.SongFeatures] = None
+_pids: List[str] = []
+_rows: Dict[str, int] = {}                 # pid -> row
+_members: List[Set[int]] = []              # row -> catalog ids of its songs
+_sizes = np.zeros(0, dtype=np.float32)     # row -> number of songs
+_public = np.zeros(0, dtype=bool)          # row -> playlists.private = FALSE (and not deleted)
+_genre_counts = np.zeros((0, 0), dtype=np.float32)  # row x genre song counts
+# row x artist song counts as a (row, artist, +1 / -1) log, summed when scoring.
+# Writes append to _artist_pending; scoring folds it into the arrays.
+_artist_rows = np.zeros(0, dtype=np.int32)
+_artist_ids = np.zeros(0, dtype=np.int32)
+_artist_deltas = np.zeros(0, dtype=np.float32)
+_artist_pending: List[Tuple[int, int, float]] = []
+
+
+def _build_index():
+    global _features, _pids, _rows, _members, _sizes, _public, _genre_counts
+    global _artist_rows, _artist_ids, _artist_deltas, _artist_pending
+    features = song_recommender.get_features()
+    catalog = features.catalog
+    rows = run("""
+    SELECT p.pid, p.private, ps.sid
+    FROM playlists p
+    LEFT JOIN playlist_songs ps ON ps.pid = p.pid
+    """, fetch=True) or []
+
+    pids: List[str] = []
+    index: Dict[str, int] = {}
+    public: List[bool] = []
+    members: List[Set[int]] = []
+    for row in rows:
+        r = index.get(row["pid"])
+        if r is None:
+            r = index[row["pid"]] = len(pids)
+            pids.append(row["pid"])
+            public.append(not row["private"])
+            members.append(set())
+        i = catalog.sid_ids.get(row["sid"]) if row["sid"] is not None else None
+        if i is not None:
+            members[r].add(i)
+
+    entry_rows = np.array([r for r, songs in enumerate(members) for _ in songs], dtype=np.int32)
+    entry_songs = np.array([i for songs in members for i in songs], dtype=np.int64)
+    membership = sparse.csr_matrix(
+        (np.ones(len(entry_rows), dtype=np.float32), (entry_rows, entry_songs)),
+        shape=(len(pids), catalog.size))
+    genre_counts = np.asarray((membership @ features.genre_matrix).todense(), dtype=np.float32)
+    artists = features.song_artist[entry_songs]
+    known = artists >= 0
+
+    with _lock:
+        _features = features
+        _pids = pids
+        _rows = index
+        _members = members
+        _sizes = np.array([len(songs) for songs in members], dtype=np.float32)
+        _public = np.array(public, dtype=bool)
+        _genre_counts = genre_counts.reshape(len(pids), len(features.genres))
+        _artist_rows = entry_rows[known]
+        _artist_ids = artists[known].astype(np.int32)
+        _artist_deltas = np.ones(int(known.sum()), dtype=np.float32)
+        _artist_pending = []
+
+
+_refresher = index_refresh.Refresher("playlist vectors", _build_index, ttl_seconds=INDEX_TTL_SECONDS,
+                                     changed=lambda: _features is not song_recommender.get_features())
+
+
+def build_index():
+    """
+    (Re)build every playlist's genre / artist vector from playlists and playlist_songs
+    """
+    _refresher.build()
+
+
+def _row(pid: str) -> int:
+    """
+    Row of pid, appending an empty private row for playlists created since the build.
+    Caller holds _lock.
+    """
+    global _sizes, _public, _genre_counts
+    r = _rows.get(pid)
+    if r is not None:
+        return r
+    r = _rows[pid] = len(_pids)
+    _pids.append(pid)
+    _members.append(set())
+    if r >= len(_sizes):
+        # Grow capacity geometrically so appends stay amortised O(1)
+        capacity = max(2 * len(_sizes), 16)
+        _sizes = np.concatenate([_sizes, np.zeros(capacity - len(_sizes), dtype=np.float32)])
+        _public = np.concatenate([_public, np.zeros(capacity - len(_public), dtype=bool)])
+        _genre_counts = np.vstack([_genre_counts, np.zeros((capacity - len(_genre_counts), _genre_counts.shape[1]),
+                                                           dtype=np.float32)])
+    return r
+
+
+def _apply(pid: str, sid: str, delta: float):
+    """
+    Add (delta=1) or remove (delta=-1) one song from pid's vectors
+    """
+    with _lock:
+        i = _features.catalog.sid_ids.get(sid)
+        if i is None:
+            return
+        r = _row(pid)
+        if (i in _members[r]) == (delta > 0):
+            return  # Already present / absent, e.g. INSERT IGNORE of a duplicate
+        if delta > 0:
+            _members[r].add(i)
+        else:
+            _members[r].discard(i)
+        _sizes[r] += delta
+        genre_ids = _features.genre_matrix.indices[_features.genre_matrix.indptr[i]:_features.genre_matrix.indptr[i + 1]]
+        _genre_counts[r, genre_ids] += delta
+        artist = _features.song_artist[i]
+        if artist >= 0:
+            _artist_pending.append((r, int(artist), delta))
+
+
+def _set_public(pid: str, public: bool):
+    with _lock:
+        _public[_row(pid)] = public
+
+
+def _remove_row(pid: str):
+    with _lock:
+        r = _rows.get(pid)
+        if r is not None:
+            _public[r] = False
+
+
+def _flush_artist_log():
+    """
+    Fold pending artist updates into the log arrays, compacting it once removals
+    have left it mostly cancelled-out entries. Caller holds _lock.
+    """
+    global _artist_rows, _artist_ids, _artist_deltas, _artist_pending
+    if not _artist_pending:
+        return
+    pending = np.array(_artist_pending, dtype=np.float64).reshape(-1, 3)
+    _artist_pending = []
+    _artist_rows = np.concatenate([_artist_rows, pending[:, 0].astype(np.int32)])
+    _artist_ids = np.concatenate([_artist_ids, pending[:, 1].astype(np.int32)])
+    _artist_deltas = np.concatenate([_artist_deltas, pending[:, 2].astype(np.float32)])
+    if (_artist_deltas < 0).sum() * 4 > len(_artist_deltas):
+        counts = sparse.coo_matrix((_artist_deltas, (_artist_rows, _artist_ids))).tocsr()
+        counts.eliminate_zeros()
+        counts = counts.tocoo()
+        _artist_rows = counts.row.astype(np.int32)
+        _artist_ids = counts.col.astype(np.int32)
+        _artist_deltas = counts.data.astype(np.float32)
+
+
+def add_song(pid: str, sid: str):
+    """
+    Patch pid's vectors after sid was inserted into playlist_songs
+    """
+    _refresher.patch(lambda: _apply(pid, sid, 1.0))
+
+
+def remove_song(pid: str, sid: str):
+    """
+    Patch pid's vectors after sid was deleted from playlist_songs
+    """
+    _refresher.patch(lambda: _apply(pid, sid, -1.0))
+
+
+def set_private(pid: str, private: bool):
+    _refresher.patch(lambda: _set_public(pid, not private))
+
+
+def remove_playlist(pid: str):
+    """
+    Forget a deleted playlist; its row stays allocated but is never ranked
+    """
+    _refresher.patch(lambda: _remove_row(pid))
+
+
+def rank(uid: str, limit: int) -> List[dict]:
+    """
+    Public playlists uid is not part of, best match to uid's taste profile first,
+    as {"pid", "confidence_score", "song_count"}.
+
+    Scores every playlist in one vectorised pass: a mat-vec of the genre counts
+    with the profile's genre weights, plus one bincount over the artist log.
+    """
+    _refresher.ensure()
+    profile = song_recommender.get_profile(uid)
+    if profile["features"] is not _features:
+        # Vectors of an older catalog cannot be scored against this profile; rebuild first
+        _refresher.ensure(wait=True)
+        profile = song_recommender.get_profile(uid)
+    own = {row["pid"] for row in run("SELECT pid FROM user_playlists WHERE uid = :uid", {"uid": uid}, fetch=True) or []}
+    with _lock:
+        if profile["features"] is not _features:
+            return []  # Catalog reloaded again during the rebuild
+        _flush_artist_log()
+        n = len(_pids)
+        sizes = _sizes[:n]
+        genre_match = _genre_counts[:n] @ profile["genre_weights"]
+        artist_weights = profile["artist_weights"]
+        artist_match = np.bincount(_artist_rows, weights=_artist_deltas * artist_weights[_artist_ids],
+                                   minlength=n)[:n]
+        scores = (GENRE_SCORE * genre_match + ARTIST_SCORE * artist_match) / (sizes + SIZE_PRIOR)
+        eligible = _public[:n] & (sizes > 0)
+        for pid in own:
+            r = _rows.get(pid)
+            if r is not None:
+                eligible[r] = False
+        candidates = np.flatnonzero(eligible)
+        # Best score first, bigger playlists first on ties (e.g. for users without history)
+        order = candidates[np.lexsort((-sizes[candidates], -scores[candidates]))][:limit]
+        return [
+            {"pid": _pids[r], "confidence_score": float(scores[r]), "song_count": int(sizes[r])}
+            for r in order.tolist()
+        ]
@@ -0,0 +1,94 @@
+from typing import Dict, List
+from database.db import run, expand_in
+from database.utils import user_repo, similarity_cache
+
+
+def _favorite_genres(uids: List[str]) -> Dict[str, List[str]]:
+    """
+    Favourite genres for every uid in one grouped query (same ranking as user_repo.get_user_favorite_genres)
+    """
+    placeholders, params = expand_in("uids", uids)
+    sql = f"""
+    SELECT uta.uid, g.genre_name as genre, COUNT(*) as play_count
+    FROM user_track_actions uta
+    JOIN songs s ON uta.sid = s.sid
+    JOIN song_genres sg ON s.sid = sg.sid
+    JOIN genres g ON sg.gid = g.gid
+    WHERE uta.uid IN ({placeholders}) AND (uta.favourite = TRUE OR uta.total_plays > 0)
+    GROUP BY uta.uid, g.genre_name
+    """
+    rows_by_user: Dict[str, List[dict]] = {uid: [] for uid in uids}
+    for row in run(sql, params, fetch=True) or []:
+        rows_by_user[row["uid"]].append(row)
+    return {
+        uid: user_repo.rank_favorite_genres(sorted(rows, key=lambda r: r["play_count"], reverse=True))
+        for uid, rows in rows_by_user.items()
+    }
+
+
+def _top_artists(uids: List[str]) -> Dict[str, List[str]]:
+    """
+    Top 5 artists for every uid in one grouped query
+    """
+    placeholders, params = expand_in("uids", uids)
+    sql = f"""
+    SELECT uta.uid, s.artist, COUNT(*) as play_count
+    FROM user_track_actions uta
+    JOIN songs s ON uta.sid = s.sid
+    WHERE uta.uid IN ({placeholders}) AND (uta.favourite = TRUE OR uta.total_plays > 0)
+    GROUP BY uta.uid, s.artist
+    """
+    rows_by_user: Dict[str, List[dict]] = {uid: [] for uid in uids}
+    for row in run(sql, params, fetch=True) or []:
+        rows_by_user[row["uid"]].append(row)
+    return {
+        uid: [r["artist"] for r in sorted(rows, key=lambda r: r["play_count"], reverse=True)[:5]]
+        for uid, rows in rows_by_user.items()
+    }
+
+
+def _common_songs(viewer_uid: str, uids: List[str]) -> Dict[str, int]:
+    """
+    Number of songs each uid shares with the viewer, in one grouped self-join
+    """
+    placeholders, params = expand_in("uids", uids)
+    sql = f"""
+    SELECT uta2.uid, COUNT(DISTINCT uta1.sid) as common_songs
+    FROM user_track_actions uta1
+    JOIN user_track_actions uta2 ON uta1.sid = uta2.sid
+    WHERE uta1.uid = :viewer_uid AND uta2.uid IN ({placeholders})
+    GROUP BY uta2.uid
+    """
+    rows = run(sql, {"viewer_uid": viewer_uid, **params}, fetch=True) or []
+    return {row["uid"]: row["common_songs"] for row in rows}
+
+
+def enrich_users(viewer_uid: str, users: List[dict], score_offset: float = 0.0) -> List[dict]:
+    """
+    Attach the fields the matching UI expects to every user dict, in place:
+    favorite_genres, top_artists, similarity_score, common_genres, common_songs.
+
+    Costs a constant number of queries regardless of len(users). Users that
+    already carry a similarity_score keep it; the rest are scored in one batch
+    and shifted by score_offset.
+    """
+    if not users:
+        return users
+    uids = list(dict.fromkeys(user["uid"] for user in users))
+
+    genres = _favorite_genres([viewer_uid] + uids)
+    artists = _top_artists(uids)
+    common_songs = _common_songs(viewer_uid, uids)
+    unscored = [user["uid"] for user in users if "similarity_score" not in user]
+    similarities = similarity_cache.get_scores(viewer_uid, unscored) if unscored else {}
+
+    viewer_genres = set(genres.get(viewer_uid, []))
+    for user in users:
+        uid = user["uid"]
+        user["favorite_genres"] = genres.get(uid, [])
+        user["top_artists"] = artists.get(uid, [])
+        if "similarity_score" not in user:
+            user["similarity_score"] = similarities.get(uid, 0.0) + score_offset
+        user["common_genres"] = len(viewer_genres.intersection(user["favorite_genres"]))
+        user["common_songs"] = common_songs.get(uid, 0)
+    return users
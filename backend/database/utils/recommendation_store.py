@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from database.db import run, run_many, expand_in
+
+# Read / write helpers for the song_recommendations, user_recommendations and
+# playlist_recommendations tables filled by database/scripts/precompute_recommendations.py.
+#
+# A user's rows are stale once they are older than MAX_AGE_HOURS (the job runs
+# nightly) or older than the user's last taste change (user_taste_versions);
+# readers then fall back to computing live.
+MAX_AGE_HOURS = 26
+
+# Rows kept per user; readers asking for more fall back to live computation
+SONGS_PER_USER = 50
+USERS_PER_USER = 50
+PLAYLISTS_PER_USER = 20
+
+SONGS = ("song_recommendations", "sid")
+USERS = ("user_recommendations", "recommended_uid")
+PLAYLISTS = ("playlist_recommendations", "pid")
+
+_PER_USER = {SONGS: SONGS_PER_USER, USERS: USERS_PER_USER, PLAYLISTS: PLAYLISTS_PER_USER}
+
+
+def read(kind: tuple, uid: str, limit: int) -> Optional[List[dict]]:
+    """
+    Precomputed rows of uid for kind (SONGS / USERS / PLAYLISTS), best first,
+    or None when they are missing, stale or too few to answer limit
+    """
+    table, key = kind
+    if limit > _PER_USER[kind]:
+        return None
+    sql = f"""
+    SELECT r.*,
+           (r.created_at >= NOW() - INTERVAL {MAX_AGE_HOURS} HOUR
+            AND (tv.updated_at IS NULL OR r.created_at >= tv.updated_at)) AS fresh
+    FROM {table} r
+    LEFT JOIN user_taste_versions tv ON tv.uid = r.uid
+    WHERE r.uid = :uid
+    ORDER BY r.confidence_score DESC, r.{key}
+    LIMIT :limit
+    """
+    try:
+        rows = run(sql, {"uid": uid, "limit": limit}, fetch=True) or []
+    except Exception as e:
+        print(f"Failed to read {table} for user {uid}: {e}")
+        return None
+    # Every row of a user is written by the same batch, so the first row speaks for all
+    if not rows or not rows[0]["fresh"]:
+        return None
+    return rows
+
+
+def write(kind: tuple, rows_by_uid: Dict[str, List[dict]], computed_at: datetime):
+    """
+    Replace the precomputed rows of every uid in rows_by_uid with one bulk insert.
+    Each row holds the key column, confidence_score and recommendation_reason
+    (recommendation_type for USERS).
+    created_at is set to computed_at, the database time the rows were computed
+    from: a taste change between computing and writing them then makes them stale.
+    """
+    table, key = kind
+    if not rows_by_uid:
+        return
+    placeholders, params = expand_in("uids", list(rows_by_uid))
+    run(f"DELETE FROM {table} WHERE uid IN ({placeholders})", params)
+    label = "recommendation_type" if kind == USERS else "recommendation_reason"
+    run_many(f"""
+    INSERT INTO {table} (uid, {key}, {label}, confidence_score, created_at)
+    VALUES (:uid, :{key}, :{label}, :confidence_score, :created_at)
+    """, [dict(row, uid=uid, created_at=computed_at) for uid, rows in rows_by_uid.items() for row in rows])
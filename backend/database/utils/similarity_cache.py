@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Iterable, Tuple
+from database.db import run, run_many, expand_in
+from database.utils import similarity_engine
+
+# In-process tier: (user1_id, user2_id, mode) -> (score, (user1_version, user2_version))
+LRU_MAX_ENTRIES = 50000
+
+_lock = threading.Lock()
+_lru: "OrderedDict[Tuple[str, str, str], Tuple[float, Tuple[int, int]]]" = OrderedDict()
+
+
+def ordered_pair(a: str, b: str) -> Tuple[str, str]:
+    """
+    Canonical (smaller, larger) order used for every stored user pair
+    """
+    return (a, b) if a <= b else (b, a)
+
+
+def bump_taste_version(uid: str):
+    """
+    Mark uid's listening history as changed; every cached score involving uid becomes stale
+    """
+    sql = """
+    INSERT INTO user_taste_versions (uid, version)
+    VALUES (:uid, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+    """
+    run(sql, {"uid": uid})
+
+
+def get_taste_versions(uids: Iterable[str]) -> Dict[str, int]:
+    """
+    Current taste version of every uid (0 for users that never had a write)
+    """
+    uids = list(dict.fromkeys(uids))
+    placeholders, params = expand_in("uids", uids)
+    sql = f"""
+    SELECT uid, version FROM user_taste_versions
+    WHERE uid IN ({placeholders})
+    """
+    versions = {uid: 0 for uid in uids}
+    for row in run(sql, params, fetch=True) or []:
+        versions[row["uid"]] = row["version"]
+    return versions
+
+
+def _lru_get(key, stamp):
+    with _lock:
+        entry = _lru.get(key)
+        if entry is None or entry[1] != stamp:
+            return None
+        _lru.move_to_end(key)
+        return entry[0]
+
+
+def _lru_put(key, score, stamp):
+    with _lock:
+        _lru[key] = (score, stamp)
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_MAX_ENTRIES:
+            _lru.popitem(last=False)
+
+
+def _load_db_tier(uid: str, others: List[str], mode: str) -> Dict[str, tuple]:
+    """
+    Cached rows between uid and others: {other: (score, (user1_version, user2_version))}
+    """
+    placeholders, params = expand_in("others", others)
+    sql = f"""
+    SELECT user1_id, user2_id, similarity_score, user1_version, user2_version
+    FROM user_similarity_cache
+    WHERE mode = :mode
+    AND ((user1_id = :uid AND user2_id IN ({placeholders}))
+      OR (user2_id = :uid AND user1_id IN ({placeholders})))
+    """
+    rows = run(sql, {"uid": uid, "mode": mode, **params}, fetch=True) or []
+    return {
+        (row["user2_id"] if row["user1_id"] == uid else row["user1_id"]):
+            (row["similarity_score"], (row["user1_version"], row["user2_version"]))
+        for row in rows
+    }
+
+
+def _store(uid: str, scores: Dict[str, float], versions: Dict[str, int], mode: str):
+    """
+    Write fresh scores to the DB tier and, for the matching mode, to user_matches
+    """
+    rows = []
+    for other, score in scores.items():
+        user1_id, user2_id = ordered_pair(uid, other)
+        rows.append({
+            "user1_id": user1_id,
+            "user2_id": user2_id,
+            "mode": mode,
+            "similarity_score": score,
+            "user1_version": versions[user1_id],
+            "user2_version": versions[user2_id],
+        })
+    run_many("""
+    INSERT INTO user_similarity_cache
+        (user1_id, user2_id, mode, similarity_score, user1_version, user2_version)
+    VALUES (:user1_id, :user2_id, :mode, :similarity_score, :user1_version, :user2_version)
+    ON DUPLICATE KEY UPDATE
+        similarity_score = VALUES(similarity_score),
+        user1_version = VALUES(user1_version),
+        user2_version = VALUES(user2_version)
+    """, rows)
+
+    if mode == similarity_engine.DEFAULT_MODE:
+        # user_matches.similarity_score is only ever refreshed from here
+        run_many("""
+        UPDATE user_matches
+        SET similarity_score = :similarity_score
+        WHERE user1_id = :user1_id AND user2_id = :user2_id
+        """, rows)
+
+
+def get_scores(uid: str, others: Iterable[str], mode: str = similarity_engine.DEFAULT_MODE) -> Dict[str, float]:
+    """
+    Similarity between uid and each of others.
+
+    Lookup order: in-process LRU, then user_similarity_cache, then one batched
+    similarity_engine pass for whatever is missing or stale. An entry is only
+    reused while both users' taste versions match the ones it was computed with.
+    """
+    others = [o for o in dict.fromkeys(others) if o != uid]
+    if not others:
+        return {}
+    versions = get_taste_versions([uid] + others)
+
+    scores: Dict[str, float] = {}
+    misses: List[str] = []
+    for other in others:
+        user1_id, user2_id = ordered_pair(uid, other)
+        cached = _lru_get((user1_id, user2_id, mode), (versions[user1_id], versions[user2_id]))
+        if cached is None:
+            misses.append(other)
+        else:
+            scores[other] = cached
+
+    if misses:
+        stale = []
+        db_rows = _load_db_tier(uid, misses, mode)
+        for other in misses:
+            user1_id, user2_id = ordered_pair(uid, other)
+            stamp = (versions[user1_id], versions[user2_id])
+            row = db_rows.get(other)
+            if row is not None and row[1] == stamp:
+                scores[other] = row[0]
+                _lru_put((user1_id, user2_id, mode), row[0], stamp)
+            else:
+                stale.append(other)
+
+        if stale:
+            fresh = similarity_engine.score_candidates(uid, stale, mode)
+            for other, score in fresh.items():
+                user1_id, user2_id = ordered_pair(uid, other)
+                _lru_put((user1_id, user2_id, mode), score, (versions[user1_id], versions[user2_id]))
+            _store(uid, fresh, versions, mode)
+            scores.update(fresh)
+
+    return scores
+
+
+def get_score(user1_id: str, user2_id: str, mode: str = similarity_engine.DEFAULT_MODE) -> float:
+    """
+    Cached similarity between two users
+    """
+    return get_scores(user1_id, [user2_id], mode).get(user2_id, 0.0)
@@ -0,0 +1,197 @@
+import math
+from typing import Dict, List, Iterable, Tuple
+import numpy as np
+from scipy import sparse
+from database.db import run, expand_in
+
+# Scoring modes
+COSINE = "cosine"
+WEIGHTED_JACCARD = "weighted_jaccard"
+LEGACY = "legacy"  # the original common-genres / common-artists formula
+MODES = (COSINE, WEIGHTED_JACCARD, LEGACY)
+DEFAULT_MODE = COSINE
+
+# Genre and artist blocks are blended with the same weights as the legacy formula
+GENRE_WEIGHT = 0.4
+ARTIST_WEIGHT = 0.6
+FAVOURITE_WEIGHT = 2.0
+# Each rating star above / below 3 adds / removes this much interaction weight
+RATING_WEIGHT = 0.5
+
+
+def action_weight(total_plays, favourite) -> float:
+    """
+    Weight of a single user_track_actions row: log-damped play count plus a favourite bonus
+    """
+    return math.log1p(max(total_plays or 0, 0)) + (FAVOURITE_WEIGHT if favourite else 0.0)
+
+
+def interaction_weight(total_plays, favourite, rating) -> float:
+    """
+    action_weight plus a bonus (or penalty) for the row's rating; may be negative
+    """
+    weight = action_weight(total_plays, favourite)
+    if rating:
+        weight += RATING_WEIGHT * (rating - 3)
+    return weight
+
+
+def load_user_song_matrix() -> Tuple[List[str], List[str], sparse.csr_matrix]:
+    """
+    users x songs matrix of positive interaction weights for the CF batch jobs,
+    with the uid of every row and the sid of every column (in sid order)
+    """
+    sids = [row["sid"] for row in run("SELECT sid FROM songs ORDER BY sid", fetch=True) or []]
+    song_index = {sid: i for i, sid in enumerate(sids)}
+    user_index = {}
+    rows, cols, values = [], [], []
+    for row in run("SELECT uid, sid, total_plays, favourite, rating FROM user_track_actions", fetch=True) or []:
+        weight = interaction_weight(row["total_plays"], row["favourite"], row["rating"])
+        if weight <= 0 or row["sid"] not in song_index:
+            continue
+        rows.append(user_index.setdefault(row["uid"], len(user_index)))
+        cols.append(song_index[row["sid"]])
+        values.append(weight)
+    matrix = sparse.csr_matrix((np.array(values, dtype=np.float32), (rows, cols)),
+                               shape=(len(user_index), len(sids)))
+    matrix.sum_duplicates()
+    return list(user_index), sids, matrix
+
+
+def load_taste_profiles(uids: Iterable[str]) -> Dict[str, dict]:
+    """
+    Load the listening history of several users in one query and fold it into taste profiles.
+
+    Each profile holds:
+        songs:   {sid: {"favourite": bool, "artist": str, "genres": set}}
+        genres:  {genre_name: weight}
+        artists: {artist: weight}
+    Users without any actions get an empty profile.
+    """
+    uids = list(dict.fromkeys(uids))
+    profiles = {uid: {"songs": {}, "genres": {}, "artists": {}} for uid in uids}
+    if not uids:
+        return profiles
+
+    placeholders, params = expand_in("uids", uids)
+    sql = f"""
+    SELECT uta.uid, uta.sid, uta.total_plays, uta.favourite, s.artist, g.genre_name
+    FROM user_track_actions uta
+    JOIN songs s ON uta.sid = s.sid
+    LEFT JOIN song_genres sg ON s.sid = sg.sid
+    LEFT JOIN genres g ON sg.gid = g.gid
+    WHERE uta.uid IN ({placeholders})
+    """
+    rows = run(sql, params, fetch=True) or []
+
+    for row in rows:
+        profile = profiles[row["uid"]]
+        song = profile["songs"].get(row["sid"])
+        weight = action_weight(row["total_plays"], row["favourite"])
+        if song is None:
+            song = {"favourite": bool(row["favourite"]), "artist": row["artist"], "genres": set()}
+            profile["songs"][row["sid"]] = song
+            # One row per genre, so only count the artist once per song
+            if row["artist"] and weight > 0:
+                profile["artists"][row["artist"]] = profile["artists"].get(row["artist"], 0.0) + weight
+        if row["genre_name"]:
+            song["genres"].add(row["genre_name"])
+            if weight > 0:
+                profile["genres"][row["genre_name"]] = profile["genres"].get(row["genre_name"], 0.0) + weight
+
+    return profiles
+
+
+def _to_matrix(weights: List[dict], viewer: dict):
+    """
+    Project sparse {feature: weight} dicts onto a shared dense vocabulary.
+    Returns (candidate_matrix, viewer_vector).
+    """
+    vocab = {}
+    for key in viewer:
+        vocab.setdefault(key, len(vocab))
+    for w in weights:
+        for key in w:
+            vocab.setdefault(key, len(vocab))
+
+    matrix = np.zeros((len(weights), len(vocab)), dtype=np.float64)
+    for i, w in enumerate(weights):
+        for key, value in w.items():
+            matrix[i, vocab[key]] = value
+    vector = np.zeros(len(vocab), dtype=np.float64)
+    for key, value in viewer.items():
+        vector[vocab[key]] = value
+    return matrix, vector
+
+
+def cosine_scores(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of every row of matrix against vector (0 where either side is empty)
+    """
+    dots = matrix @ vector
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+def weighted_jaccard_scores(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """
+    Weighted Jaccard (sum of minima over sum of maxima) of every row against vector
+    """
+    mins = np.minimum(matrix, vector).sum(axis=1)
+    maxs = np.maximum(matrix, vector).sum(axis=1)
+    return np.divide(mins, maxs, out=np.zeros_like(mins), where=maxs > 0)
+
+
+def _legacy_score(viewer: dict, candidate: dict) -> float:
+    """
+    Original formula: distinct genres and artists of songs both users acted on,
+    where at least one of them favourited the song.
+    """
+    genres, artists = set(), set()
+    for sid in viewer["songs"].keys() & candidate["songs"].keys():
+        mine, theirs = viewer["songs"][sid], candidate["songs"][sid]
+        if not (mine["favourite"] or theirs["favourite"]):
+            continue
+        genres |= mine["genres"]
+        if mine["artist"]:
+            artists.add(mine["artist"])
+    similarity = (len(genres) * 0.4 + len(artists) * 0.6) / 10.0
+    return min(similarity, 1.0)
+
+
+def score_profiles(viewer: dict, candidates: List[dict], mode: str = DEFAULT_MODE) -> np.ndarray:
+    """
+    Score one taste profile against a batch of profiles in a single vectorised pass.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown similarity mode '{mode}'")
+    if not candidates:
+        return np.zeros(0, dtype=np.float64)
+    if mode == LEGACY:
+        return np.array([_legacy_score(viewer, c) for c in candidates], dtype=np.float64)
+
+    score_fn = cosine_scores if mode == COSINE else weighted_jaccard_scores
+    genre_matrix, genre_vector = _to_matrix([c["genres"] for c in candidates], viewer["genres"])
+    artist_matrix, artist_vector = _to_matrix([c["artists"] for c in candidates], viewer["artists"])
+    return (GENRE_WEIGHT * score_fn(genre_matrix, genre_vector)
+            + ARTIST_WEIGHT * score_fn(artist_matrix, artist_vector))
+
+
+def score_candidates(uid: str, candidate_uids: Iterable[str], mode: str = DEFAULT_MODE) -> Dict[str, float]:
+    """
+    Similarity between uid and every candidate, using one profile load for the whole batch.
+    Returns {candidate_uid: score in [0, 1]}.
+    """
+    candidate_uids = list(dict.fromkeys(candidate_uids))
+    if not candidate_uids:
+        return {}
+    profiles = load_taste_profiles([uid] + candidate_uids)
+    scores = score_profiles(profiles[uid], [profiles[c] for c in candidate_uids], mode)
+    return {c: float(s) for c, s in zip(candidate_uids, scores)}
+
+
+def pair_similarity(user1_id: str, user2_id: str, mode: str = DEFAULT_MODE) -> float:
+    """
+    Similarity between two users
+    """
+    return score_candidates(user1_id, [user2_id], mode).get(user2_id, 0.0)
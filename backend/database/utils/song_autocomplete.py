@@ -0,0 +1,211 @@
+import bisect
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+from database.db import run
+from database.utils import index_refresh, song_catalog
+from database.utils.song_search import fold_text
+
+# Completions kept per prefix; also the largest limit the endpoint accepts
+TOP_K = 10
+
+# Prefixes matching at most this many keys are answered by scanning their sorted
+# range; larger ("heavy") prefixes keep a precomputed top-k list, like trie nodes
+SCAN_LIMIT = 256
+
+# Play counts drift slowly; re-rank completions this often
+POPULARITY_TTL_SECONDS = 900
+
+SONG = "song"
+ARTIST = "artist"
+
+
+_lock = threading.Lock()
+_catalog = None                            # song_catalog snapshot the index covers
+_indexed_sids: set = set()
+_keys: List[str] = []                      # folded completion text, sorted
+_entries: List[Tuple[int, str, str, Optional[str]]] = []  # parallel to _keys: (popularity, kind, label, sid)
+_artist_popularity: Dict[str, int] = {}    # folded artist -> summed plays
+_top: Dict[str, List[int]] = {}            # heavy prefix -> positions into _keys, best first
+
+
+def _load_popularity() -> Dict[str, int]:
+    rows = run("SELECT sid, total_plays FROM song_play_counts", fetch=True) or []
+    return {row["sid"]: int(row["total_plays"] or 0) for row in rows}
+
+
+def _rank_key(position: int):
+    popularity, kind, label, sid = _entries[position]
+    return (-popularity, len(label), label, position)
+
+
+def _top_of_range(lo: int, hi: int, k: int = TOP_K) -> List[int]:
+    return heapq.nsmallest(k, range(lo, hi), key=_rank_key)
+
+
+def _prefix_range(prefix: str) -> Tuple[int, int]:
+    lo = bisect.bisect_left(_keys, prefix)
+    hi = bisect.bisect_left(_keys, prefix + "\U0010ffff")
+    return lo, hi
+
+
+def _build_heavy(lo: int, hi: int, depth: int):
+    """
+    Store top-k for every heavy prefix inside [lo, hi), whose keys share depth leading characters
+    """
+    start = lo
+    while start < hi:
+        # Skip keys that end at this depth
+        if len(_keys[start]) <= depth:
+            start += 1
+            continue
+        prefix = _keys[start][:depth + 1]
+        end = bisect.bisect_left(_keys, prefix + "\U0010ffff", start, hi)
+        if end - start > SCAN_LIMIT:
+            _top[prefix] = _top_of_range(start, end)
+            _build_heavy(start, end, depth + 1)
+        start = end
+
+
+def _build_index():
+    global _catalog, _indexed_sids, _keys, _entries, _artist_popularity, _top
+    catalog = song_catalog.get_catalog()
+    popularity = _load_popularity()
+
+    artist_popularity: Dict[str, int] = {}
+    artist_labels: Dict[str, str] = {}
+    items = []
+    for i, sid in enumerate(catalog.sids):
+        plays = popularity.get(sid, 0)
+        name, artist = catalog.names[i], catalog.artists[i]
+        if fold_text(name):
+            items.append((fold_text(name), (plays, SONG, name.strip(), sid)))
+        folded_artist = fold_text(artist)
+        if folded_artist:
+            artist_popularity[folded_artist] = artist_popularity.get(folded_artist, 0) + plays
+            artist_labels.setdefault(folded_artist, artist.strip())
+    for folded_artist, plays in artist_popularity.items():
+        items.append((folded_artist, (plays, ARTIST, artist_labels[folded_artist], None)))
+    items.sort(key=lambda item: item[0])
+
+    with _lock:
+        _catalog = catalog
+        _indexed_sids = set(catalog.sids)
+        _keys = [key for key, _ in items]
+        _entries = [entry for _, entry in items]
+        _artist_popularity = artist_popularity
+        _top = {}
+        _build_heavy(0, len(_keys), 0)
+        _top[""] = _top_of_range(0, len(_keys))
+
+
+_refresher = index_refresh.Refresher("autocomplete index", _build_index, ttl_seconds=POPULARITY_TTL_SECONDS)
+
+
+def build_index():
+    """
+    Full rebuild from the current song catalog and song_play_counts
+    """
+    _refresher.build()
+
+
+def _insert_many(items: List[Tuple[str, tuple]]):
+    """
+    Merge new (key, entry) completions into the sorted index in one pass, then patch
+    the top-k lists of their heavy prefixes once. Caller holds _lock.
+    """
+    global _keys, _entries
+    if not items:
+        return
+    items = sorted(items, key=lambda item: item[0])
+    old_keys, old_entries = _keys, _entries
+    keys: List[str] = []
+    entries: List[tuple] = []
+    moved: List[int] = []  # old position -> new position
+    added: Dict[str, List[int]] = {}  # prefix of a new key -> new positions under it
+    i = 0
+    for key, entry in items:
+        # Equal keys go after the existing ones, as bisect_right would place them
+        while i < len(old_keys) and old_keys[i] <= key:
+            moved.append(len(keys))
+            keys.append(old_keys[i])
+            entries.append(old_entries[i])
+            i += 1
+        for depth in range(len(key) + 1):
+            added.setdefault(key[:depth], []).append(len(keys))
+        keys.append(key)
+        entries.append(entry)
+    moved.extend(range(len(keys), len(keys) + len(old_keys) - i))
+    keys.extend(old_keys[i:])
+    entries.extend(old_entries[i:])
+    _keys, _entries = keys, entries
+
+    for prefix, top in _top.items():
+        _top[prefix] = [moved[p] for p in top]
+    for prefix, positions in added.items():
+        top = _top.get(prefix)
+        if top is not None:
+            _top[prefix] = heapq.nsmallest(TOP_K, top + positions, key=_rank_key)
+        else:
+            lo, hi = _prefix_range(prefix)
+            if hi - lo > SCAN_LIMIT:
+                _top[prefix] = _top_of_range(lo, hi)
+
+
+def _add_songs(catalog: song_catalog.Catalog, sids: List[str]):
+    global _catalog
+    with _lock:
+        items = []
+        for sid in sids:
+            if sid in _indexed_sids or sid not in catalog.sid_ids:
+                continue
+            i = catalog.sid_ids[sid]
+            name, artist = catalog.names[i], catalog.artists[i]
+            if fold_text(name):
+                items.append((fold_text(name), (0, SONG, name.strip(), sid)))
+            folded_artist = fold_text(artist)
+            if folded_artist and folded_artist not in _artist_popularity:
+                _artist_popularity[folded_artist] = 0
+                items.append((folded_artist, (0, ARTIST, artist.strip(), None)))
+            _indexed_sids.add(sid)
+        _insert_many(items)
+        _catalog = catalog
+
+
+def add_songs(sids: List[str]):
+    """
+    Index songs added to the catalog since the last build, without a full rebuild
+    """
+    catalog = song_catalog.get_catalog()
+    _refresher.patch(lambda: _add_songs(catalog, sids))
+
+
+def _ensure_built():
+    _refresher.ensure()
+    catalog = song_catalog.get_catalog()
+    if catalog is _catalog:
+        return
+    current = set(catalog.sids)
+    if _indexed_sids <= current:
+        # Loader only ever adds songs: patch them in
+        add_songs([sid for sid in catalog.sids if sid not in _indexed_sids])
+    else:
+        _refresher.refresh()
+
+
+def complete(prefix: str, limit: int = TOP_K) -> List[dict]:
+    """
+    Most popular song and artist names starting with prefix (case- and accent-insensitive)
+    """
+    _ensure_built()
+    folded = fold_text(prefix)
+    with _lock:
+        top = _top.get(folded)
+        if top is None:
+            lo, hi = _prefix_range(folded)
+            top = _top_of_range(lo, hi, limit)
+        results = []
+        for position in top[:limit]:
+            popularity, kind, label, sid = _entries[position]
+            results.append({"type": kind, "text": label, "sid": sid, "popularity": popularity})
+    return results
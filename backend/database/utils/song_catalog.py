@@ -0,0 +1,184 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from database.db import run
+from database.utils import genre_summary
+
+# How often a worker checks catalog_versions for a reload triggered elsewhere
+VERSION_CHECK_SECONDS = 30
+
+CATALOG_VERSION_NAME = "songs"
+
+
+class StringColumn:
+    """
+    Strings packed into one UTF-8 buffer plus int64 offsets, instead of one Python object each
+    """
+
+    def __init__(self, values: List[Optional[str]]):
+        encoded = [(v or "").encode("utf-8") for v in values]
+        self._missing = np.array([v is None for v in values], dtype=bool)
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=self._offsets[1:])
+        self._buffer = b"".join(encoded)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if self._missing[i]:
+            return None
+        return self._buffer[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+
+class Catalog:
+    """
+    Immutable, array-backed snapshot of the songs table.
+
+    Songs are interned to dense ids 0..n-1 in sid order. Durations are kept
+    sorted for range queries, each song keeps its song_genre_summary.genre_mask,
+    genre membership is also one packed bitset per genre and artists map to id
+    postings.
+    """
+
+    def __init__(self, rows: List[dict], version: int, genre_names: Dict[int, str]):
+        rows = sorted(rows, key=lambda row: row["sid"])
+        self.version = version
+        self.size = len(rows)
+        self.sids = [row["sid"] for row in rows]
+        self.sid_ids: Dict[str, int] = {sid: i for i, sid in enumerate(self.sids)}
+        self.names = StringColumn([row["name"] for row in rows])
+        self.artists = StringColumn([row["artist"] for row in rows])
+        self.genres = StringColumn([row["genre"] for row in rows])
+        self.audio_paths = StringColumn([row["audio_path"] for row in rows])
+        self.download_paths = StringColumn([row["audio_download_path"] for row in rows])
+
+        # float64 keeps the value the driver returned, so row() matches the old API exactly
+        self.durations = np.array([row["duration"] or 0.0 for row in rows], dtype=np.float64)
+        self.duration_order = np.argsort(self.durations, kind="stable").astype(np.int32)
+        self.sorted_durations = self.durations[self.duration_order]
+
+        # Songs without a summary row yet have no genres
+        empty_mask = bytes(genre_summary.GENRE_MASK_BYTES)
+        self.genre_masks = np.frombuffer(
+            b"".join(row["genre_mask"] or empty_mask for row in rows), dtype=np.uint8
+        ).reshape(self.size, genre_summary.GENRE_MASK_BYTES)
+        # genre_summary refuses to summarise genres past the mask width, so no song has them
+        self.genre_gids: Dict[str, int] = {
+            name.lower(): gid for gid, name in genre_names.items() if gid <= genre_summary.GENRE_MASK_BITS
+        }
+
+        # Masks are big-endian, so reversing the bytes puts bit gid - 1 in column gid - 1
+        genre_bits = np.unpackbits(self.genre_masks[:, ::-1], axis=1, bitorder="little")
+        self.genre_bitsets: Dict[str, np.ndarray] = {}
+        for genre, gid in self.genre_gids.items():
+            member = genre_bits[:, gid - 1]
+            if member.any():
+                self.genre_bitsets[genre] = np.packbits(member)
+
+        artist_members: Dict[str, List[int]] = {}
+        for i, row in enumerate(rows):
+            if row["artist"]:
+                artist_members.setdefault(row["artist"].lower(), []).append(i)
+        self.artist_postings: Dict[str, np.ndarray] = {
+            artist: np.array(ids, dtype=np.int32) for artist, ids in artist_members.items()
+        }
+
+    def row(self, i: int) -> dict:
+        return {
+            "sid": self.sids[i],
+            "name": self.names[i],
+            "artist": self.artists[i],
+            "duration": float(self.durations[i]),
+            "audio_path": self.audio_paths[i],
+            "audio_download_path": self.download_paths[i],
+            "genre": self.genres[i],
+        }
+
+    def rows(self, ids: Iterable[int]) -> List[dict]:
+        return [self.row(int(i)) for i in ids]
+
+    def genre_ids(self, genre_substr: str) -> np.ndarray:
+        """
+        Song ids having any genre whose name contains genre_substr (case-insensitive)
+        """
+        needle = genre_substr.strip().lower()
+        gids = [gid for genre, gid in self.genre_gids.items() if needle in genre]
+        if not gids:
+            return np.empty(0, dtype=np.int32)
+        query = np.frombuffer(genre_summary.genre_mask(gids), dtype=np.uint8)
+        return np.flatnonzero((self.genre_masks & query).any(axis=1)).astype(np.int32)
+
+    def artist_ids(self, artist: str) -> np.ndarray:
+        return self.artist_postings.get(artist.strip().lower(), np.empty(0, dtype=np.int32))
+
+    def duration_ids(self, min_sec: float, max_sec: float) -> np.ndarray:
+        """
+        Song ids with min_sec <= duration <= max_sec, shortest first
+        """
+        start = np.searchsorted(self.sorted_durations, min_sec, side="left")
+        end = np.searchsorted(self.sorted_durations, max_sec, side="right")
+        return self.duration_order[start:end]
+
+
+_lock = threading.Lock()
+# Held for the first load, so concurrent first requests read the songs table once
+_load_lock = threading.Lock()
+_catalog: Optional[Catalog] = None
+_checked_at = 0.0
+
+
+def _stored_version() -> int:
+    row = run("SELECT version FROM catalog_versions WHERE name = :name",
+              {"name": CATALOG_VERSION_NAME}, fetchone=True)
+    return row["version"] if row else 0
+
+
+def bump_version():
+    """
+    Record that the songs table changed; every worker reloads within VERSION_CHECK_SECONDS
+    """
+    run("""
+    INSERT INTO catalog_versions (name, version)
+    VALUES (:name, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+    """, {"name": CATALOG_VERSION_NAME})
+
+
+def load(version: Optional[int] = None) -> Catalog:
+    """
+    Read the songs table once and swap in a new snapshot
+    """
+    global _catalog, _checked_at
+    version = _stored_version() if version is None else version
+    rows = run("""
+    SELECT s.*, gs.genre, gs.genre_mask
+    FROM songs s
+    LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
+    """, fetch=True) or []
+    genres = run("SELECT gid, genre_name FROM genres", fetch=True) or []
+    catalog = Catalog(rows, version, {row["gid"]: row["genre_name"] for row in genres})
+    with _lock:
+        _catalog = catalog
+        _checked_at = time.monotonic()
+    return catalog
+
+
+def get_catalog() -> Catalog:
+    """
+    Current snapshot, reloaded when catalog_versions moved on since it was built
+    """
+    global _checked_at
+    catalog = _catalog
+    if catalog is None:
+        with _load_lock:
+            if _catalog is None:
+                return load()
+            return _catalog
+    if time.monotonic() - _checked_at > VERSION_CHECK_SECONDS:
+        _checked_at = time.monotonic()
+        version = _stored_version()
+        if version != catalog.version:
+            return load(version)
+    return catalog
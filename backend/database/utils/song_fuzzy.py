@@ -0,0 +1,142 @@
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from database.utils import index_refresh, song_catalog
+from database.utils.song_search import tokenize
+
+# Fields matched fuzzily (typos are made in names, not genres)
+FIELDS = ("name", "artist")
+
+# Minimum trigram similarity between a query word and an indexed word, as in pg_trgm
+SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(word: str) -> Set[str]:
+    """
+    Character trigrams of a word padded like pg_trgm ("  abc ")
+    """
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _FieldIndex:
+    """
+    Trigram index over the distinct words of one field.
+
+    Query words are first matched against the vocabulary (trigram postings ->
+    similar words), then expanded to songs through word -> song postings.
+    """
+
+    def __init__(self, column, size: int):
+        word_ids: Dict[str, int] = {}
+        word_docs: List[List[int]] = []
+        for doc in range(size):
+            for word in set(tokenize(column[doc])):
+                word_id = word_ids.setdefault(word, len(word_ids))
+                if word_id == len(word_docs):
+                    word_docs.append([])
+                word_docs[word_id].append(doc)
+
+        trigram_words: Dict[str, List[int]] = {}
+        self.trigram_counts = np.zeros(len(word_ids), dtype=np.int32)
+        for word, word_id in word_ids.items():
+            grams = trigrams(word)
+            self.trigram_counts[word_id] = len(grams)
+            for gram in grams:
+                trigram_words.setdefault(gram, []).append(word_id)
+        self.trigram_words = {gram: np.array(ids, dtype=np.int32) for gram, ids in trigram_words.items()}
+        self.word_docs = [np.array(docs, dtype=np.int32) for docs in word_docs]
+
+    def similar_words(self, word: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (word ids, similarity) of indexed words at least SIMILARITY_THRESHOLD similar to word
+        """
+        grams = trigrams(word)
+        postings = [self.trigram_words[g] for g in grams if g in self.trigram_words]
+        if not postings:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+        similarity = shared / (len(grams) + self.trigram_counts[candidates] - shared)
+        keep = similarity >= SIMILARITY_THRESHOLD
+        return candidates[keep], similarity[keep].astype(np.float32)
+
+    def word_scores(self, word: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (doc ids, best similarity of any word in the doc to word)
+        """
+        word_ids, similarity = self.similar_words(word)
+        if not len(word_ids):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        docs = np.concatenate([self.word_docs[w] for w in word_ids])
+        scores = np.repeat(similarity, [len(self.word_docs[w]) for w in word_ids])
+        # Highest score first within each doc, then keep the first row per doc
+        order = np.lexsort((-scores, docs))
+        docs, scores = docs[order], scores[order]
+        first = np.ones(len(docs), dtype=bool)
+        first[1:] = docs[1:] != docs[:-1]
+        return docs[first], scores[first]
+
+
+_lock = threading.Lock()
+_catalog: Optional[song_catalog.Catalog] = None
+_fields: Dict[str, _FieldIndex] = {}
+
+
+def _build_index(catalog: Optional[song_catalog.Catalog] = None):
+    global _catalog, _fields
+    catalog = song_catalog.get_catalog() if catalog is None else catalog
+    fields = {
+        "name": _FieldIndex(catalog.names, catalog.size),
+        "artist": _FieldIndex(catalog.artists, catalog.size),
+    }
+    with _lock:
+        _catalog = catalog
+        _fields = fields
+
+
+_refresher = index_refresh.Refresher("fuzzy index", _build_index,
+                                     changed=lambda: song_catalog.get_catalog() is not _catalog)
+
+
+def build_index(catalog: Optional[song_catalog.Catalog] = None):
+    """
+    (Re)build the trigram indexes from the song catalog snapshot
+    """
+    _refresher.build(catalog)
+
+
+def rank(query: str, fields: Sequence[str] = FIELDS) -> List[Tuple[float, str]]:
+    """
+    Songs fuzzily matching query as (score, sid), best first, ties broken by sid.
+
+    Each query word contributes the similarity of its closest word in the
+    song's name or artist, so "metalica" still finds "Metallica". Work is
+    bounded by the trigram and word posting lengths, not the catalog size.
+    """
+    _refresher.ensure()
+    words = list(dict.fromkeys(tokenize(query)))
+    if not words:
+        return []
+    with _lock:
+        catalog, indexes = _catalog, [_fields[f] for f in fields if f in _fields]
+    all_docs, all_scores = [], []
+    for word in words:
+        per_field = [index.word_scores(word) for index in indexes]
+        docs = np.concatenate([d for d, _ in per_field])
+        scores = np.concatenate([s for _, s in per_field])
+        if not len(docs):
+            continue
+        # A word matching both name and artist counts once, with its better score
+        order = np.lexsort((-scores, docs))
+        docs, scores = docs[order], scores[order]
+        first = np.ones(len(docs), dtype=bool)
+        first[1:] = docs[1:] != docs[:-1]
+        all_docs.append(docs[first])
+        all_scores.append(scores[first])
+    if not all_docs:
+        return []
+    docs, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(all_scores))
+    ranked = [(float(score), catalog.sids[doc]) for doc, score in zip(docs.tolist(), totals.tolist())]
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked
@@ -0,0 +1,344 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from database.db import run
+from database.utils import als_model, item_cf, played_sets, song_catalog
+from database.utils.similarity_engine import interaction_weight
+
+# Score = GENRE_SCORE * genre affinity + ARTIST_SCORE * artist affinity + DURATION_SCORE * duration fit,
+# the same 3 / 2 / 1 priorities the SQL recommender used, on normalised weights
+GENRE_SCORE = 3.0
+ARTIST_SCORE = 2.0
+DURATION_SCORE = 1.0
+# Item-CF neighbour scores (see item_cf) are scaled to max 1 and added with this weight
+CF_WEIGHT = 2.0
+
+# Ranking methods: content features (+ item-CF), or the ALS embeddings (see als_model)
+CONTENT = "content"
+ALS = "als"
+METHODS = (CONTENT, ALS)
+
+# Songs in the user's own (non-favourites) playlists count as a light signal
+PLAYLIST_WEIGHT = 0.5
+# Duration spread assumed when a user has too few songs to estimate one
+DEFAULT_DURATION_STD = 30.0
+
+# Profiles are dropped on taste changes (see invalidate_profile / record_play) and expire for other workers
+PROFILE_TTL_SECONDS = 300
+PROFILE_CACHE_SIZE = 10000
+
+# Ranked results are cached per user RESULT_DEPTH deep, so repeat visits, larger pages
+# and plays that knock songs off the top are served without re-scoring the catalog
+RESULT_DEPTH = 200
+RESULT_TTL_SECONDS = 300
+RESULT_CACHE_SIZE = 10000
+
+
+class SongFeatures:
+    """
+    Per-song feature arrays over one catalog snapshot (row i = catalog id i)
+    """
+
+    def __init__(self, catalog: song_catalog.Catalog):
+        self.catalog = catalog
+        self.genres = sorted(catalog.genre_bitsets)
+        self.genre_index = {genre: j for j, genre in enumerate(self.genres)}
+        rows, cols = [], []
+        for j, genre in enumerate(self.genres):
+            ids = np.flatnonzero(np.unpackbits(catalog.genre_bitsets[genre], count=catalog.size))
+            rows.append(ids)
+            cols.append(np.full(len(ids), j, dtype=np.int32))
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int32)
+        # song x genre membership, so genre affinity of every song is one mat-vec
+        self.genre_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(catalog.size, len(self.genres)))
+
+        self.artists = sorted(catalog.artist_postings)
+        self.song_artist = np.full(catalog.size, -1, dtype=np.int32)
+        for j, artist in enumerate(self.artists):
+            self.song_artist[catalog.artist_postings[artist]] = j
+        self.durations = catalog.durations.astype(np.float32)
+
+
+_lock = threading.Lock()
+_features: Optional[SongFeatures] = None
+_profiles: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_results: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def get_features() -> SongFeatures:
+    global _features
+    catalog = song_catalog.get_catalog()
+    features = _features
+    if features is None or features.catalog is not catalog:
+        features = SongFeatures(catalog)
+        with _lock:
+            _features = features
+    return features
+
+
+def _load_profile(uid: str, features: SongFeatures) -> dict:
+    """
+    Fold a user's actions and playlist songs into a compact taste profile (one query):
+        genre_weights:  float32[n_genres], max 1
+        artist_weights: float32[n_artists], max 1
+        duration_mean / duration_std
+        seed_ids / seed_weights: catalog ids and weights of every song the profile was built from
+    Profiles index into the arrays of `features` and are rebuilt when it changes.
+    """
+    sql = """
+    SELECT sid, total_plays, favourite, rating, FALSE AS in_playlist
+    FROM user_track_actions
+    WHERE uid = :uid
+    UNION ALL
+    SELECT ps.sid, 0, FALSE, NULL, TRUE
+    FROM playlist_songs ps
+    JOIN user_playlists up ON ps.pid = up.pid
+    WHERE up.uid = :uid AND up.is_favourite = FALSE
+    """
+    rows = run(sql, {"uid": uid}, fetch=True) or []
+    catalog = features.catalog
+    weights: Dict[int, float] = {}
+    played, favourites = [], []
+    for row in rows:
+        i = catalog.sid_ids.get(row["sid"])
+        if i is None:
+            continue
+        if row["in_playlist"]:
+            weights[i] = weights.get(i, 0.0) + PLAYLIST_WEIGHT
+            continue
+        played.append(i)
+        weight = interaction_weight(row["total_plays"], row["favourite"], row["rating"])
+        weights[i] = weights.get(i, 0.0) + max(weight, 0.0)
+        if row["favourite"]:
+            favourites.append(i)
+
+    ids = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+    w = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+    genre_weights = np.zeros(len(features.genres), dtype=np.float32)
+    artist_weights = np.zeros(len(features.artists), dtype=np.float32)
+    if len(ids):
+        genre_weights = np.asarray(features.genre_matrix[ids].T @ w, dtype=np.float32).ravel()
+        known = features.song_artist[ids] >= 0
+        artist_weights = np.bincount(features.song_artist[ids][known], weights=w[known],
+                                     minlength=len(features.artists)).astype(np.float32)
+    for vector in (genre_weights, artist_weights):
+        top = vector.max() if len(vector) else 0.0
+        if top > 0:
+            vector /= top
+
+    # Duration taste from favourites, like the SQL version, else from everything played
+    basis = favourites or played
+    durations = features.durations[basis] if basis else np.empty(0, dtype=np.float32)
+    return {
+        "features": features,
+        "genre_weights": genre_weights,
+        "artist_weights": artist_weights,
+        "duration_mean": float(durations.mean()) if len(durations) else None,
+        "duration_std": float(durations.std()) if len(durations) > 1 else DEFAULT_DURATION_STD,
+        "seed_ids": ids,
+        "seed_weights": w,
+        "has_signal": bool(w.sum() > 0) if len(w) else False,
+    }
+
+
+def get_profile(uid: str) -> dict:
+    """
+    Cached taste profile of uid
+    """
+    features = get_features()
+    now = time.monotonic()
+    with _lock:
+        entry = _profiles.get(uid)
+        if (entry is not None and now - entry[0] <= PROFILE_TTL_SECONDS
+                and entry[1]["features"] is features):
+            _profiles.move_to_end(uid)
+            return entry[1]
+    profile = _load_profile(uid, features)
+    with _lock:
+        _profiles[uid] = (now, profile)
+        _profiles.move_to_end(uid)
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def invalidate_profile(uid: str):
+    """
+    Drop uid's cached profile and ranked results after a change to their signals
+    """
+    with _lock:
+        _profiles.pop(uid, None)
+        _results.pop(uid, None)
+
+
+def record_play(uid: str, sid: str, new_row: bool):
+    """
+    A play or favourite of sid: drop the profile. When sid is a newly played song
+    (new_row) the ranked results are kept, as played_sets filters it out at read time;
+    they are dropped when sid already had a row (its weight changed) or when they are
+    empty (a user without signal now has some).
+    """
+    with _lock:
+        _profiles.pop(uid, None)
+        entry = _results.get(uid)
+        if entry is not None and (not new_row or not len(entry["ids"])):
+            del _results[uid]
+
+
+def score_catalog(profile: dict, features: SongFeatures) -> np.ndarray:
+    """
+    Score every song in the catalog for profile in one vectorised pass
+    """
+    scores = GENRE_SCORE * np.asarray(features.genre_matrix @ profile["genre_weights"]).ravel()
+    artist_weights = np.append(profile["artist_weights"], np.float32(0.0))  # index -1 -> no artist
+    scores += ARTIST_SCORE * artist_weights[features.song_artist]
+    if profile["duration_mean"] is not None:
+        std = max(profile["duration_std"], 1.0)
+        z = (features.durations - profile["duration_mean"]) / std
+        scores += DURATION_SCORE * np.exp(-0.5 * z * z)
+    return scores.astype(np.float32)
+
+
+def cf_scores(profile: dict, features: SongFeatures) -> Optional[np.ndarray]:
+    """
+    Item-CF scores of every song for profile scaled to max 1, or None without a model
+    """
+    model = item_cf.get_model()
+    if model is None or model.catalog is not features.catalog:
+        return None
+    scores = model.scores(profile["seed_ids"], profile["seed_weights"])
+    top = scores.max() if len(scores) else 0.0
+    return scores / top if top > 0 else scores
+
+
+def get_cached(uid: str, limit: int, cf_weight: float = CF_WEIGHT, method: str = CONTENT) -> Optional[List[dict]]:
+    """
+    recommend() served from the in-memory result cache only, or None on a miss
+    """
+    features = get_features()
+    now = time.monotonic()
+    with _lock:
+        entry = _results.get(uid)
+        if (entry is None or now - entry["at"] > RESULT_TTL_SECONDS
+                or entry["features"] is not features or entry["method"] != (method, cf_weight)):
+            return None
+        ranked = entry["ids"]
+        _results.move_to_end(uid)
+    # Songs played since the entry was ranked are filtered out here
+    ids = ranked[~played_sets.get(uid, features.catalog).contains(ranked)]
+    if len(ids) < limit and not entry["complete"]:
+        return None
+    return features.catalog.rows(ids[:limit])
+
+
+def _cache_ranked(uid: str, features: SongFeatures, method: tuple, ids: np.ndarray,
+                  complete: bool, now: float):
+    with _lock:
+        _results[uid] = {"at": now, "features": features, "method": method, "ids": ids,
+                         "complete": complete}
+        _results.move_to_end(uid)
+        while len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
+
+
+def cache_stored(uid: str, sids: List[str]):
+    """
+    Seed the result cache with a default ranking read from song_recommendations, so
+    repeat visits skip the database. The stored list is a prefix of the ranking, so
+    requests deeper than it still rank live.
+    """
+    features = get_features()
+    sid_ids = features.catalog.sid_ids
+    ids = np.array([sid_ids[sid] for sid in sids if sid in sid_ids], dtype=np.int64)
+    _cache_ranked(uid, features, (CONTENT, CF_WEIGHT), ids, False, time.monotonic())
+
+
+def recommend(uid: str, limit: int, cf_weight: float = CF_WEIGHT, method: str = CONTENT,
+              use_cache: bool = True) -> List[dict]:
+    """
+    Top `limit` unplayed songs for uid, best first. Empty when uid has no listening signal.
+    cf_weight blends in item-CF neighbour scores; 0 uses content features only.
+    method=ALS ranks by the ALS embeddings instead, falling back to CONTENT without a model.
+    use_cache=False skips the result cache lookup, for callers that just missed it
+    via get_cached; the fresh ranking is still cached.
+    """
+    if limit <= 0:
+        return []
+    if use_cache:
+        cached = get_cached(uid, limit, cf_weight, method)
+        if cached is not None:
+            return cached
+
+    now = time.monotonic()
+    profile = get_profile(uid)
+    features = profile["features"]
+    depth = max(limit, RESULT_DEPTH)
+    ids, _ = _rank(uid, profile, features, depth, cf_weight, method)
+    # A list shorter than the depth asked for already holds every candidate
+    _cache_ranked(uid, features, (method, cf_weight), ids, len(ids) < depth, now)
+    return features.catalog.rows(ids[:limit])
+
+
+def top_songs(uid: str, k: int, cf_weight: float = CF_WEIGHT, method: str = CONTENT) -> List[Tuple[str, float]]:
+    """
+    Uncached ranking of uid's k best unplayed songs as (sid, score), for batch jobs
+    """
+    features = get_features()
+    profile = _load_profile(uid, features)
+    ids, scores = _rank(uid, profile, features, k, cf_weight, method)
+    return [(features.catalog.sids[i], float(score)) for i, score in zip(ids.tolist(), scores.tolist())]
+
+
+def als_scores(uid: str, profile: dict, features: SongFeatures) -> Optional[np.ndarray]:
+    """
+    ALS preference of every song for uid (folded in from profile if uid is newer
+    than the model), or None without a model
+    """
+    model = als_model.get_model()
+    if model is None or model.catalog is not features.catalog:
+        return None
+    return model.scores(model.user_vector(uid, profile["seed_ids"], profile["seed_weights"]))
+
+
+def _rank(uid: str, profile: dict, features: SongFeatures, k: int, cf_weight: float,
+          method: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Catalog ids of the k best unplayed songs for profile, best first, and their scores
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    if not profile["has_signal"]:
+        return empty
+    scores = als_scores(uid, profile, features) if method == ALS else None
+    if scores is None:
+        scores = score_catalog(profile, features)
+    elif cf_weight > 0:
+        # ALS already captures co-listening
+        cf_weight = 0.0
+    if cf_weight > 0:
+        cf = cf_scores(profile, features)
+        if cf is not None:
+            scores += np.float32(cf_weight) * cf
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return empty
+    # Filter the best candidates against the played set rather than masking the
+    # whole history, widening the window only if most of it was already played
+    played = played_sets.get(uid, features.catalog)
+    window = min(2 * k, n)
+    while True:
+        top = np.argpartition(-scores, window - 1)[:window] if window < n else np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[np.isfinite(scores[top])]
+        top = top[~played.contains(top)]
+        if len(top) >= k or window == n:
+            break
+        window = min(4 * window, n)
+    top = top[:k]
+    return top, scores[top]
@@ -1,298 +1,251 @@
 
-from database.db import run
+from database.db import run, run_stream, expand_in
+from database.utils import recommendation_store, song_catalog, song_fuzzy, song_recommender, song_sampling, song_search
+import base64
+import bisect
+import json
 import random
-from typing import List, Dict, Any, Optional, Union
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+# Ranked results of recent paged searches, so later pages slice them instead of ranking
+# the whole catalog again. New songs show up in a cached search after SEARCH_CACHE_SECONDS.
+SEARCH_CACHE_SECONDS = 60
+SEARCH_CACHE_SIZE = 256
+
+_search_lock = threading.Lock()
+_searches: "OrderedDict[Tuple[str, bool], dict]" = OrderedDict()
 
 def get_all_songs():
     sql = """
-        SELECT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
+        SELECT s.*, gs.genre
         FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        GROUP BY s.sid
+        LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
     """
     return run(sql, fetch=True)
 
+def iter_all_songs(batch_size: int = 500):
+    """
+    Every song with its genres, streamed in sid order without loading the catalog into memory
+    """
+    sql = """
+        SELECT s.*, gs.genre
+        FROM songs s
+        LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
+        ORDER BY s.sid
+    """
+    return run_stream(sql, batch_size=batch_size)
+
 def get_song_paginated_filtered(
     page: int = 1,
     page_size: int = 20,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    fuzzy: bool = False
 ):
     offset = (page - 1) * page_size
 
     if search:
-        # match name OR artist OR genre
-        sql = """
-        SELECT s.*, 
-               GROUP_CONCAT(g.genre_name SEPARATOR '; ') AS genre
-        FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE s.name    LIKE :search
-           OR s.artist  LIKE :search
-           OR g.genre_name LIKE :search
-        GROUP BY s.sid
-        LIMIT :page_size
-        OFFSET :offset
-        """
-        params = {
-            "offset": offset,
-            "page_size": page_size,
-            "search": f"%{search}%"
-        }
+        # Relevance-ranked match on name, artist and genre from the token index
+        ranked = _paged_search(search, fuzzy)["ranked"]
+        return song_search.get_rows(sid for _, sid in ranked[offset:offset + page_size])
     else:
         # no filtering
         sql = """
-        SELECT s.*, 
-               GROUP_CONCAT(g.genre_name SEPARATOR '; ') AS genre
+        SELECT s.*, gs.genre
         FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        GROUP BY s.sid
+        LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
+        ORDER BY s.sid
         LIMIT :page_size
         OFFSET :offset
         """
         params = {"offset": offset, "page_size": page_size}
 
-    return run(sql, params, fetch=True)
+        return run(sql, params, fetch=True)
 
-def search_by_genre(genre_substr: str):
-    sql = """
-        SELECT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
-        FROM songs s
-        JOIN song_genres sg ON s.sid = sg.sid
-        JOIN genres g ON sg.gid = g.gid
-        WHERE g.genre_name LIKE :genre
-        GROUP BY s.sid
+def _rank_search(query: str, fuzzy: bool = False, fields: Optional[Tuple[str, ...]] = None) -> List[Tuple[float, str]]:
     """
-    return run(sql, {"genre": f"%{genre_substr}%"}, fetch=True)
-
-def search_by_artist(artist_name: str):
-    sql = """
-        SELECT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
-        FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE s.artist LIKE :artist
-        GROUP BY s.sid
+    (score, sid) best first: BM25 over tokens, or trigram similarity when fuzzy (tolerates typos)
     """
-    return run(sql, {"artist": f"%{artist_name}%"}, fetch=True)
+    if fuzzy:
+        return song_fuzzy.rank(query, fields or song_fuzzy.FIELDS)
+    return song_search.rank(query, fields or song_search.FIELDS)
 
-def search_by_name(keyword: str):
-    sql = """
-        SELECT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
-        FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE s.name LIKE :keyword
-        GROUP BY s.sid
+def _paged_search(query: str, fuzzy: bool) -> dict:
     """
-    return run(sql, {"keyword": f"%{keyword}%"}, fetch=True)
-
-def search_by_duration(min_sec: float = 0, max_sec: float = 1000):
-    sql = """
-        SELECT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
-        FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE s.duration BETWEEN :min_sec AND :max_sec
-        GROUP BY s.sid
+    {"ranked", "keys"} of a search, cached for SEARCH_CACHE_SECONDS. keys is ranked as
+    ascending (-score, sid) tuples for bisecting cursors, built on the first keyset page.
     """
-    return run(sql, {"min_sec": min_sec, "max_sec": max_sec}, fetch=True)
+    key = (query, fuzzy)
+    now = time.monotonic()
+    with _search_lock:
+        entry = _searches.get(key)
+        if entry is not None and now - entry["at"] <= SEARCH_CACHE_SECONDS:
+            _searches.move_to_end(key)
+            return entry
+    entry = {"at": now, "ranked": _rank_search(query, fuzzy), "keys": None}
+    with _search_lock:
+        _searches[key] = entry
+        _searches.move_to_end(key)
+        while len(_searches) > SEARCH_CACHE_SIZE:
+            _searches.popitem(last=False)
+    return entry
 
-def search_by_sid(sid: str):
-    sql = """
-        SELECT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
-        FROM songs s
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE s.sid = :sid
-        GROUP BY s.sid
-    """
-    return run(sql, {"sid": sid}, fetch=True)
+def encode_song_cursor(sid: str, score: Optional[float] = None) -> str:
+    payload = {"sid": sid} if score is None else {"sid": sid, "score": score}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii").rstrip("=")
 
-def get_personalized_recommendations(uid: str, limit: int = 5) -> List[Dict[str, Any]]:
+def decode_song_cursor(cursor: str) -> dict:
     """
-    Generate personalized song recommendations based on:
-    1. User's favorite songs (genres, artists, duration patterns)
-    2. Top 5 genres from user's listening history
-    3. Songs from user's playlists
-    4. Exclude songs user has already played
-    """
-    # Step 1: Get user's favorite songs and their characteristics
-    favorite_songs_sql = """
-        SELECT s.*, g.genre_name, uta.total_plays, uta.rating
-        FROM user_track_actions uta
-        JOIN songs s ON uta.sid = s.sid
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE uta.uid = :uid AND uta.favourite = TRUE
+    Parse a cursor from get_song_page_keyset; raises ValueError if it is malformed
     """
-    favorite_songs = run(favorite_songs_sql, {"uid": uid}, fetch=True)
-    
-    # Step 2: Get top 5 genres from user's listening history
-    top_genres_sql = """
-        SELECT g.genre_name, SUM(uta.total_plays) as total_plays
-        FROM user_track_actions uta
-        JOIN songs s ON uta.sid = s.sid
-        JOIN song_genres sg ON s.sid = sg.sid
-        JOIN genres g ON sg.gid = g.gid
-        WHERE uta.uid = :uid
-        GROUP BY g.genre_name
-        ORDER BY total_plays DESC
-        LIMIT 5
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        score = payload.get("score")
+        return {"sid": str(payload["sid"]), "score": None if score is None else float(score)}
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def get_song_page_keyset(
+    page_size: int = 20,
+    search: Optional[str] = None,
+    cursor: Optional[dict] = None,
+    fuzzy: bool = False
+) -> Tuple[List[dict], Optional[str]]:
     """
-    top_genres = run(top_genres_sql, {"uid": uid}, fetch=True)
-    
-    # Step 3: Get artists from user's favorites and listening history
-    favorite_artists_sql = """
-        SELECT s.artist, SUM(uta.total_plays) as total_plays, 
-               COUNT(CASE WHEN uta.favourite = TRUE THEN 1 END) as favorite_count
-        FROM user_track_actions uta
-        JOIN songs s ON uta.sid = s.sid
-        WHERE uta.uid = :uid
-        GROUP BY s.artist
-        ORDER BY favorite_count DESC, total_plays DESC
-        LIMIT 10
+    Seek-paginated songs: (rows, next_cursor).
+
+    Without a search the page is the next page_size sids after cursor["sid"],
+    a primary-key range scan, so every page costs the same. With a search,
+    results are in relevance order and the cursor holds the last (score, sid);
+    the next page starts right after it.
     """
-    favorite_artists = run(favorite_artists_sql, {"uid": uid}, fetch=True)
-    
-    # Step 4: Get songs from user's playlists (excluding favorites playlist)
-    playlist_songs_sql = """
-        SELECT DISTINCT s.sid, s.artist, g.genre_name
-        FROM playlist_songs ps
-        JOIN user_playlists up ON ps.pid = up.pid
-        JOIN songs s ON ps.sid = s.sid
-        LEFT JOIN song_genres sg ON s.sid = sg.sid
-        LEFT JOIN genres g ON sg.gid = g.gid
-        WHERE up.uid = :uid AND up.is_favourite = FALSE
+    if search:
+        search_entry = _paged_search(search, fuzzy)
+        ranked = search_entry["ranked"]
+        start = 0
+        if cursor:
+            if cursor["score"] is None:
+                raise ValueError("Cursor does not belong to a search")
+            if search_entry["keys"] is None:
+                search_entry["keys"] = [(-score, sid) for score, sid in ranked]
+            start = bisect.bisect_right(search_entry["keys"], (-cursor["score"], cursor["sid"]))
+        window = ranked[start:start + page_size]
+        rows = song_search.get_rows(sid for _, sid in window)
+        next_cursor = None
+        if window and start + page_size < len(ranked):
+            next_cursor = encode_song_cursor(window[-1][1], window[-1][0])
+        return rows, next_cursor
+
+    seek = "WHERE s.sid > :after_sid" if cursor else ""
+    sql = f"""
+    SELECT s.*, gs.genre
+    FROM songs s
+    LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
+    {seek}
+    ORDER BY s.sid
+    LIMIT :page_size
     """
-    playlist_songs = run(playlist_songs_sql, {"uid": uid}, fetch=True)
-    
-    # Step 5: Get songs user has already played (to exclude)
-    played_songs_sql = """
-        SELECT sid FROM user_track_actions WHERE uid = :uid
+    params = {"page_size": page_size}
+    if cursor:
+        params["after_sid"] = cursor["sid"]
+    rows = run(sql, params, fetch=True) or []
+    next_cursor = encode_song_cursor(rows[-1]["sid"]) if len(rows) == page_size else None
+    return rows, next_cursor
+
+def search_by_genre(genre_substr: str):
+    # Songs with any genre whose name contains genre_substr, from the catalog's genre bitsets
+    catalog = song_catalog.get_catalog()
+    return catalog.rows(catalog.genre_ids(genre_substr))
+
+def sample_by_genre(genre: str, k: int):
+    # Popularity-weighted random songs of one genre (exact name), drawn from its sampling pool
+    return song_sampling.sample_songs(song_sampling.GENRE, genre, k)
+
+def sample_by_artist(artist_name: str, k: int):
+    return song_sampling.sample_songs(song_sampling.ARTIST, artist_name, k)
+
+def search_by_artist(artist_name: str, fuzzy: bool = False):
+    # Exact artist postings first, ranked token search for partial names
+    catalog = song_catalog.get_catalog()
+    ids = catalog.artist_ids(artist_name)
+    if len(ids):
+        return catalog.rows(ids)
+    return song_search.get_rows(sid for _, sid in _rank_search(artist_name, fuzzy, ("artist",)))
+
+def search_by_name(keyword: str, fuzzy: bool = False):
+    return song_search.get_rows(sid for _, sid in _rank_search(keyword, fuzzy, ("name",)))
+
+def search_by_duration(min_sec: float = 0, max_sec: float = 1000):
+    catalog = song_catalog.get_catalog()
+    return catalog.rows(catalog.duration_ids(min_sec, max_sec))
+
+def search_by_sid(sid: str):
+    catalog = song_catalog.get_catalog()
+    i = catalog.sid_ids.get(sid)
+    return [] if i is None else [catalog.row(i)]
+
+def get_songs_by_sids(sids: List[str]) -> Tuple[List[dict], List[str]]:
     """
-    played_songs = run(played_songs_sql, {"uid": uid}, fetch=True)
-    played_song_ids = {song['sid'] for song in played_songs} if played_songs else set()
-    
-    # Step 6: Calculate average duration preference
-    avg_duration_sql = """
-        SELECT AVG(s.duration) as avg_duration, STDDEV(s.duration) as std_duration
-        FROM user_track_actions uta
-        JOIN songs s ON uta.sid = s.sid
-        WHERE uta.uid = :uid AND uta.favourite = TRUE
+    Resolve many sids at once: (rows in request order, sids that do not exist).
+    Served from the in-memory catalog; sids newer than the snapshot cost one IN query.
     """
-    duration_stats = run(avg_duration_sql, {"uid": uid}, fetchone=True)
-    
-    # Build recommendation criteria
-    recommendation_criteria = []    
-    
-    # Criteria 1: Songs from top genres
-    if top_genres:
-        genre_names = [genre['genre_name'] for genre in top_genres]
-        genre_placeholders = ', '.join([f"'{genre}'" for genre in genre_names])
-        recommendation_criteria.append(f"g.genre_name IN ({genre_placeholders})")
-    
-    # Criteria 2: Songs from favorite artists
-    if favorite_artists:
-        artist_names = [artist['artist'] for artist in favorite_artists[:5]]  # Top 5 artists
-        artist_placeholders = ', '.join([f"'{artist}'" for artist in artist_names])
-        recommendation_criteria.append(f"s.artist IN ({artist_placeholders})")
-    
-    # Criteria 3: Duration preference (if available)
-    if duration_stats and duration_stats.get('avg_duration'):
-        avg_dur = duration_stats['avg_duration']
-        std_dur = duration_stats.get('std_duration', 30)  # Default std dev
-        min_dur = max(0, avg_dur - std_dur)
-        max_dur = avg_dur + std_dur
-        recommendation_criteria.append(f"s.duration BETWEEN {min_dur} AND {max_dur}")
-    
-    print('recommendation_criteria', recommendation_criteria)
-    # Build the main recommendation query
-    if recommendation_criteria:
-        criteria_sql = " OR ".join(recommendation_criteria)
-        
-        # Exclude played songs
-        exclude_clause = ""
-        if played_song_ids:
-            exclude_list = ', '.join([f"'{sid}'" for sid in played_song_ids])
-            exclude_clause = f"AND s.sid NOT IN ({exclude_list})"
-        
-        recommendation_sql = f"""
-            SELECT DISTINCT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre,
-                   CASE 
-                       WHEN MAX(g.genre_name) IN ({', '.join([f"'{g['genre_name']}'" for g in top_genres]) if top_genres else "''"}) THEN 3
-                       WHEN s.artist IN ({', '.join([f"'{a['artist']}'" for a in favorite_artists[:5]]) if favorite_artists else "''"}) THEN 2
-                       ELSE 1
-                   END as recommendation_score
+    sids = list(dict.fromkeys(sids))
+    catalog = song_catalog.get_catalog()
+    found = {sid: catalog.row(catalog.sid_ids[sid]) for sid in sids if sid in catalog.sid_ids}
+    unknown = [sid for sid in sids if sid not in found]
+    if unknown:
+        placeholders, params = expand_in("sids", unknown)
+        sql = f"""
+            SELECT s.*, gs.genre
             FROM songs s
-            LEFT JOIN song_genres sg ON s.sid = sg.sid
-            LEFT JOIN genres g ON sg.gid = g.gid
-            WHERE ({criteria_sql}) {exclude_clause}
-            GROUP BY s.sid
-            ORDER BY recommendation_score DESC, RAND()
-            LIMIT {limit * 3}
+            LEFT JOIN song_genre_summary gs ON s.sid = gs.sid
+            WHERE s.sid IN ({placeholders})
         """
-    else:
-        # Fallback: Get random popular songs if no user data available
-        exclude_clause = ""
-        if played_song_ids:
-            exclude_list = ', '.join([f"'{sid}'" for sid in played_song_ids])
-            exclude_clause = f"WHERE s.sid NOT IN ({exclude_list})"
-        
-        recommendation_sql = f"""
-            SELECT DISTINCT s.*, GROUP_CONCAT(g.genre_name SEPARATOR '; ') as genre
-            FROM songs s
-            LEFT JOIN song_genres sg ON s.sid = sg.sid
-            LEFT JOIN genres g ON sg.gid = g.gid
-            {exclude_clause}
-            GROUP BY s.sid
-            ORDER BY RAND()
-            LIMIT {limit * 2}
-        """
-    print('recommendation_sql', recommendation_sql)
-    # Execute recommendation query
-    recommendations = run(recommendation_sql, fetch=True)
-    print('recommendations', recommendations)
-    # Step 7: Apply additional filtering and scoring
+        for row in run(sql, params, fetch=True) or []:
+            found[row["sid"]] = row
+    rows = [found[sid] for sid in sids if sid in found]
+    missing = [sid for sid in sids if sid not in found]
+    return rows, missing
+
+def get_personalized_recommendations(uid: str, limit: int = 5,
+                                     cf_weight: float = song_recommender.CF_WEIGHT,
+                                     method: str = song_recommender.CONTENT) -> List[Dict[str, Any]]:
+    """
+    Generate personalized song recommendations based on:
+    1. User's favorite and played songs (genres, artists, duration patterns)
+    2. Songs from user's playlists
+    3. Exclude songs user has already played
+
+    The user's taste profile is cached and the whole catalog is scored in one
+    vectorised pass (see song_recommender), blended with item-CF neighbours of the
+    user's songs when a model has been built (cf_weight=0 turns that off).
+    method="als" ranks by the memory-mapped ALS embeddings instead (dot product
+    of the user vector with every song vector, then a top-k partial sort).
+    Users without any history get popular songs drawn at random (see song_sampling).
+
+    With the default ranking, a repeat visit is served from the in-memory result
+    cache and a first visit from the nightly song_recommendations rows, which then
+    seed that cache, so only users whose rows are missing or stale are scored live.
+    """
+    default_ranking = method == song_recommender.CONTENT and cf_weight == song_recommender.CF_WEIGHT
+    recommendations = None
+    if default_ranking:
+        recommendations = song_recommender.get_cached(uid, limit)
+        if recommendations is None:
+            stored = recommendation_store.read(recommendation_store.SONGS, uid, limit)
+            if stored is not None:
+                song_recommender.cache_stored(uid, [row["sid"] for row in stored])
+                # None when too many stored songs have been played since; rank live then
+                recommendations = song_recommender.get_cached(uid, limit)
+
+    if recommendations is None:
+        # The default ranking's cache was checked above already
+        recommendations = song_recommender.recommend(uid, limit, cf_weight, method, use_cache=not default_ranking)
     if recommendations:
-        # Score and rank recommendations
-        scored_recommendations = []
-        
-        for song in recommendations:
-            score = 0
-            
-            # Genre matching score
-            if top_genres and song.get('genre'):
-                song_genres = [g.strip() for g in song['genre'].split(';')]
-                top_genre_names = [g['genre_name'] for g in top_genres]
-                genre_matches = len(set(song_genres) & set(top_genre_names))
-                score += genre_matches * 3
-            
-            # Artist matching score
-            if favorite_artists:
-                artist_names = [a['artist'] for a in favorite_artists]
-                if song['artist'] in artist_names:
-                    score += 2
-            
-            # Duration preference score
-            if duration_stats and duration_stats.get('avg_duration'):
-                avg_dur = duration_stats['avg_duration']
-                duration_diff = abs(song['duration'] - avg_dur)
-                if duration_diff < 30:  # Within 30 seconds
-                    score += 1
-            
-            scored_recommendations.append((song, score))
-        
-        # Sort by score and randomize within score groups
-        scored_recommendations.sort(key=lambda x: x[1], reverse=True)
-        
-        # Select final recommendations
-        final_recommendations = []
-        for song, score in scored_recommendations[:limit]:
-            final_recommendations.append(song)
-        
-        return final_recommendations
-    
-    return []
\ No newline at end of file
+        return recommendations
+
+    # Fallback: popularity-weighted random songs the user has not played yet
+    return song_sampling.sample_songs(song_sampling.ALL, k=limit, uid=uid)
@@ -0,0 +1,154 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from database.db import run
+from database.utils import index_refresh, played_sets, song_catalog
+
+# Pools are reshuffled (and re-weighted by current play counts) this often
+POOL_TTL_SECONDS = 600
+
+# Length of each pool's pre-drawn weighted sequence, relative to the pool size and capped
+WEIGHTED_SEQUENCE_FACTOR = 4
+MAX_WEIGHTED_SEQUENCE = 8192
+
+ALL = "all"
+GENRE = "genre"
+ARTIST = "artist"
+
+
+class Pool:
+    """
+    Catalog ids of one genre / artist (or the whole catalog), prepared for O(k) draws:
+        shuffled: every id once, uniformly shuffled; random draws read a window of it
+        weighted: ids drawn with replacement proportionally to 1 + plays; weighted
+                  draws read a window of it, skipping repeats
+    Windows start at a random offset and wrap around.
+    """
+
+    def __init__(self, ids: np.ndarray, popularity: np.ndarray, rng: np.random.Generator):
+        self.shuffled = ids[rng.permutation(len(ids))]
+        length = min(len(ids) * WEIGHTED_SEQUENCE_FACTOR, MAX_WEIGHTED_SEQUENCE)
+        weights = popularity[ids] + 1.0
+        self.weighted = rng.choice(ids, size=length, p=weights / weights.sum()) if len(ids) else ids
+
+    def __len__(self):
+        return len(self.shuffled)
+
+
+def _excluded(candidates: np.ndarray, exclude) -> np.ndarray:
+    """
+    Mask of candidates present in exclude (a played_sets set), O(len(candidates))
+    """
+    if exclude is None:
+        return np.zeros(len(candidates), dtype=bool)
+    return exclude.contains(candidates)
+
+
+def _take(sequence: np.ndarray, k: int, exclude, picked: List[int],
+          seen: set, rng: np.random.Generator):
+    """
+    Append up to k distinct, non-excluded ids from a random window of sequence to picked
+    """
+    n = len(sequence)
+    if not n:
+        return
+    start = int(rng.integers(n))
+    position = 0
+    while len(picked) < k and position < n:
+        # Read in chunks a little larger than what is still missing
+        end = min(position + 2 * (k - len(picked)) + 8, n)
+        candidates = sequence[(start + np.arange(position, end)) % n]
+        for i in candidates[~_excluded(candidates, exclude)].tolist():
+            if i not in seen:
+                seen.add(i)
+                picked.append(i)
+                if len(picked) == k:
+                    break
+        position = end
+
+
+_lock = threading.Lock()
+_catalog: Optional[song_catalog.Catalog] = None
+_pools: Dict[Tuple[str, str], Pool] = {}
+# Generators are not thread-safe, so each request thread draws from its own
+_local = threading.local()
+
+
+def _rng() -> np.random.Generator:
+    rng = getattr(_local, "rng", None)
+    if rng is None:
+        rng = _local.rng = np.random.default_rng()
+    return rng
+
+
+def _load_popularity(catalog: song_catalog.Catalog) -> np.ndarray:
+    popularity = np.zeros(catalog.size, dtype=np.float64)
+    rows = run("SELECT sid, total_plays FROM song_play_counts", fetch=True) or []
+    for row in rows:
+        i = catalog.sid_ids.get(row["sid"])
+        if i is not None:
+            popularity[i] = float(row["total_plays"] or 0)
+    return popularity
+
+
+def _build_pools():
+    global _catalog, _pools
+    catalog = song_catalog.get_catalog()
+    popularity = _load_popularity(catalog)
+    rng = np.random.default_rng()
+    pools = {(ALL, ""): Pool(np.arange(catalog.size, dtype=np.int64), popularity, rng)}
+    for genre, bitset in catalog.genre_bitsets.items():
+        ids = np.flatnonzero(np.unpackbits(bitset, count=catalog.size))
+        pools[(GENRE, genre)] = Pool(ids, popularity, rng)
+    for artist, ids in catalog.artist_postings.items():
+        pools[(ARTIST, artist)] = Pool(ids.astype(np.int64), popularity, rng)
+    with _lock:
+        _catalog = catalog
+        _pools = pools
+
+
+_refresher = index_refresh.Refresher("sampling pools", _build_pools, ttl_seconds=POOL_TTL_SECONDS,
+                                     changed=lambda: song_catalog.get_catalog() is not _catalog)
+
+
+def build_pools():
+    """
+    Reshuffle every pool from the current catalog snapshot and play counts
+    """
+    _refresher.build()
+
+
+def sample(kind: str, key: str = "", k: int = 10, uid: Optional[str] = None,
+           weighted: bool = True) -> Tuple[song_catalog.Catalog, np.ndarray]:
+    """
+    Up to k distinct catalog ids from one pool, e.g. sample(GENRE, "rock", 5).
+
+    weighted=True favours popular songs, False samples uniformly. With uid, songs
+    uid has played are never returned.
+    Cost grows with k and the share of played songs, not with the pool size.
+    Returns the catalog snapshot the ids index into, with the ids.
+    """
+    _refresher.ensure()
+    with _lock:
+        catalog, pool = _catalog, _pools.get((kind, key.strip().lower()))
+    if pool is None or k <= 0:
+        return catalog, np.empty(0, dtype=np.int64)
+    # Played set over the pools' own snapshot, which lags the current one during a refresh
+    exclude = played_sets.get(uid, catalog) if uid is not None else None
+    rng = _rng()
+    picked: List[int] = []
+    seen: set = set()
+    if weighted:
+        _take(pool.weighted, k, exclude, picked, seen, rng)
+    # Uniform window tops up weighted draws when the weighted sequence runs dry
+    _take(pool.shuffled, k, exclude, picked, seen, rng)
+    return catalog, np.array(picked, dtype=np.int64)
+
+
+def sample_songs(kind: str, key: str = "", k: int = 10, uid: Optional[str] = None,
+                 weighted: bool = True) -> List[dict]:
+    """
+    sample(), returned as song rows
+    """
+    catalog, ids = sample(kind, key, k, uid, weighted)
+    return catalog.rows(ids) if catalog is not None else []
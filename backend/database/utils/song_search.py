@@ -0,0 +1,169 @@
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from database.utils import index_refresh, song_catalog
+
+# Searchable fields and how much a match in each one counts (BM25F field weights)
+FIELD_WEIGHTS = {"name": 2.0, "artist": 1.5, "genre": 1.0}
+FIELDS = tuple(FIELD_WEIGHTS)
+
+# BM25 saturation and length normalisation
+K1 = 1.2
+B = 0.75
+
+# The last query term is also matched as a prefix (typing "metal" finds "metallica"),
+# limited to this many vocabulary terms
+MAX_PREFIX_EXPANSIONS = 32
+# Completions count for less than an exact match of the typed word
+PREFIX_MATCH_WEIGHT = 0.5
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_lock = threading.Lock()
+_catalog: Optional[song_catalog.Catalog] = None  # snapshot the index was built from; doc id = catalog id
+_postings: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}  # term -> field -> (doc ids, field tf)
+_idf: Dict[str, float] = {}
+_vocabulary: List[str] = []  # sorted terms, for prefix lookups
+
+
+def fold_text(text: Optional[str]) -> str:
+    """
+    Case- and accent-insensitive form of text with whitespace collapsed ("Beyoncé " -> "beyonce")
+    """
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall(fold_text(text))
+
+
+def _build_index(catalog: Optional[song_catalog.Catalog] = None):
+    global _catalog, _postings, _idf, _vocabulary
+    catalog = song_catalog.get_catalog() if catalog is None else catalog
+    columns = {"name": catalog.names, "artist": catalog.artists, "genre": catalog.genres}
+
+    # term -> field -> {doc: term frequency}, plus field lengths for normalisation
+    raw: Dict[str, Dict[str, Dict[int, int]]] = {}
+    lengths = {field: np.zeros(catalog.size, dtype=np.float32) for field in FIELDS}
+    for doc in range(catalog.size):
+        for field in FIELDS:
+            tokens = tokenize(columns[field][doc])
+            lengths[field][doc] = len(tokens)
+            for token in tokens:
+                counts = raw.setdefault(token, {}).setdefault(field, {})
+                counts[doc] = counts.get(doc, 0) + 1
+
+    average = {field: max(float(lengths[field].mean()) if catalog.size else 0.0, 1.0) for field in FIELDS}
+    postings: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+    idf: Dict[str, float] = {}
+    for term, by_field in raw.items():
+        docs_with_term = set()
+        postings[term] = {}
+        for field, counts in by_field.items():
+            docs = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            # Length-normalised, field-weighted tf; saturation happens at query time
+            norm = 1.0 - B + B * lengths[field][docs] / average[field]
+            postings[term][field] = (docs, FIELD_WEIGHTS[field] * tf / norm)
+            docs_with_term.update(counts)
+        df = len(docs_with_term)
+        idf[term] = math.log(1.0 + (catalog.size - df + 0.5) / (df + 0.5))
+
+    with _lock:
+        _catalog = catalog
+        _postings = postings
+        _idf = idf
+        _vocabulary = sorted(postings)
+
+
+# Rebuilt whenever the catalog snapshot was reloaded
+_refresher = index_refresh.Refresher("search index", _build_index,
+                                     changed=lambda: song_catalog.get_catalog() is not _catalog)
+
+
+def build_index(catalog: Optional[song_catalog.Catalog] = None):
+    """
+    (Re)build the token index over song name, artist and genre and swap it in.
+    Defaults to the current song_catalog snapshot.
+    """
+    _refresher.build(catalog)
+
+
+def _expand(term: str, prefix: bool) -> List[str]:
+    if not prefix:
+        return [term] if term in _postings else []
+    start = bisect.bisect_left(_vocabulary, term)
+    end = bisect.bisect_left(_vocabulary, term + "\U0010ffff")
+    matches = _vocabulary[start:end]
+    if len(matches) > MAX_PREFIX_EXPANSIONS:
+        # Keep the exact term and the most selective completions
+        matches = sorted(matches, key=lambda t: (t != term, -_idf[t]))[:MAX_PREFIX_EXPANSIONS]
+    return matches
+
+
+def _term_scores(typed: str, terms: Iterable[str], fields: Sequence[str]) -> Dict[int, float]:
+    """
+    Best BM25F score per doc over a set of alternative terms (one query term and its completions).
+    Work is proportional to the posting lengths, not the catalog size.
+    """
+    best: Dict[int, float] = {}
+    for term in terms:
+        postings = [_postings[term][field] for field in fields if field in _postings[term]]
+        if not postings:
+            continue
+        docs, inverse = np.unique(np.concatenate([p[0] for p in postings]), return_inverse=True)
+        tf = np.bincount(inverse, weights=np.concatenate([p[1] for p in postings]))
+        scores = _idf[term] * tf * (K1 + 1.0) / (tf + K1)
+        if term != typed:
+            scores *= PREFIX_MATCH_WEIGHT
+        for doc, score in zip(docs.tolist(), scores.tolist()):
+            if score > best.get(doc, 0.0):
+                best[doc] = score
+    return best
+
+
+def rank(query: str, fields: Sequence[str] = FIELDS) -> List[Tuple[float, str]]:
+    """
+    Every matching song as (score, sid), best first, ties broken by sid.
+    Terms are OR-ed, so songs matching more of the query score higher.
+    """
+    _refresher.ensure()
+    terms = tokenize(query)
+    if not terms:
+        return []
+    # A trailing space means the last word is complete
+    prefix_last = not query[-1:].isspace()
+    with _lock:
+        totals: Dict[int, float] = {}
+        for term in dict.fromkeys(terms):
+            expansions = _expand(term, prefix_last and term == terms[-1])
+            for doc, score in _term_scores(term, expansions, fields).items():
+                totals[doc] = totals.get(doc, 0.0) + score
+        ranked = [(score, _catalog.sids[doc]) for doc, score in totals.items()]
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked
+
+
+def get_rows(sids: Iterable[str]) -> List[dict]:
+    """
+    Song rows for sids, in the given order (unknown sids are skipped)
+    """
+    catalog = song_catalog.get_catalog()
+    return catalog.rows(catalog.sid_ids[sid] for sid in sids if sid in catalog.sid_ids)
+
+
+def search(query: str, fields: Sequence[str] = FIELDS, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+    """
+    Song rows matching query, most relevant first
+    """
+    ranked = rank(query, fields)
+    window = ranked[offset:] if limit is None else ranked[offset:offset + limit]
+    return get_rows(sid for _, sid in window)
@@ -2,6 +2,31 @@ from typing import List, Optional
 from datetime import datetime
 from database.schema.models import UserTrackActionCreate, UserTrackActionUpdate, UserTrackActionRead
 from database.db import run, run_transaction
+from database.utils import candidate_index, similarity_cache, lsh_repo, played_sets, playlist_vectors, song_recommender
+
+def _on_taste_changed(uid: str, added_sid: Optional[str] = None, new_row: bool = False):
+    """
+    Keep derived matching and recommendation structures in step with a write to user_track_actions.
+    Pass added_sid when the write only added a played/favourited song, so the
+    MinHash signature can be patched in place instead of recomputed, and new_row
+    when sid had no user_track_actions row before, so cached recommendations
+    only need that song filtered out.
+    """
+    try:
+        if added_sid is not None:
+            song_recommender.record_play(uid, added_sid, new_row)
+            played_sets.add(uid, added_sid)
+        else:
+            song_recommender.invalidate_profile(uid)
+            played_sets.invalidate(uid)
+        similarity_cache.bump_taste_version(uid)
+        candidate_index.refresh_user(uid)
+        if added_sid is not None:
+            lsh_repo.add_song(uid, added_sid)
+        else:
+            lsh_repo.refresh_user(uid)
+    except Exception as e:
+        print(f"Failed to refresh matching index for user {uid}: {e}")
 
 def create_user_track_action(action: UserTrackActionCreate) -> bool:
     """
@@ -57,6 +82,10 @@ def create_user_track_action(action: UserTrackActionCreate) -> bool:
         }
         
         run(insert_sql, insert_params)
+        if insert_params["favourite"] or insert_params["total_plays"] > 0:
+            _on_taste_changed(action.uid, added_sid=action.sid, new_row=True)
+        else:
+            _on_taste_changed(action.uid)
         print(f"Successfully created user track action for user {action.uid} and song {action.sid}")
         return True
         
@@ -112,6 +141,7 @@ def update_user_track_action(uid: str, sid: str, update_data: UserTrackActionUpd
         """
         
         run(update_sql, update_params)
+        _on_taste_changed(uid)
         print(f"Successfully updated user track action for user {uid} and song {sid}")
         return True
         
@@ -193,6 +223,7 @@ def delete_user_track_action(uid: str, sid: str) -> bool:
         WHERE uid = :uid AND sid = :sid
         """
         run(delete_sql, params)
+        _on_taste_changed(uid)
         print(f"Successfully deleted user track action for user {uid} and song {sid}")
         return True
         
@@ -236,6 +267,7 @@ def increment_play_count(uid: str, sid: str) -> bool:
             "last_listened": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         run(update_sql, update_params)
+        _on_taste_changed(uid, added_sid=sid)
         print(f"Successfully incremented play count for user {uid} and song {sid}")
         return True
         
@@ -280,6 +312,7 @@ def toggle_favourite(uid: str, sid: str) -> bool:
             "favourite": new_favourite
         }
         run(update_sql, update_params)
+        _on_taste_changed(uid, added_sid=sid if new_favourite else None)
         print(f"Successfully toggled favourite status for user {uid} and song {sid}")
         return True
         
@@ -415,6 +448,11 @@ def toggle_favourite_with_playlist(uid: str, sid: str) -> bool:
         success = run_transaction(operations)
         
         if success:
+            _on_taste_changed(uid, added_sid=sid if new_favourite else None, new_row=current_action is None)
+            if new_favourite:
+                playlist_vectors.add_song(pid, sid)
+            else:
+                playlist_vectors.remove_song(pid, sid)
             action = "favourited" if new_favourite else "unfavourited"
             print(f"Successfully {action} song {sid} for user {uid}")
             return True
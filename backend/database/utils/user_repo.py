@@ -1,4 +1,5 @@
 from database.db import run
+from database.utils import similarity_engine
 
 def get_all_users():
     sql = """
@@ -130,10 +131,15 @@ def get_user_favorite_genres(uid: str):
     LIMIT 10
     """
     result = run(sql, {"uid": uid}, fetch=True)
-    
+    return rank_favorite_genres(result)
+
+def rank_favorite_genres(rows):
+    """
+    Turn (genre, play_count) rows, most played first, into the user's top 5 genres
+    """
     # Process results to handle duplicates
     genre_counts = {}
-    for row in result:
+    for row in rows[:10]:
         genre = row['genre']
         # Some genres might contain multiple genres separated by commas
         if ',' in genre:
@@ -169,74 +175,38 @@ def get_user_top_artists(uid: str):
     result = run(sql, {"uid": uid}, fetch=True)
     return [row['artist'] for row in result]
 
-def get_users_for_matching(current_uid: str, limit: int = 10, offset: int = 0):
+def get_users_for_matching(current_uid: str, limit: int = 10, after_uid: str = None):
     """
-    Get users for matching, excluding the current user and already matched users
+    Get users for matching, excluding the current user and already matched users.
+    Keyset-paginated by uid: pass the last uid of the previous page as after_uid.
     """
     sql = """
     SELECT u.uid, u.username, u.name, u.age, u.country
     FROM users u
     WHERE u.uid != :current_uid
+    AND (:after_uid IS NULL OR u.uid > :after_uid)
     AND u.uid NOT IN (
         SELECT user2_id FROM user_matches WHERE user1_id = :current_uid
         UNION
         SELECT user1_id FROM user_matches WHERE user2_id = :current_uid
     )
-    LIMIT :limit OFFSET :offset
+    ORDER BY u.uid
+    LIMIT :limit
     """
     result = run(sql, {
         "current_uid": current_uid,
         "limit": limit,
-        "offset": offset
+        "after_uid": after_uid
     }, fetch=True)
     return result
 
-def calculate_user_similarity(user1_id: str, user2_id: str):
-    """
-    Calculate similarity score between two users based on music taste
+def calculate_user_similarity(user1_id: str, user2_id: str, mode: str = similarity_engine.LEGACY):
     """
-    # Get common genres
-    genre_sql = """
-    SELECT COUNT(DISTINCT g1.genre_name) as common_genres
-    FROM user_track_actions uta1
-    JOIN songs s1 ON uta1.sid = s1.sid
-    JOIN song_genres sg1 ON s1.sid = sg1.sid
-    JOIN genres g1 ON sg1.gid = g1.gid
-    JOIN user_track_actions uta2 ON s1.sid = uta2.sid
-    JOIN song_genres sg2 ON uta2.sid = sg2.sid
-    JOIN genres g2 ON sg2.gid = g2.gid
-    WHERE uta1.uid = :user1_id AND uta2.uid = :user2_id
-    AND g1.genre_name = g2.genre_name
-    AND (uta1.favourite = TRUE OR uta2.favourite = TRUE)
+    Calculate similarity score between two users based on music taste.
+    Defaults to the original common-genres/common-artists formula; pass
+    similarity_engine.COSINE or WEIGHTED_JACCARD for the taste-vector scores.
     """
-    genre_result = run(genre_sql, {
-        "user1_id": user1_id,
-        "user2_id": user2_id
-    }, fetchone=True)
-    
-    # Get common artists
-    artist_sql = """
-    SELECT COUNT(DISTINCT s1.artist) as common_artists
-    FROM user_track_actions uta1
-    JOIN songs s1 ON uta1.sid = s1.sid
-    JOIN user_track_actions uta2 ON s1.sid = uta2.sid
-    JOIN songs s2 ON uta2.sid = s2.sid
-    WHERE uta1.uid = :user1_id AND uta2.uid = :user2_id
-    AND s1.artist = s2.artist
-    AND (uta1.favourite = TRUE OR uta2.favourite = TRUE)
-    """
-    artist_result = run(artist_sql, {
-        "user1_id": user1_id,
-        "user2_id": user2_id
-    }, fetchone=True)
-    
-    # Calculate similarity score (simple weighted average)
-    common_genres = genre_result['common_genres'] if genre_result else 0
-    common_artists = artist_result['common_artists'] if artist_result else 0
-    
-    # Simple similarity calculation (can be improved)
-    similarity = (common_genres * 0.4 + common_artists * 0.6) / 10.0
-    return min(similarity, 1.0)  # Cap at 1.0
+    return similarity_engine.pair_similarity(user1_id, user2_id, mode)
 
 def get_total_users_for_matching(current_uid: str):
     """
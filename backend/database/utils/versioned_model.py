@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
+from database.utils import song_catalog
+
+# Shared layout of the models built by batch jobs (item_cf, als): every run writes a
+# new MODEL_DATA_DIR/<model>/<version>/ directory, then MODEL_DATA_DIR/<model>/CURRENT
+# is switched to it atomically, so API workers never see a half-written model.
+MODEL_DATA_DIR = Path(os.environ.get("MODEL_DATA_DIR", Path(__file__).resolve().parents[2] / "model_data"))
+CURRENT_FILE = "CURRENT"
+META_FILE = "meta.json"
+
+# Versions kept on disk; older ones are deleted after a publish
+KEEP_VERSIONS = 2
+
+# How often a worker checks whether a batch job published a new version
+RELOAD_CHECK_SECONDS = 60
+
+
+def current_version(model_dir: Path) -> Optional[str]:
+    try:
+        version = (model_dir / CURRENT_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def read_meta(model_dir: Path, version: str) -> dict:
+    return json.loads((model_dir / version / META_FILE).read_text())
+
+
+def publish(model_dir: Path, write: Callable[[Path], None], meta: dict) -> str:
+    """
+    Write a new version with write(version_dir) plus META_FILE, point CURRENT at it
+    and prune all but the newest KEEP_VERSIONS versions. Returns the new version.
+    """
+    version = datetime.now().strftime("%Y%m%d%H%M%S")
+    version_dir = model_dir / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    write(version_dir)
+    (version_dir / META_FILE).write_text(json.dumps(meta))
+    tmp = model_dir / (CURRENT_FILE + ".tmp")
+    tmp.write_text(version)
+    os.replace(tmp, model_dir / CURRENT_FILE)
+
+    versions = sorted(p.name for p in model_dir.iterdir() if p.is_dir())
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(model_dir / old, ignore_errors=True)
+    return version
+
+
+class Loader:
+    """
+    One worker's copy of a model's live version, mapped onto the current catalog
+    snapshot by load(version, catalog). Reloaded when the catalog changes or CURRENT
+    names a new version (checked every RELOAD_CHECK_SECONDS); a version that fails
+    to load keeps the previous model in place.
+    """
+
+    def __init__(self, name: str, model_dir: Path, load: Callable[[str, song_catalog.Catalog], Any]):
+        self.name = name
+        self.model_dir = model_dir
+        self._load = load
+        self._lock = threading.Lock()
+        self._model = None
+        self._checked_at = 0.0
+
+    def get(self):
+        """
+        Current model, or None until the batch job has produced one
+        """
+        catalog = song_catalog.get_catalog()
+        model = self._model
+        now = time.monotonic()
+        if model is not None and model.catalog is catalog and now - self._checked_at <= RELOAD_CHECK_SECONDS:
+            return model
+        self._checked_at = now
+        version = current_version(self.model_dir)
+        if version is None:
+            return None
+        if model is None or model.catalog is not catalog or model.version != version:
+            try:
+                model = self._load(version, catalog)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Failed to load {self.name}: {e}")
+                return model
+            with self._lock:
+                self._model = model
+        return model